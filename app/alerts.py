@@ -0,0 +1,157 @@
+import asyncio
+import os
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+
+from .models import Mail
+
+# Alerts buffered per WebSocket before the client counts as too slow
+ALERT_QUEUE_SIZE = int(os.getenv("ALERT_QUEUE_SIZE", "100"))
+# Most alerts sent on one replay from the database
+ALERT_REPLAY_LIMIT = 500
+# How often a worker with WebSockets connected checks the database for new alerts. Only the
+# notifier's leader creates alerts, so on the other workers this is the delay they arrive with;
+# it doubles while nothing turns up, up to ALERT_POLL_MAX_SECONDS
+ALERT_POLL_SECONDS = float(os.getenv("ALERT_POLL_SECONDS", "2"))
+ALERT_POLL_MAX_SECONDS = float(os.getenv("ALERT_POLL_MAX_SECONDS", "30"))
+
+# Position in the alert stream: mails are notified in (notified_at, id) order
+Cursor = namedtuple("Cursor", ["notified_at", "id"])
+
+
+def format_cursor(cursor: Cursor) -> str:
+    return f"{cursor.notified_at.isoformat()}_{cursor.id}"
+
+
+def parse_cursor(value: str) -> Cursor:
+    notified_at, _, mail_id = value.rpartition("_")
+    return Cursor(datetime.fromisoformat(notified_at), int(mail_id))
+
+
+def make_alert(mail_id, eksu_ref, sender, recipient, threshold_hours, notified_at) -> dict:
+    return {
+        "id": mail_id,
+        "ref": eksu_ref,
+        "message": f"Mail {eksu_ref} from {sender} to {recipient} has not been attended to in {threshold_hours or 48} hours.",
+        "time": notified_at.isoformat() if notified_at else None,
+        "cursor": format_cursor(Cursor(notified_at, mail_id)),
+    }
+
+
+def load_alerts_since(db: Session, cursor: Cursor, limit: int = ALERT_REPLAY_LIMIT) -> list:
+    """Alerts after `cursor`, oldest first, for clients catching up."""
+    rows = db.query(
+        Mail.id, Mail.eksu_ref, Mail.sender, Mail.recipient, Mail.custom_threshold_hours, Mail.notified_at
+    ).filter(
+        Mail.notified == True,
+        Mail.notified_at.isnot(None),
+        or_(Mail.notified_at > cursor.notified_at,
+            and_(Mail.notified_at == cursor.notified_at, Mail.id > cursor.id))
+    ).order_by(Mail.notified_at.asc(), Mail.id.asc()).limit(limit).all()
+    return [make_alert(*row) for row in rows]
+
+
+def latest_cursor(db: Session) -> Cursor:
+    """Cursor of the newest alert, or of the start of the stream if there are none."""
+    row = db.query(Mail.notified_at, Mail.id).filter(
+        Mail.notified == True, Mail.notified_at.isnot(None)
+    ).order_by(Mail.notified_at.desc(), Mail.id.desc()).first()
+    return Cursor(*row) if row else Cursor(datetime.min, 0)
+
+
+class Subscription:
+    """One WebSocket's view of the alert stream."""
+
+    LAGGED = object()  # queued when alerts were dropped; the client must catch up from the database
+
+    def __init__(self, maxsize: int):
+        self.queue = asyncio.Queue(maxsize)
+        self.lagged = False
+        self.dropped = 0
+        self.resume_cursor = None  # just before the oldest dropped alert
+
+    def offer(self, alert: dict):
+        if self.lagged:
+            self.dropped += 1
+            return
+        try:
+            self.queue.put_nowait(alert)
+        except asyncio.QueueFull:
+            # Slow consumer: don't let it hold memory or stall the others. Drop its buffer
+            # and make it replay from its cursor once it gets to the LAGGED marker.
+            oldest = alert
+            while not self.queue.empty():
+                queued = self.queue.get_nowait()
+                if oldest is alert:
+                    oldest = queued
+                self.dropped += 1
+            dropped_from = parse_cursor(oldest["cursor"])
+            self.resume_cursor = Cursor(dropped_from.notified_at, dropped_from.id - 1)
+            self.dropped += 1
+            self.lagged = True
+            self.queue.put_nowait(self.LAGGED)
+
+
+class AlertBroadcaster:
+    """
+    Single fan-out point for overdue alerts. The notifier publishes once (from any thread);
+    every connected WebSocket gets the alerts through its own bounded queue.
+
+    The same alerts can be published twice on the notifier's worker, once by the notifier
+    and once by the database feed (app/main.py); anything at or before the last alert
+    fanned out is dropped, so subscribers see each alert once.
+    """
+
+    def __init__(self, queue_size: int = ALERT_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers = set()
+        self._loop = None
+        self.published = 0
+        self.last_cursor = None
+        self.subscribed = None  # set on every subscribe, for the database feed
+
+    def bind(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self.subscribed = asyncio.Event()
+
+    def subscribe(self) -> Subscription:
+        subscription = Subscription(self.queue_size)
+        self._subscribers.add(subscription)
+        if self.subscribed is not None:
+            self.subscribed.set()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self._subscribers.discard(subscription)
+
+    def has_subscribers(self) -> bool:
+        return bool(self._subscribers)
+
+    def publish(self, alerts: list):
+        """Thread-safe: hands the alerts to the event loop for fan-out."""
+        if alerts and self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._fan_out, list(alerts))
+
+    def _fan_out(self, alerts: list):
+        if self.last_cursor is not None:
+            alerts = [a for a in alerts if parse_cursor(a["cursor"]) > self.last_cursor]
+        if not alerts:
+            return
+        self.last_cursor = max(parse_cursor(a["cursor"]) for a in alerts)
+        self.published += len(alerts)
+        for subscription in list(self._subscribers):
+            for alert in alerts:
+                subscription.offer(alert)
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": len(self._subscribers),
+            "published": self.published,
+            "lagging": sum(1 for s in self._subscribers if s.lagged),
+        }
+
+
+broadcaster = AlertBroadcaster()
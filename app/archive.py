@@ -0,0 +1,104 @@
+import os
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, insert, literal, select
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import visitors
+
+from . import events, leases, metrics
+from .cache import MAIL_VIEWS, response_cache
+from .models import Mail, MailArchive, MailStatus
+
+# Completed mails sent longer ago than this move to mails_archive
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "365"))
+# Mails moved per transaction
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "1000"))
+# Lease held while a run is going, so two workers never archive at once (see app/leases.py)
+ARCHIVE_LEASE = "archive"
+
+MAIL_COLUMNS = [c.name for c in Mail.__table__.columns]
+
+
+def for_archive(clause):
+    """`clause`, written against Mail (e.g. listing.filter_clauses), on MailArchive instead."""
+    columns = MailArchive.__table__.c
+    return visitors.replacement_traverse(
+        clause, {}, lambda e: columns[e.name] if getattr(e, "table", None) is Mail.__table__ else None
+    )
+
+
+def _eligible(cutoff: datetime, below_id: int) -> list:
+    return [Mail.status == MailStatus.completed, Mail.date_sent < cutoff, Mail.id < below_id]
+
+
+def _archive_batch(db: Session, clauses: list, batch_size: int, now: datetime) -> int:
+    # In index order (status, date_sent, id), so each batch reads only the rows it moves
+    ids = db.execute(
+        select(Mail.id).where(*clauses).order_by(Mail.date_sent, Mail.id).limit(batch_size)
+    ).scalars().all()
+    if not ids:
+        return 0
+    batch = [Mail.id.in_(ids)]
+    db.execute(insert(MailArchive).from_select(
+        [*MAIL_COLUMNS, "archived_at"],
+        select(*(getattr(Mail, c) for c in MAIL_COLUMNS), literal(now)).where(*batch)
+    ))
+    events.record_archived(db, batch, now)
+    db.execute(delete(Mail).where(*batch), execution_options={"synchronize_session": False})
+    response_cache.invalidate(*MAIL_VIEWS, db=db)
+    db.commit()
+    return len(ids)
+
+
+def archive_mails(db: Session, older_than_days: int = ARCHIVE_AFTER_DAYS, batch_size: int = ARCHIVE_BATCH_SIZE,
+                  max_batches: int = None, now: datetime = None, progress=None) -> dict:
+    """
+    Move completed mails sent more than `older_than_days` ago from mails to mails_archive,
+    `batch_size` per transaction, until none are left or `max_batches` have been moved.
+    Every batch commits on its own, so a run can be stopped at any point and the next
+    one carries on. `progress(archived, batches)` is called after each batch.
+
+    The dashboard counters keep counting archived mails (archiving isn't deleting), so
+    they don't change. Raises ValueError if another run holds the archive lease.
+    """
+    now = now or datetime.utcnow()
+    if not leases.try_acquire(db, ARCHIVE_LEASE):
+        raise ValueError("an archive run is already in progress")
+    try:
+        # Never the newest mail: SQLite gives a new row max(id) + 1, so archiving the row
+        # with the highest id would let the next mail take an id the archive already has
+        below_id = db.query(func.max(Mail.id)).scalar() or 0
+        clauses = _eligible(now - timedelta(days=older_than_days), below_id)
+        started = time.perf_counter()
+        archived = batches = 0
+        while max_batches is None or batches < max_batches:
+            with metrics.span("archive.batch"):
+                moved = _archive_batch(db, clauses, batch_size, now)
+            if not moved:
+                break
+            archived += moved
+            batches += 1
+            if progress:
+                progress(archived, batches)
+            # Renewed per batch, so a long run keeps it; if it's gone, someone else took over
+            if moved < batch_size or not leases.try_acquire(db, ARCHIVE_LEASE):
+                break
+        remaining = db.query(func.count(Mail.id)).filter(*clauses).scalar()
+    finally:
+        leases.release(db, ARCHIVE_LEASE)
+    return {"archived": archived, "batches": batches, "remaining": remaining,
+            "seconds": round(time.perf_counter() - started, 2)}
+
+
+def archive_stats(db: Session, older_than_days: int = ARCHIVE_AFTER_DAYS, now: datetime = None) -> dict:
+    """Rows in each tier, and how many live mails an archive run would move now."""
+    now = now or datetime.utcnow()
+    below_id = db.query(func.max(Mail.id)).scalar() or 0
+    return {
+        "live": db.query(func.count(Mail.id)).scalar(),
+        "archived": db.query(func.count(MailArchive.id)).scalar(),
+        "eligible": db.query(func.count(Mail.id)).filter(
+            *_eligible(now - timedelta(days=older_than_days), below_id)).scalar(),
+        "older_than_days": older_than_days,
+    }
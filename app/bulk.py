@@ -0,0 +1,117 @@
+import os
+from collections import Counter
+from datetime import datetime
+
+from sqlalchemy import bindparam, update
+from sqlalchemy.orm import Session
+
+from .models import Mail
+from . import counters, events
+from .scheduler import compute_due_at
+from .utils import VALID_STATUSES
+
+# Ids per IN list / UPDATE statement; the whole batch still commits once
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "1000"))
+MAX_BULK_IDS = int(os.getenv("MAX_BULK_IDS", "50000"))
+
+# What a bulk call reports for each id
+UPDATED, UNCHANGED, NOT_FOUND = "updated", "unchanged", "not_found"
+
+
+def _chunks(ids: list, size: int = BULK_CHUNK_SIZE):
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+
+def resolve_ids(db: Session, ids: list = None, clauses: list = None) -> list:
+    """The ids a bulk call applies to: the given ids (deduplicated, in order) or every mail matching `clauses`."""
+    if ids is not None:
+        ids = list(dict.fromkeys(ids))
+    else:
+        ids = [i for (i,) in db.query(Mail.id).filter(*clauses).order_by(Mail.id)]
+    if len(ids) > MAX_BULK_IDS:
+        raise ValueError(f"{len(ids)} mails selected; at most {MAX_BULK_IDS} per call")
+    return ids
+
+
+def _load(db: Session, ids: list, lock: bool = False) -> dict:
+    """
+    id -> row for the ids that exist, one IN query per chunk. With `lock` the rows stay
+    locked (SELECT ... FOR UPDATE) until the caller commits, so counter deltas computed
+    from them can't be undone by another writer changing a row in between.
+    """
+    rows = {}
+    for chunk in _chunks(ids):
+        query = db.query(
+            Mail.id, Mail.name, Mail.sender, Mail.status, Mail.notified, Mail.custom_threshold_hours, Mail.date_sent
+        ).filter(Mail.id.in_(chunk)).order_by(Mail.id)
+        for row in query.with_for_update() if lock else query:
+            rows[row.id] = row
+    return rows
+
+
+def _results(ids: list, found: dict, changed: set) -> dict:
+    results = {UPDATED: [], UNCHANGED: [], NOT_FOUND: []}
+    for i in ids:
+        results[NOT_FOUND if i not in found else UPDATED if i in changed else UNCHANGED].append(i)
+    return results
+
+
+def _apply_chunked(db: Session, ids: list, values: dict):
+    for chunk in _chunks(ids):
+        db.execute(
+            update(Mail).where(Mail.id.in_(chunk)).values(**values),
+            execution_options={"synchronize_session": False}
+        )
+
+
+def set_status(db: Session, ids: list, status: str) -> dict:
+    """Move the mails to `status`, in one transaction. Raises ValueError for an unknown status."""
+    if status not in VALID_STATUSES:
+        raise ValueError(f"invalid status {status!r}; expected one of {sorted(VALID_STATUSES)}")
+    found = _load(db, ids, lock=True)
+    changed = [i for i, row in found.items() if counters.mail_state(row)[1] != status]
+
+    delta = Counter()
+    for i in changed:
+        before = counters.mail_state(found[i])
+        counters.diff(before, (before[0], status, *before[2:]), delta)
+    now = datetime.utcnow()
+    _apply_chunked(db, changed, {"status": status, "updated_at": now})
+    counters.apply(db, delta)
+    events.record(db, [events.for_mail(found[i], events.STATUS, now, status) for i in changed])
+    db.commit()
+    return _results(ids, found, set(changed))
+
+
+def set_threshold(db: Session, ids: list, hours: int) -> dict:
+    """Give the mails a custom overdue threshold (and the matching due_at), in one transaction."""
+    found = _load(db, ids, lock=True)
+    changed = [i for i, row in found.items() if row.custom_threshold_hours != hours]
+
+    delta = Counter()
+    for i in changed:
+        before = counters.mail_state(found[i])
+        counters.diff(before, (*before[:3], hours), delta)
+    # due_at differs per mail (date_sent + hours), so this is one executemany per chunk
+    now = datetime.utcnow()
+    for chunk in _chunks(changed):
+        db.execute(
+            update(Mail.__table__).where(Mail.__table__.c.id == bindparam("mail_id")),
+            [{"mail_id": i, "custom_threshold_hours": hours, "updated_at": now,
+              "due_at": compute_due_at(found[i].date_sent, hours)} for i in chunk]
+        )
+    counters.apply(db, delta)
+    events.record(db, [events.for_mail(found[i], events.THRESHOLD, now, hours) for i in changed])
+    db.commit()
+    return _results(ids, found, set(changed))
+
+
+def mark_reminders(db: Session, ids: list, now: datetime = None) -> dict:
+    """Stamp reminder_sent_at on the mails, in one transaction."""
+    now = now or datetime.utcnow()
+    found = _load(db, ids)
+    _apply_chunked(db, list(found), {"reminder_sent_at": now})
+    events.record(db, [events.for_mail(row, events.REMINDER, now) for row in found.values()])
+    db.commit()
+    return _results(ids, found, set(found))
@@ -0,0 +1,265 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi import Request, Response
+from sqlalchemy import event, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .models import CacheGeneration
+
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "300"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "256"))
+# /overdue-mails also changes as time passes (mails crossing 24h), not just on writes
+OVERDUE_TTL_SECONDS = float(os.getenv("CACHE_OVERDUE_TTL_SECONDS", "60"))
+# How often each worker reads the shared generations: the longest another worker's write
+# can go unseen by this worker's cache
+CACHE_SYNC_SECONDS = float(os.getenv("CACHE_SYNC_SECONDS", "2"))
+
+# Cached views of the mails table; writers invalidate the ones their change can show up in
+MAIL_VIEWS = ("mails", "notifications", "overdue")
+# Session.info key of the invalidations waiting for that session's commit
+PENDING_INVALIDATIONS = "cache_invalidations"
+
+
+class CacheBackend:
+    """
+    Storage for ResponseCache. Subclass this to put the cache somewhere shared (e.g. Redis)
+    and pass it to ResponseCache. Values are (etag, body, headers) tuples.
+    """
+
+    def get(self, key: str):
+        """The stored value, or None if missing or expired."""
+        raise NotImplementedError
+
+    def set(self, key: str, value, ttl: float):
+        raise NotImplementedError
+
+    def incr(self, key: str) -> int:
+        """Atomically add one to a counter (starting at 0) and return the new value."""
+        raise NotImplementedError
+
+    def counter(self, key: str) -> int:
+        raise NotImplementedError
+
+    def share_counters(self, bind, keys: list):
+        """Share the counters `keys` between workers through the database (backends that are shared already needn't)."""
+
+    def sync_counters(self):
+        """Pick up counters bumped by other workers, if share_counters() needs that."""
+
+    def bump_shared(self, db: Session, keys: list):
+        """Bump the shared copies of `keys` in db's transaction, if share_counters() keeps any."""
+
+    def stats(self) -> dict:
+        return {}
+
+
+class MemoryBackend(CacheBackend):
+    """
+    In-process LRU with per-entry TTL. Each worker process has its own entries.
+
+    Counters are per process too until share_counters() binds them to the
+    cache_generations table; from then on a bump through any worker reaches the others
+    on their next sync_counters() (app/main.py runs it every CACHE_SYNC_SECONDS).
+    """
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, value), least recently used first
+        self._counters = {}
+        self._lock = threading.Lock()
+        self.evictions = 0
+        self.bind = None  # engine holding the shared counters, if any
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def incr(self, key):
+        # Shared or not, this only moves the local copy: bump_shared() already moved the
+        # shared one by one in the committed transaction, so local never passes it
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def counter(self, key):
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def share_counters(self, bind, keys):
+        """Keep the counters `keys` in `bind`'s cache_generations table from now on."""
+        for key in keys:
+            try:
+                with bind.begin() as conn:
+                    conn.execute(insert(CacheGeneration).values(key=key, generation=0))
+            except IntegrityError:
+                pass  # another worker (or an earlier start) created it
+        with self._lock:
+            # Entries stored under the local counters could collide with the shared ones
+            self._entries.clear()
+            self._counters.clear()
+            self.bind = bind
+        self.sync_counters()
+
+    def sync_counters(self):
+        """Copy in the shared counters (a no-op until share_counters())."""
+        if self.bind is None:
+            return
+        with self.bind.connect() as conn:
+            rows = conn.execute(select(CacheGeneration.key, CacheGeneration.generation)).all()
+        with self._lock:
+            for key, value in rows:
+                self._counters[key] = max(self._counters.get(key, 0), value)
+
+    def bump_shared(self, db, keys):
+        if self.bind is not None:
+            db.execute(update(CacheGeneration).where(CacheGeneration.key.in_(keys))
+                       .values(generation=CacheGeneration.generation + 1))
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "max_entries": self.max_entries, "evictions": self.evictions}
+
+
+def _etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"'
+
+
+def _etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    # Weak comparison, as RFC 9110 asks for If-None-Match
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+class ResponseCache:
+    """
+    Read-through cache of rendered JSON responses, keyed by view + path + query string.
+
+    Invalidation is by generation: every view has a counter in the backend that is part
+    of its cache keys, and writers bump the counters of the views they affect. A reader
+    takes the generation before it queries, so a response computed across a write is
+    stored under the old generation and never served.
+
+    Every response carries an ETag of its body; a request whose If-None-Match still
+    matches gets a 304 with no body.
+    """
+
+    def __init__(self, backend: CacheBackend = None, ttl: float = CACHE_TTL_SECONDS, views: tuple = MAIL_VIEWS):
+        self.backend = backend or MemoryBackend()
+        self.ttl = ttl
+        self.views = views
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.invalidations = 0
+
+    def _key(self, view: str, request: Request) -> str:
+        query = "&".join(sorted(f"{k}={v}" for k, v in request.query_params.multi_items()))
+        # The path too: several endpoints can share a view (and its invalidation)
+        return f"{view}|{self.backend.counter('gen:' + view)}|{request.url.path}?{query}"
+
+    def respond(self, request: Request, view: str, render, ttl: float = None) -> Response:
+        """
+        Serve `view` for this request from the cache, or call `render()` (which returns
+        the JSON body as bytes, plus a dict of extra headers) and cache what it returns.
+        """
+        key, ttl, cached = self._lookup(request, view, ttl)
+        return self._respond(request, cached or self._store(key, ttl, *render()))
+
+    async def respond_async(self, request: Request, view: str, render, ttl: float = None) -> Response:
+        """respond() for a coroutine `render`."""
+        key, ttl, cached = self._lookup(request, view, ttl)
+        return self._respond(request, cached or self._store(key, ttl, *(await render())))
+
+    def _lookup(self, request: Request, view: str, ttl: float):
+        ttl = self.ttl if ttl is None else ttl
+        key = self._key(view, request)
+        cached = self.backend.get(key) if ttl > 0 else None
+        if cached:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return key, ttl, cached
+
+    def _store(self, key: str, ttl: float, body: bytes, headers: dict):
+        entry = (_etag(body), body, headers)
+        if ttl > 0:
+            self.backend.set(key, entry, ttl)
+        return entry
+
+    def _respond(self, request: Request, entry) -> Response:
+        etag, body, headers = entry
+        headers = {**headers, "ETag": etag, "Cache-Control": "private, no-cache"}
+        if _etag_matches(request.headers.get("if-none-match"), etag):
+            self.not_modified += 1
+            return Response(status_code=304, headers=headers)
+        return Response(body, media_type="application/json", headers=headers)
+
+    def share_generations(self, bind):
+        """Share the views' generations with the other workers through `bind` (see MemoryBackend)."""
+        self.backend.share_counters(bind, ["gen:" + view for view in self.views])
+
+    def invalidate(self, *views: str, db: Session = None):
+        """
+        Invalidate `views`. With `db`, as part of its next commit: the shared generations
+        are bumped in that transaction, in one statement, and this worker's once it has
+        committed; a rollback leaves them all alone. Call it before the commit.
+        """
+        if db is None:
+            self._bump(views)
+        else:
+            db.info.setdefault(PENDING_INVALIDATIONS, {}).setdefault(self, set()).update(views)
+
+    def _bump(self, views):
+        for view in views:
+            self.backend.incr("gen:" + view)
+        self.invalidations += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits, "misses": self.misses, "not_modified": self.not_modified,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else None,
+            "invalidations": self.invalidations, **self.backend.stats(),
+        }
+
+
+@event.listens_for(Session, "before_commit")
+def _bump_shared_generations(session):
+    for cache, views in session.info.get(PENDING_INVALIDATIONS, {}).items():
+        cache.backend.bump_shared(session, sorted("gen:" + view for view in views))
+
+
+@event.listens_for(Session, "after_commit")
+def _bump_local_generations(session):
+    for cache, views in session.info.pop(PENDING_INVALIDATIONS, {}).items():
+        cache._bump(views)
+
+
+@event.listens_for(Session, "after_rollback")
+def _drop_invalidations(session):
+    session.info.pop(PENDING_INVALIDATIONS, None)
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,139 @@
+from collections import Counter
+
+from sqlalchemy import delete, func, insert, update
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from .models import Mail, MailArchive, MailCounter, MailStatus
+
+# Scopes kept in mail_counters. A mail counts once under its status and its department;
+# a pending mail the notifier has flagged also counts under the overdue scopes.
+SCOPES = ("status", "department", "overdue", "overdue_department")
+
+
+def _status_value(status):
+    return status.value if isinstance(status, MailStatus) else status
+
+
+def mail_state(mail) -> tuple:
+    """The fields of a mail the counters depend on."""
+    return (mail.name, _status_value(mail.status), mail.notified, mail.custom_threshold_hours)
+
+
+def mail_keys(name, status, notified, custom_threshold_hours) -> list:
+    """(scope, key) of every counter a mail in this state adds one to."""
+    department = name if isinstance(name, str) else ""  # None, or NaN from an empty spreadsheet cell
+    keys = [("status", _status_value(status) or ""), ("department", department)]
+    if _status_value(status) == "pending" and notified:
+        bucket = "custom_threshold" if custom_threshold_hours else "default_threshold"
+        keys += [("overdue", "total"), ("overdue", bucket), ("overdue_department", department)]
+    return keys
+
+
+def diff(before: tuple = None, after: tuple = None, delta: Counter = None) -> Counter:
+    """Add the counter changes of one mail going from `before` to `after` (None = absent) to `delta`."""
+    delta = Counter() if delta is None else delta
+    for key in mail_keys(*before) if before else ():
+        delta[key] -= 1
+    for key in mail_keys(*after) if after else ():
+        delta[key] += 1
+    return delta
+
+
+def _upsert(db: Session):
+    """The single-statement upsert for this dialect, run with rows of {scope, key, value}, or None."""
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        stmt = sqlite_insert(MailCounter)
+        return stmt.on_conflict_do_update(
+            index_elements=["scope", "key"], set_={"value": MailCounter.value + stmt.excluded.value})
+    if dialect == "mysql":
+        stmt = mysql_insert(MailCounter)
+        return stmt.on_duplicate_key_update(value=MailCounter.value + stmt.inserted.value)
+    return None
+
+
+def _increment(db: Session, scope: str, key: str, by: int):
+    result = db.execute(update(MailCounter).where(
+        MailCounter.scope == scope, MailCounter.key == key).values(value=MailCounter.value + by))
+    if result.rowcount == 0:
+        db.execute(insert(MailCounter).values(scope=scope, key=key, value=by))
+
+
+def apply(db: Session, delta: Counter):
+    """
+    Write a delta from `diff` in the caller's transaction, so the counters commit (or
+    roll back) together with the change to the mails. One executemany of the upsert for
+    the whole delta; keys go in a fixed order so concurrent writers lock counter rows in
+    the same order.
+    """
+    rows = [{"scope": scope, "key": key, "value": by} for (scope, key), by in sorted(delta.items()) if by]
+    if not rows:
+        return
+    upsert = _upsert(db)
+    if upsert is not None:
+        db.execute(upsert, rows)
+    else:
+        for row in rows:
+            _increment(db, row["scope"], row["key"], row["value"])
+
+
+def track(db: Session, before: tuple = None, after: tuple = None):
+    apply(db, diff(before, after))
+
+
+def reset(db: Session):
+    """All mails are gone: every counter goes back to zero."""
+    db.execute(delete(MailCounter))
+
+
+def read(db: Session) -> Counter:
+    return Counter({(c.scope, c.key): c.value for c in db.query(MailCounter.scope, MailCounter.key, MailCounter.value)})
+
+
+def count_from_mails(db: Session) -> Counter:
+    """
+    The counters as they should be, computed from the mails table in one grouped pass.
+    Archived mails (mails_archive) still count: archiving moves mails, it doesn't remove them.
+    """
+    actual = Counter()
+    for model in (Mail, MailArchive):
+        rows = db.query(
+            model.name, model.status, model.notified, model.custom_threshold_hours, func.count()
+        ).group_by(model.name, model.status, model.notified, model.custom_threshold_hours).all()
+        for name, status, notified, custom, count in rows:
+            for key in mail_keys(name, status, notified, custom):
+                actual[key] += count
+    return actual
+
+
+def snapshot(db: Session) -> dict:
+    """Counters grouped by scope, zeros left out."""
+    stats = {scope: {} for scope in SCOPES}
+    for (scope, key), value in sorted(read(db).items()):
+        if value and scope in stats:
+            stats[scope][key] = value
+    stats["total"] = sum(stats["status"].values())
+    return stats
+
+
+def reconcile(db: Session, fix: bool = True) -> dict:
+    """
+    Compare the stored counters with a recount of the mails table and, if `fix`,
+    replace them with the recount. Returns the drift as {"scope/key": {"stored", "actual"}}.
+    """
+    stored, actual = read(db), count_from_mails(db)
+    drift = {
+        f"{scope}/{key}": {"stored": stored.get((scope, key), 0), "actual": actual.get((scope, key), 0)}
+        for scope, key in sorted(stored.keys() | actual.keys())
+        if stored.get((scope, key), 0) != actual.get((scope, key), 0)
+    }
+    if fix:
+        reset(db)
+        if actual:
+            db.execute(insert(MailCounter), [
+                {"scope": scope, "key": key, "value": value} for (scope, key), value in actual.items() if value
+            ])
+        db.commit()
+    return drift
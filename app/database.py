@@ -1,18 +1,41 @@
 import os
+import threading
+import time
 from dotenv import load_dotenv
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from . import metrics
 
 # Load environment variables from .env file only if DATABASE_URL is not set (for local development)
 if not os.getenv('DATABASE_URL'):
     load_dotenv()
-# --- Database Configuration ---
 
-# --- Database Configuration ---
-# Use DATABASE_URL if set (e.g., in production on Render), otherwise use SQLite for local testing
-database_url = os.getenv('DATABASE_URL')
-if database_url:
+# --- Pool / connection tuning (all optional) ---
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))  # seconds to wait for a free connection
+# Managed MySQL drops idle connections; recycle them before that happens and ping on checkout
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "280"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") not in ("0", "false", "False")
+# Per-statement limit for SELECTs on MySQL (max_execution_time); 0 = no limit
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "0"))
+# SQLite: how long a writer waits for a lock before "database is locked"
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+# Checkouts slower than this count as "slow" in the pool stats
+SLOW_CHECKOUT_MS = float(os.getenv("DB_SLOW_CHECKOUT_MS", "100"))
+
+
+def build_database_url(database_url: str = None) -> str:
+    """
+    SQLAlchemy URL for DATABASE_URL (e.g. in production on Render), or the local SQLite
+    file when it isn't set.
+    """
+    if not database_url:
+        return "sqlite:///./mail_tracking.db"
     # For production (Render), parse and reconstruct URL to handle SSL parameters properly
     from urllib.parse import urlparse, parse_qs, urlunparse
     parsed = urlparse(database_url)
@@ -24,12 +47,170 @@ if database_url:
     new_query = '&'.join([f"{k}={v[0]}" for k, v in query_params.items()])
     # Ensure the scheme includes the mysql-connector-python driver
     scheme = "mysql+mysqlconnector"
-    SQLALCHEMY_DATABASE_URL = urlunparse((scheme, parsed.netloc, parsed.path, parsed.params, new_query, parsed.fragment))
-else:
-    # For local testing, use SQLite
-    SQLALCHEMY_DATABASE_URL = "sqlite:///./mail_tracking.db"
+    return urlunparse((scheme, parsed.netloc, parsed.path, parsed.params, new_query, parsed.fragment))
+
+
+class PoolStats:
+    """How long requests wait for a pooled connection, and how often the pool runs dry."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.slow_checkouts = 0
+        self.timeouts = 0
+
+    def record(self, waited: float, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+                return
+            self.checkouts += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+            if waited * 1000 >= SLOW_CHECKOUT_MS:
+                self.slow_checkouts += 1
+
+    def snapshot(self, pool) -> dict:
+        capacity = pool.size() + max(pool._max_overflow, 0)
+        with self._lock:
+            return {
+                "pool_size": pool.size(),
+                "max_overflow": pool._max_overflow,
+                "checked_out": pool.checkedout(),
+                "idle": pool.checkedin(),
+                "saturation": round(pool.checkedout() / capacity, 3) if capacity else None,
+                "checkouts": self.checkouts,
+                "wait_ms_avg": round(self.wait_total / self.checkouts * 1000, 3) if self.checkouts else 0,
+                "wait_ms_max": round(self.wait_max * 1000, 3),
+                "slow_checkouts": self.slow_checkouts,
+                "timeouts": self.timeouts,
+            }
+
+
+# Async drivers used for the same database by the async engine
+ASYNC_DRIVERS = {"sqlite": "aiosqlite", "mysql": "aiomysql"}
+
+
+def build_async_database_url(url: str = None) -> str:
+    """The async-driver version of a sync database URL (aiosqlite / aiomysql)."""
+    parsed = make_url(url or SQLALCHEMY_DATABASE_URL)
+    backend = parsed.get_backend_name()
+    return parsed.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend]}").render_as_string(hide_password=False)
+
+
+class _TimedCheckout:
+    """Pool mixin that records how long each checkout waited (including opening a connection)."""
+
+    stats = None  # PoolStats, set per engine by make_engine / make_async_engine
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            conn = super()._do_get()
+        except Exception:
+            self.stats.record(time.perf_counter() - started, timed_out=True)
+            raise
+        self.stats.record(time.perf_counter() - started)
+        return conn
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+class TimedQueuePool(_TimedCheckout, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(_TimedCheckout, AsyncAdaptedQueuePool):
+    pass
+
+
+def _sqlite_pragmas(dbapi_conn, connection_record):
+    cursor = dbapi_conn.cursor()
+    # WAL: readers don't block on the notifier / uploads writing, and vice versa
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")  # safe with WAL, far fewer fsyncs
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.close()
+
+
+def _mysql_session_settings(dbapi_conn, connection_record):
+    cursor = dbapi_conn.cursor()
+    cursor.execute(f"SET SESSION max_execution_time = {DB_STATEMENT_TIMEOUT_MS}")
+    cursor.close()
+
+
+def _engine_options(url: str, poolclass) -> dict:
+    options = {
+        "poolclass": poolclass,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+    parsed = make_url(url)
+    if parsed.get_backend_name() == "sqlite":
+        if parsed.get_driver_name() == "pysqlite":
+            # Sessions are used from worker threads (uploads, notifier), never concurrently
+            options["connect_args"] = {"check_same_thread": False}
+        if parsed.database in (None, "", ":memory:"):
+            # Every pooled connection would get its own empty database; keep SQLAlchemy's default
+            options = {k: v for k, v in options.items() if k == "connect_args"}
+    return options
+
+
+def _instrument(sync_engine):
+    if isinstance(sync_engine.pool, _TimedCheckout):
+        sync_engine.pool.stats = PoolStats()
+    metrics.watch_engine(sync_engine)
+    if sync_engine.dialect.name == "sqlite":
+        event.listen(sync_engine, "connect", _sqlite_pragmas)
+    elif sync_engine.dialect.name == "mysql" and DB_STATEMENT_TIMEOUT_MS:
+        event.listen(sync_engine, "connect", _mysql_session_settings)
+
+
+def make_engine(url: str = None, **overrides):
+    """
+    Engine with the pool settings above. Shared by the app and migrate_db.py;
+    keyword arguments override the defaults (e.g. echo=True).
+    """
+    url = url or SQLALCHEMY_DATABASE_URL
+    new_engine = create_engine(url, **{**_engine_options(url, TimedQueuePool), **overrides})
+    _instrument(new_engine)
+    return new_engine
+
+
+def make_async_engine(url: str = None, **overrides):
+    """Async engine (aiosqlite / aiomysql) with the same pool settings and pragmas."""
+    url = url or build_async_database_url()
+    new_engine = create_async_engine(url, **{**_engine_options(url, TimedAsyncQueuePool), **overrides})
+    _instrument(new_engine.sync_engine)
+    return new_engine
+
+
+def pool_stats(target_engine=None) -> dict:
+    target_engine = target_engine or engine
+    pool = getattr(target_engine, "sync_engine", target_engine).pool
+    stats = getattr(pool, "stats", None)
+    return stats.snapshot(pool) if stats else {}
+
+
+# --- Database Configuration ---
+# Use DATABASE_URL if set (e.g., in production on Render), otherwise use SQLite for local testing
+database_url = os.getenv('DATABASE_URL')
+SQLALCHEMY_DATABASE_URL = build_database_url(database_url)
 
 # --- Create the engine ---
-engine = create_engine(SQLALCHEMY_DATABASE_URL)
+engine = make_engine(SQLALCHEMY_DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Same database through an async driver, for the read endpoints
+async_engine = make_async_engine(build_async_database_url(SQLALCHEMY_DATABASE_URL))
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
 Base = declarative_base()
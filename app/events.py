@@ -0,0 +1,193 @@
+import math
+from datetime import datetime
+
+from sqlalchemy import String, and_, case, func, insert, literal, select, type_coerce
+from sqlalchemy.orm import Session, aliased
+
+from .models import Mail, MailEvent, MailStatus
+
+# Event kinds; `value` holds what the event set
+CREATED = "created"        # value: the status it arrived with
+STATUS = "status"          # value: the new status
+MATCHED = "matched"        # value: id of the reply that completed it
+NOTIFIED = "notified"      # overdue alert raised
+REMINDER = "reminder"      # reminder sent
+THRESHOLD = "threshold"    # value: custom threshold hours
+DELETED = "deleted"
+ARCHIVED = "archived"      # moved to mails_archive (app/archive.py)
+
+# Turnaround report: which event column to group by, and the percentiles it shows
+TURNAROUND_GROUPS = {"department": MailEvent.department, "sender": MailEvent.sender}
+PERCENTILES = (50, 90, 95)
+
+
+def _text(value):
+    # None, or NaN from an empty spreadsheet cell, is stored as NULL
+    return value if isinstance(value, str) else None
+
+
+def _status_value(status):
+    return status.value if isinstance(status, MailStatus) else status
+
+
+def event(mail_id: int, kind: str, at: datetime, value=None, department=None, sender=None) -> dict:
+    """One mail_events row, ready for record()."""
+    value = _status_value(value)
+    return {"mail_id": mail_id, "kind": kind, "at": at, "value": None if value is None else str(value),
+            "department": _text(department), "sender": _text(sender)}
+
+
+def for_mail(mail, kind: str, at: datetime, value=None) -> dict:
+    """An event for a Mail (or any row with id, name and sender)."""
+    return event(mail.id, kind, at, value, mail.name, mail.sender)
+
+
+def record(db: Session, events: list):
+    """Append events in the caller's transaction, one executemany for the whole batch."""
+    if events:
+        db.execute(insert(MailEvent).execution_options(render_nulls=True), events)
+
+
+def _record_for_matching(db: Session, kind: str, model, clauses, now: datetime):
+    db.execute(insert(MailEvent).from_select(
+        ["mail_id", "kind", "at", "department", "sender"],
+        select(model.id, literal(kind), literal(now), model.name, model.sender).where(*clauses)
+    ))
+
+
+def record_deleted(db: Session, clauses: list = (), now: datetime = None, model=Mail):
+    """A `deleted` event for every mail matching `clauses`, written by one INSERT ... SELECT."""
+    _record_for_matching(db, DELETED, model, clauses, now or datetime.utcnow())
+
+
+def record_archived(db: Session, clauses: list, now: datetime = None):
+    """An `archived` event for every mail matching `clauses` (call before they're moved)."""
+    _record_for_matching(db, ARCHIVED, Mail, clauses, now or datetime.utcnow())
+
+
+def _fresh_state() -> dict:
+    return {"status": None, "notified": False, "reminder_sent_at": None,
+            "custom_threshold_hours": None, "matched_to_id": None, "deleted": False, "archived": False}
+
+
+def history(db: Session, mail_id: int, now: datetime = None):
+    """
+    Replay a mail's events: the events themselves plus the time it spent in each status.
+    None if the mail has no events.
+
+    SQLite hands out the ids of deleted mails again (after /mails/all), so a `created`
+    event following a `deleted` (or `archived`) one starts a new mail's history.
+    """
+    now = now or datetime.utcnow()
+    rows = db.query(MailEvent.kind, MailEvent.at, MailEvent.value).filter(
+        MailEvent.mail_id == mail_id
+    ).order_by(MailEvent.id).all()
+    if not rows:
+        return None
+
+    events, states, current = [], [], _fresh_state()
+    for kind, at, value in rows:
+        if kind == CREATED and (current["deleted"] or current["archived"]):
+            events, states, current = [], [], _fresh_state()
+        events.append({"kind": kind, "at": at, "value": value})
+        if kind in (CREATED, STATUS) and value != current["status"]:
+            if states:
+                states[-1]["until"] = at
+            states.append({"status": value, "from": at, "until": None})
+            current["status"] = value
+        elif kind == NOTIFIED:
+            current["notified"] = True
+        elif kind == REMINDER:
+            current["reminder_sent_at"] = at
+        elif kind == THRESHOLD:
+            current["custom_threshold_hours"] = int(value) if value else None
+        elif kind == MATCHED:
+            current["matched_to_id"] = int(value)
+        elif kind == ARCHIVED:
+            current["archived"] = True
+        elif kind == DELETED:
+            current["deleted"] = True
+            if states and states[-1]["until"] is None:
+                states[-1]["until"] = at
+    for state in states:
+        state["hours"] = round(((state["until"] or now) - state["from"]).total_seconds() / 3600, 2)
+    return {"mail_id": mail_id, "current": current, "states": states, "events": events}
+
+
+def _percentile(ordered: list, p: int) -> float:
+    # Nearest-rank
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+
+def _summary(hours: list) -> dict:
+    hours.sort()
+    return {
+        "count": len(hours),
+        "mean_hours": round(sum(hours) / len(hours), 2),
+        **{f"p{p}_hours": round(_percentile(hours, p), 2) for p in PERCENTILES},
+        "max_hours": round(hours[-1], 2),
+    }
+
+
+def turnaround(db: Session, by: str = "department", date_from: datetime = None, date_to: datetime = None) -> dict:
+    """
+    Hours from a mail's arrival (its `created` event) to completion, for completions in
+    [date_from, date_to), overall and per department or sender. Reads only mail_events.
+    """
+    group = TURNAROUND_GROUPS[by]
+    created = aliased(MailEvent)
+    # The mail's latest arrival before the completion (ids can be reused, see history())
+    arrived_at = (
+        select(created.at)
+        .where(created.mail_id == MailEvent.mail_id, created.kind == CREATED, created.id < MailEvent.id)
+        .order_by(created.id.desc()).limit(1).scalar_subquery()
+    )
+    window = [MailEvent.kind == STATUS, MailEvent.value == MailStatus.completed.value]
+    if date_from:
+        window.append(MailEvent.at >= date_from)
+    if date_to:
+        window.append(MailEvent.at < date_to)
+    rows = db.execute(select(group, MailEvent.at, arrived_at).where(*window))
+
+    overall, groups = [], {}
+    for key, completed_at, created_at in rows:
+        if created_at is None:
+            continue
+        hours = max((completed_at - created_at).total_seconds(), 0) / 3600
+        overall.append(hours)
+        groups.setdefault(key or "", []).append(hours)
+    return {
+        "by": by,
+        "overall": _summary(overall) if overall else {"count": 0},
+        "groups": [{by: key, **_summary(hours)} for key, hours in sorted(groups.items())],
+    }
+
+
+def backfill(db: Session) -> int:
+    """
+    Seed mail_events from the mails table for history written before the log existed:
+    arrival, completion (when the response date is known), notification and reminder.
+    Does nothing if there are events already. Returns the number of events written.
+    """
+    if db.query(MailEvent.id).first():
+        return 0
+    status = type_coerce(Mail.status, String)  # the stored string, not the Enum
+    completed = and_(Mail.status == MailStatus.completed, Mail.response_date.isnot(None))
+    arrived = func.coalesce(Mail.date_sent, Mail.created_at)
+    columns = ["mail_id", "kind", "at", "value", "department", "sender"]
+    statements = [
+        # A mail completed by a known reply arrived pending
+        select(Mail.id, literal(CREATED), arrived,
+               case((completed, MailStatus.pending.value), else_=status), Mail.name, Mail.sender),
+        select(Mail.id, literal(STATUS), Mail.response_date, literal(MailStatus.completed.value),
+               Mail.name, Mail.sender).where(completed),
+        select(Mail.id, literal(NOTIFIED), Mail.notified_at, literal(None), Mail.name, Mail.sender)
+        .where(Mail.notified_at.isnot(None)),
+        select(Mail.id, literal(REMINDER), Mail.reminder_sent_at, literal(None), Mail.name, Mail.sender)
+        .where(Mail.reminder_sent_at.isnot(None)),
+    ]
+    written = 0
+    for statement in statements:
+        written += db.execute(insert(MailEvent).from_select(columns, statement)).rowcount
+    db.commit()
+    return written
@@ -0,0 +1,123 @@
+import csv
+import heapq
+import io
+import itertools
+import json
+import tempfile
+from datetime import datetime
+
+import openpyxl
+from sqlalchemy import select
+
+from .archive import for_archive
+from .database import SessionLocal
+from .listing import list_columns
+from .models import Mail, MailArchive
+
+# The upload layout first (the headers parse_excel_to_rows reads), so an export can be
+# uploaded again as is; the rest are extra columns the parser ignores
+EXPORT_COLUMNS = (
+    "name", "sender", "document", "recipient", "date_sent", "status", "response_date",
+    "eksu_ref", "custom_threshold_hours", "notified_at", "reminder_sent_at",
+)
+EXPORT_FORMATS = {
+    "csv": "text/csv",
+    "ndjson": "application/x-ndjson",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+# Rows fetched per round trip (server-side cursor on MySQL) and per chunk written out
+EXPORT_BATCH_SIZE = 1000
+DATE_SENT = EXPORT_COLUMNS.index("date_sent")
+
+
+def _tier_rows(model, clauses: list):
+    """One tier's matching mails in (date_sent, id) order, each row ending with its id."""
+    # Own session: this runs while the response streams, after the request's session is gone
+    db = SessionLocal()
+    try:
+        query = (
+            select(*list_columns(EXPORT_COLUMNS, model=model), model.id)
+            .where(*clauses).order_by(model.date_sent, model.id)
+        )
+        for partition in db.execute(query.execution_options(yield_per=EXPORT_BATCH_SIZE)).partitions():
+            yield from partition
+    finally:
+        db.close()
+
+
+def _date_order(row):
+    # NULLs first, as ORDER BY date_sent puts them on both backends
+    date_sent = row[DATE_SENT]
+    return date_sent is not None, date_sent or datetime.min, row[-1]
+
+
+def _rows(clauses: list, include_archived: bool = True):
+    """
+    Matching mails in date order, streamed from the database EXPORT_BATCH_SIZE at a time.
+    With `include_archived`, mails_archive is streamed alongside and merged in.
+    """
+    tiers = [_tier_rows(Mail, clauses)]
+    if include_archived:
+        tiers.append(_tier_rows(MailArchive, [for_archive(c) for c in clauses]))
+    rows = heapq.merge(*tiers, key=_date_order)
+    while partition := [row[:-1] for row in itertools.islice(rows, EXPORT_BATCH_SIZE)]:
+        yield partition
+
+
+def _csv_value(v):
+    if v is None:
+        return ""
+    if isinstance(v, datetime):
+        return v.isoformat(sep=" ")
+    return v
+
+
+def _xlsx_value(v):
+    # Excel stores times to the millisecond; keep exact microseconds as text so they round-trip
+    if isinstance(v, datetime) and v.microsecond:
+        return v.isoformat(sep=" ")
+    return v
+
+
+def _json_value(v):
+    return v.isoformat() if isinstance(v, datetime) else v
+
+
+def export_csv(clauses: list, include_archived: bool = True):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(EXPORT_COLUMNS)
+    for partition in _rows(clauses, include_archived):
+        writer.writerows([_csv_value(v) for v in row] for row in partition)
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+    yield buf.getvalue()
+
+
+def export_ndjson(clauses: list, include_archived: bool = True):
+    for partition in _rows(clauses, include_archived):
+        yield "".join(
+            json.dumps({k: _json_value(v) for k, v in zip(EXPORT_COLUMNS, row)}, separators=(",", ":")) + "\n"
+            for row in partition
+        )
+
+
+def export_xlsx(clauses: list, include_archived: bool = True, chunk_size: int = 64 * 1024):
+    # Write-only mode keeps rows on disk, not in memory; the zip can only be finished
+    # at the end, so it is built in a temp file and streamed from there
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet("mails")
+    sheet.append(EXPORT_COLUMNS)
+    for partition in _rows(clauses, include_archived):
+        for row in partition:
+            sheet.append([_xlsx_value(v) for v in row])
+    with tempfile.TemporaryFile() as out:
+        workbook.save(out)
+        out.seek(0)
+        while chunk := out.read(chunk_size):
+            yield chunk
+
+
+def export_stream(fmt: str, clauses: list, include_archived: bool = True):
+    return {"csv": export_csv, "ndjson": export_ndjson, "xlsx": export_xlsx}[fmt](clauses, include_archived)
@@ -0,0 +1,213 @@
+import csv
+import io
+import json
+import math
+import os
+import shutil
+import tempfile
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_, update
+from sqlalchemy.orm import Session
+
+from .database import SessionLocal
+from .leases import WORKER_ID
+from .models import UploadJob, UploadJobError
+from . import utils
+
+# Uploads waiting for a worker are parked here until their job runs
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR", tempfile.gettempdir())
+# Spool files are named upload-job-<job id>.<ext>, so the recovery sweep can tell whose they are
+SPOOL_PREFIX = "upload-job-"
+# How often a worker marks its queued/running jobs as still alive
+JOB_HEARTBEAT_SECONDS = float(os.getenv("UPLOAD_JOB_HEARTBEAT_SECONDS", "30"))
+# Jobs not marked alive for this long belong to a worker that has stopped (crash, restart)
+JOB_STALE_SECONDS = float(os.getenv("UPLOAD_JOB_STALE_SECONDS", "120"))
+ACTIVE = ("queued", "running")
+
+job_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("UPLOAD_JOB_WORKERS", "2")), thread_name_prefix="upload-job"
+)
+
+
+def _json_value(v):
+    if isinstance(v, datetime):
+        return v.isoformat()
+    if isinstance(v, float) and math.isnan(v):
+        return None
+    return v
+
+
+def _save_errors(db: Session, job_id: str, errors: list):
+    if errors:
+        db.add_all(UploadJobError(
+            job_id=job_id,
+            row_number=e["row"],
+            error=e["error"],
+            data=json.dumps({k: _json_value(v) for k, v in e["data"].items()}, default=str),
+        ) for e in errors)
+        errors.clear()
+
+
+def _move_job(db: Session, job_id: str, from_status: str, **values) -> bool:
+    """
+    Update a job of this worker's that is still `from_status`, and commit. False if it isn't
+    (recover_jobs() may have failed it meanwhile, and that must stick).
+    """
+    result = db.execute(
+        update(UploadJob)
+        .where(UploadJob.id == job_id, UploadJob.status == from_status, UploadJob.worker == WORKER_ID)
+        .values(**values),
+        execution_options={"synchronize_session": False}
+    )
+    db.commit()
+    return result.rowcount == 1
+
+
+def _run_job(job_id: str, path: str, filename: str):
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        if not _move_job(db, job_id, "queued", status="running", started_at=now, heartbeat_at=now):
+            # Given up on by recover_jobs() while it waited (this worker stopped heartbeating)
+            return
+        job = db.get(UploadJob, job_id)
+        errors = []
+
+        def progress(totals):
+            # Runs after each batch has been committed
+            job.rows_parsed = totals["count"]
+            job.inserted = totals["inserted"]
+            job.updated = totals["updated"]
+            job.matched = totals["matched"]
+            job.failed = totals["failed"]
+            job.heartbeat_at = datetime.utcnow()
+            _save_errors(db, job_id, errors)
+            db.commit()
+
+        try:
+            with open(path, "rb") as f:
+                utils.ingest_upload(f, filename, db, errors=errors, progress=progress)
+            outcome = {"status": "completed"}
+        except Exception as e:
+            traceback.print_exc()
+            db.rollback()
+            outcome = {"status": "failed", "error": str(e)}
+        if not _move_job(db, job_id, "running", finished_at=datetime.utcnow(), **outcome):
+            print(f"⚠️ Upload job {job_id} was marked failed while it ran; leaving it failed.")
+    finally:
+        db.close()
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def submit_upload(file_like, filename: str, db: Session) -> UploadJob:
+    """
+    Spool the upload to disk, record a queued job and hand it to the worker pool.
+    """
+    job = UploadJob(id=uuid.uuid4().hex, filename=filename, status="queued",
+                    worker=WORKER_ID, heartbeat_at=datetime.utcnow())
+    path = os.path.join(UPLOAD_SPOOL_DIR, SPOOL_PREFIX + job.id + os.path.splitext(filename)[1])
+    with open(path, "wb") as spooled:
+        shutil.copyfileobj(file_like, spooled)
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    job_executor.submit(_run_job, job.id, path, filename)
+    return job
+
+
+def touch_jobs(db: Session, now: datetime = None) -> int:
+    """Mark this worker's queued and running jobs as alive. Returns how many it has."""
+    result = db.execute(
+        update(UploadJob).where(UploadJob.worker == WORKER_ID, UploadJob.status.in_(ACTIVE))
+        .values(heartbeat_at=now or datetime.utcnow()),
+        execution_options={"synchronize_session": False}
+    )
+    db.commit()
+    return result.rowcount
+
+
+def recover_jobs(db: Session, now: datetime = None) -> int:
+    """
+    Fail the queued/running jobs whose worker stopped marking them alive (it crashed or was
+    restarted, so they will never finish), and delete spool files no live job is waiting on.
+    Safe to run from every worker: live workers keep their own jobs fresh with touch_jobs().
+    Returns how many jobs were failed.
+    """
+    now = now or datetime.utcnow()
+    result = db.execute(
+        update(UploadJob)
+        .where(UploadJob.status.in_(ACTIVE),
+               or_(UploadJob.heartbeat_at.is_(None),
+                   UploadJob.heartbeat_at < now - timedelta(seconds=JOB_STALE_SECONDS)))
+        .values(status="failed", finished_at=now,
+                error="The server stopped before this upload finished; upload the file again."),
+        execution_options={"synchronize_session": False}
+    )
+    db.commit()
+    if result.rowcount:
+        print(f"⚠️ Marked {result.rowcount} interrupted upload job(s) as failed.")
+
+    # A spool file is only needed until its job finishes. Files without a job row yet may be
+    # a submit that hasn't committed; those are left until they're as old as a stale job.
+    active = {job_id for (job_id,) in db.query(UploadJob.id).filter(UploadJob.status.in_(ACTIVE))}
+    for entry in os.scandir(UPLOAD_SPOOL_DIR):
+        if not entry.name.startswith(SPOOL_PREFIX) or not entry.is_file():
+            continue
+        job_id = os.path.splitext(entry.name[len(SPOOL_PREFIX):])[0]
+        if job_id in active or entry.stat().st_mtime > time.time() - JOB_STALE_SECONDS:
+            continue
+        try:
+            os.remove(entry.path)
+        except OSError:
+            pass  # another worker's sweep got there first
+    return result.rowcount
+
+
+def job_status(job: UploadJob) -> dict:
+    elapsed = None
+    if job.started_at:
+        elapsed = ((job.finished_at or datetime.utcnow()) - job.started_at).total_seconds()
+    return {
+        "id": job.id,
+        "filename": job.filename,
+        "status": job.status,
+        "rows_parsed": job.rows_parsed,
+        "inserted": job.inserted,
+        "updated": job.updated,
+        "matched": job.matched,
+        "failed": job.failed,
+        "error": job.error,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+        "elapsed_seconds": elapsed,
+        "rows_per_second": round(job.rows_parsed / elapsed, 1) if elapsed else None,
+    }
+
+
+def error_report_csv(job_id: str):
+    """Yield the job's failed rows as CSV: row number, error, then the parsed columns."""
+    columns = ["name", "sender", "document", "recipient", "date_sent", "status", "response_date"]
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(["row", "error"] + columns)
+    # Own session: this runs while the response streams, after the request's session is gone
+    db = SessionLocal()
+    try:
+        query = db.query(UploadJobError).filter(
+            UploadJobError.job_id == job_id
+        ).order_by(UploadJobError.row_number)
+        for e in query.yield_per(1000):
+            data = json.loads(e.data or "{}")
+            writer.writerow([e.row_number, e.error] + [data.get(c) for c in columns])
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+    finally:
+        db.close()
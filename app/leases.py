@@ -0,0 +1,145 @@
+import asyncio
+import os
+import socket
+import traceback
+import uuid
+from datetime import datetime, timedelta
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import case, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from .models import JobLease
+
+# How long a leader's lease lasts without renewal, i.e. the longest failover after a worker
+# dies. Must be well above the clock difference between replicas.
+LEASE_SECONDS = float(os.getenv("LEADER_LEASE_SECONDS", "30"))
+# This process, as it appears in job_leases.holder
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+def try_acquire(db: Session, name: str, holder: str = WORKER_ID, seconds: float = LEASE_SECONDS,
+                now: datetime = None) -> bool:
+    """
+    Take or renew lease `name` for `seconds`. True if `holder` has it afterwards.
+
+    One conditional UPDATE in its own short transaction (like app/refs.py): it succeeds
+    only for the current holder or once the lease has expired, so two workers can never
+    both get it. The first worker to ask for a new lease creates its row.
+    """
+    now = now or datetime.utcnow()
+    engine = db.get_bind()
+    while True:
+        with engine.begin() as conn:
+            result = conn.execute(
+                update(JobLease)
+                .where(JobLease.name == name, or_(JobLease.holder == holder, JobLease.expires_at < now))
+                # acquired_at first: MySQL evaluates SET left to right, so it must see the old holder
+                .ordered_values(
+                    (JobLease.acquired_at, case((JobLease.holder == holder, JobLease.acquired_at), else_=now)),
+                    (JobLease.holder, holder),
+                    (JobLease.expires_at, now + timedelta(seconds=seconds)),
+                )
+            )
+            if result.rowcount:
+                return True
+            if conn.execute(select(JobLease.name).where(JobLease.name == name)).first():
+                return False
+        try:
+            with engine.begin() as conn:
+                conn.execute(insert(JobLease).values(
+                    name=name, holder=holder, expires_at=now + timedelta(seconds=seconds), acquired_at=now
+                ))
+            return True
+        except IntegrityError:
+            pass  # another worker created it first; see whether it's still theirs
+
+
+def release(db: Session, name: str, holder: str = WORKER_ID):
+    """Give the lease up (on shutdown) so another worker can take over straight away."""
+    with db.get_bind().begin() as conn:
+        conn.execute(
+            update(JobLease).where(JobLease.name == name, JobLease.holder == holder)
+            .values(holder=None, expires_at=datetime.utcnow())
+        )
+
+
+def lease_status(db: Session, name: str):
+    lease = db.get(JobLease, name)
+    if lease is None:
+        return None
+    return {"name": lease.name, "holder": lease.holder, "expires_at": lease.expires_at,
+            "acquired_at": lease.acquired_at}
+
+
+class Leader:
+    """
+    Runs a background job in exactly one worker. Every worker runs a Leader for the job,
+    and each tries to take or renew the job's lease every `seconds / 3`. The holder runs
+    the job; a worker that can't renew in time stops it; when the leader dies its lease
+    runs out and the next worker to try takes over.
+    """
+
+    def __init__(self, name: str, seconds: float = LEASE_SECONDS, holder: str = WORKER_ID):
+        self.name = name
+        self.seconds = seconds
+        self.holder = holder
+        self.is_leader = False
+        self.terms = 0  # times this worker has become leader
+        self._valid_until = 0.0  # loop time our lease is known to be good until
+        self._task = None
+
+    def _renew(self, open_session) -> bool:
+        db = open_session()
+        try:
+            return try_acquire(db, self.name, self.holder, self.seconds)
+        finally:
+            db.close()
+
+    def _release(self, open_session):
+        db = open_session()
+        try:
+            release(db, self.name, self.holder)
+        finally:
+            db.close()
+
+    async def run(self, job, open_session):
+        """
+        `job()` makes the coroutine to run while this worker leads (it's cancelled when the
+        lease is lost); `open_session()` gives a Session for the lease updates.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                started = loop.time()
+                try:
+                    renewed = await run_in_threadpool(self._renew, open_session)
+                    self._valid_until = started + self.seconds if renewed else 0.0
+                except Exception:
+                    # Can't reach the database: we stay leader only as long as the lease we have
+                    traceback.print_exc()
+                held = loop.time() < self._valid_until
+                if held and (self._task is None or self._task.done()):
+                    if self._task is not None:
+                        print(f"⚠️ {self.name} job stopped unexpectedly, restarting")
+                    elif not self.is_leader:
+                        self.terms += 1
+                        print(f"✅ {self.holder} is now running {self.name}.")
+                    self._task = asyncio.ensure_future(job())
+                elif not held and self._task is not None:
+                    print(f"⚠️ {self.holder} lost the {self.name} lease, stopping it.")
+                    await self._stop()
+                self.is_leader = held
+                await asyncio.sleep(self.seconds / 3)
+        finally:
+            await self._stop()
+            if self.is_leader:
+                self.is_leader = False
+                await run_in_threadpool(self._release, open_session)
+
+    async def _stop(self):
+        task, self._task = self._task, None
+        if task is not None and not task.done():
+            task.cancel()
+            await asyncio.wait({task})  # unlike `await task`, doesn't swallow our own cancellation
@@ -0,0 +1,119 @@
+import base64
+import json
+from datetime import datetime
+
+from sqlalchemy import String, or_, select, type_coerce
+from sqlalchemy.orm import Session
+
+from .models import Mail
+
+# Columns the mail list view shows (no created/updated bookkeeping)
+LIST_COLUMNS = (
+    "id", "eksu_ref", "name", "sender", "document", "recipient", "date_sent", "status",
+    "response_date", "custom_threshold_hours", "matched_to_id", "notified", "notified_at",
+    "reminder_sent_at",
+)
+
+# Every column, as the responses that serialized whole Mail objects had them
+MAIL_COLUMNS = tuple(c.name for c in Mail.__table__.columns)
+
+PAGE_SIZE = 200
+MAX_PAGE_SIZE = 1000
+
+
+def list_columns(names=LIST_COLUMNS, model=Mail) -> list:
+    # status as its stored string, so rows serialize without going through the Enum
+    return [type_coerce(model.status, String).label("status") if n == "status" else getattr(model, n) for n in names]
+
+
+def filter_clauses(status: str = None, sender: str = None, recipient: str = None,
+                   department: str = None, date_from: datetime = None, date_to: datetime = None) -> list:
+    """
+    WHERE clauses shared by the list endpoints. `department` is the uploaded name/department
+    column; date_from is inclusive and date_to exclusive, both on date_sent.
+    """
+    clauses = []
+    if status:
+        clauses.append(Mail.status == status)
+    if sender:
+        clauses.append(Mail.sender == sender)
+    if recipient:
+        clauses.append(Mail.recipient == recipient)
+    if department:
+        clauses.append(Mail.name == department)
+    if date_from:
+        clauses.append(Mail.date_sent >= date_from)
+    if date_to:
+        clauses.append(Mail.date_sent < date_to)
+    return clauses
+
+
+def encode_cursor(date_sent, mail_id) -> str:
+    raw = json.dumps([date_sent.isoformat() if date_sent else None, mail_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+    """Raises ValueError for anything that isn't a cursor from encode_cursor."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        date_sent, mail_id = json.loads(raw)
+        return (datetime.fromisoformat(date_sent) if date_sent else None), int(mail_id)
+    except Exception as e:
+        raise ValueError(f"invalid cursor: {cursor!r}") from e
+
+
+def list_page(db: Session, clauses: list, limit: int = PAGE_SIZE, cursor: str = None,
+              skip: int = 0, columns=LIST_COLUMNS):
+    """
+    One page of mails, newest first (date_sent DESC, id DESC), as (rows, next_cursor).
+
+    With a cursor the page starts right after it (keyset pagination), so every page costs
+    an index range scan of `limit` rows no matter how deep it is. `skip` is the old
+    OFFSET paging, kept for existing callers. Mails without a date_sent come last.
+    """
+    order = (Mail.date_sent.desc(), Mail.id.desc())
+    base = select(*list_columns(columns)).where(*clauses).order_by(*order)
+    if cursor:
+        after_date, after_id = decode_cursor(cursor)
+    else:
+        after_date, after_id = None, None
+
+    if skip:
+        rows = db.execute(base.offset(skip).limit(limit + 1)).all()
+    elif after_id is None or after_date is not None:
+        dated = base.where(Mail.date_sent.isnot(None))
+        if after_id is not None:
+            # (date_sent, id) < cursor, written so it stays a single range on the index
+            dated = dated.where(Mail.date_sent <= after_date,
+                                or_(Mail.date_sent < after_date, Mail.id < after_id))
+        rows = db.execute(dated.limit(limit + 1)).all()
+        if len(rows) <= limit:
+            undated = base.where(Mail.date_sent.is_(None))
+            rows += db.execute(undated.limit(limit + 1 - len(rows))).all()
+    else:
+        rows = db.execute(base.where(Mail.date_sent.is_(None), Mail.id < after_id).limit(limit + 1)).all()
+
+    keys = list(columns)
+    page = [dict(zip(keys, row)) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = page[-1]
+        next_cursor = encode_cursor(last["date_sent"], last["id"])
+    return page, next_cursor
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def select_rows(db: Session, query, columns=LIST_COLUMNS) -> list:
+    """Run a select(*list_columns(columns)) and return its rows as dicts."""
+    keys = list(columns)
+    return [dict(zip(keys, row)) for row in db.execute(query)]
+
+
+def rows_to_json(rows: list) -> str:
+    return json.dumps(rows, default=_json_default, separators=(",", ":"))
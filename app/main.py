@@ -1,14 +1,22 @@
-from fastapi_utils.tasks import repeat_every
 from datetime import datetime, timedelta
-from fastapi import FastAPI, UploadFile, File, Depends, HTTPException,  WebSocket
+from fastapi import FastAPI, UploadFile, File, Depends, HTTPException,  WebSocket, WebSocketDisconnect, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from app.database import SessionLocal, engine, Base
-from app import models, utils
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from app.database import AsyncSessionLocal, SessionLocal, async_engine, engine, Base, pool_stats
+from app import alerts, archive, bulk, counters, events, export, jobs, leases, listing, metrics, models, overdue, reminders, search, utils
+from app.cache import CACHE_SYNC_SECONDS, MAIL_VIEWS, OVERDUE_TTL_SECONDS, response_cache
+from app.scheduler import compute_due_at, load_deadlines, notify_due_mails, scheduler
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from pydantic import BaseModel
-import io
+from concurrent.futures import ThreadPoolExecutor
+import os
 import smtplib
 import asyncio
+import traceback
+import contextvars
 
 # Pydantic models for API
 class MailCreate(BaseModel):
@@ -22,12 +30,36 @@ class MailCreate(BaseModel):
 class MailStatusUpdate(BaseModel):
     status: str
 
-# Create tables in the database
-Base.metadata.create_all(bind=engine)
+# Bulk endpoints: either explicit ids or a /mails-style filter
+class MailFilter(BaseModel):
+    status: str = None
+    sender: str = None
+    recipient: str = None
+    department: str = None
+    date_from: datetime = None
+    date_to: datetime = None
+
+class BulkSelection(BaseModel):
+    ids: list[int] = None
+    filter: MailFilter = None
+
+class BulkStatusUpdate(BulkSelection):
+    status: str
+
+class BulkDurationUpdate(BulkSelection):
+    hours: int
 
 # Initialize FastAPI
 app = FastAPI(title="EKSU Mail Tracking System")
 
+# Create tables in the database when the server starts (not on import, so scripts and
+# benchmarks that import the app leave ./mail_tracking.db alone); migrate_db.py does the
+# same for existing deployments
+@app.on_event("startup")
+def create_tables():
+    Base.metadata.create_all(bind=engine)
+    search.ensure_index(engine)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -35,6 +67,14 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag"],
+)
+# Outermost, so latency includes every other middleware (see /metrics)
+app.add_middleware(metrics.MetricsMiddleware)
+
+# Worker pool for upload parsing/upserts, so they never block the event loop
+upload_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("UPLOAD_WORKERS", "2")), thread_name_prefix="upload"
 )
 
 # Dependency to get DB session
@@ -45,98 +85,359 @@ def get_db():
     finally:
         db.close()
 
+# Async session for the read endpoints: queries wait on the driver instead of holding a thread
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
 # ✅ Upload Excel or CSV file
 # ✅ Upload Excel or CSV file (with full error safety)
 @app.post("/upload")
-async def upload_excel(file: UploadFile = File(...), db: Session = Depends(get_db)):
+async def upload_excel(file: UploadFile = File(...), background: bool = False, db: Session = Depends(get_db)):
     try:
         if not file.filename.endswith((".xlsx", ".csv")):
             raise HTTPException(status_code=400, detail="Upload .xlsx or .csv only")
 
-        content = await file.read()
-        filelike = io.BytesIO(content)
-
-        rows = utils.parse_excel_to_rows(filelike)  # Parse Excel/CSV
-        utils.simple_match_and_upsert(rows, db)     # Insert/update records safely
-
-        return {"count": len(rows)}
+        if background:
+            # Queue it and return straight away; poll /upload/jobs/{id} for progress
+            job = await run_in_threadpool(jobs.submit_upload, file.file, file.filename, db)
+            return {"job_id": job.id, "status": job.status}
+
+        # Parse + upsert chunk by chunk off the event loop; the upload itself stays
+        # in Starlette's spooled temp file instead of being read into memory
+        # (in this request's context, so its SQL still counts towards the request's metrics)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            upload_executor, contextvars.copy_context().run, utils.ingest_upload, file.file, file.filename, db
+        )
 
     except Exception as e:
         # Detailed error message instead of generic 500
         raise HTTPException(status_code=500, detail=f"Upload failed: {str(e)}")
 
 
+@app.get("/upload/jobs/{job_id}")
+async def get_upload_job(job_id: str, db: AsyncSession = Depends(get_async_db)):
+    job = await db.get(models.UploadJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return jobs.job_status(job)
+
+@app.get("/upload/jobs/{job_id}/errors")
+async def download_upload_job_errors(job_id: str, db: AsyncSession = Depends(get_async_db)):
+    if not await db.get(models.UploadJob, job_id):
+        raise HTTPException(status_code=404, detail="Job not found")
+    return StreamingResponse(
+        jobs.error_report_csv(job_id),
+        media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="upload-{job_id}-errors.csv"'}
+    )
+
 # ✅ Get list of mails
+# Newest first. Pass the X-Next-Cursor response header back as ?cursor= for the next page;
+# skip= (offset paging) still works but gets slower the deeper it goes.
+# Cached responses carry an ETag; send it back as If-None-Match to get a 304 if nothing changed.
 @app.get("/mails")
-def list_mails(skip: int = 0, limit: int = 200, db: Session = Depends(get_db)):
-    return db.query(models.Mail).order_by(models.Mail.date_sent.desc()).offset(skip).limit(limit).all()
-
+async def list_mails(
+    request: Request,
+    skip: int = 0,
+    limit: int = Query(listing.PAGE_SIZE, ge=1, le=listing.MAX_PAGE_SIZE),
+    cursor: str = None,
+    status: str = None,
+    sender: str = None,
+    recipient: str = None,
+    department: str = None,
+    date_from: datetime = None,
+    date_to: datetime = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    async def render():
+        clauses = listing.filter_clauses(status, sender, recipient, department, date_from, date_to)
+        try:
+            rows, next_cursor = await db.run_sync(listing.list_page, clauses, limit, cursor, skip)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+        return listing.rows_to_json(rows).encode(), headers
+
+    return await response_cache.respond_async(request, "mails", render)
+
+# ✅ Search mails by words of the document subject, sender or recipient (prefixes match too),
+# best match first; takes the /mails filters. Declared before /mails/{mail_id}/... routes.
+@app.get("/mails/search")
+async def search_mails(
+    request: Request,
+    q: str,
+    limit: int = Query(search.SEARCH_LIMIT, ge=1, le=search.MAX_SEARCH_LIMIT),
+    skip: int = Query(0, ge=0),
+    status: str = None,
+    sender: str = None,
+    recipient: str = None,
+    department: str = None,
+    date_from: datetime = None,
+    date_to: datetime = None,
+    include_archived: bool = True,
+    db: AsyncSession = Depends(get_async_db)
+):
+    async def render():
+        clauses = listing.filter_clauses(status, sender, recipient, department, date_from, date_to)
+        try:
+            rows = await db.run_sync(search.search_mails, q, clauses, limit, skip, include_archived)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        return listing.rows_to_json(rows).encode(), {}
+
+    # Same data as /mails, so the same invalidation
+    return await response_cache.respond_async(request, "mails", render)
+
+# ✅ Export every mail matching the /mails filters as csv, ndjson or xlsx, streamed as it is read.
+# Columns start with the upload layout, so an export can be uploaded again. Archived mails
+# are included unless include_archived=false.
+@app.get("/export")
+def export_mails(
+    fmt: str = Query("csv", alias="format"),
+    status: str = None,
+    sender: str = None,
+    recipient: str = None,
+    department: str = None,
+    date_from: datetime = None,
+    date_to: datetime = None,
+    include_archived: bool = True,
+):
+    if fmt not in export.EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of {', '.join(export.EXPORT_FORMATS)}")
+    clauses = listing.filter_clauses(status, sender, recipient, department, date_from, date_to)
+    return StreamingResponse(
+        export.export_stream(fmt, clauses, include_archived),
+        media_type=export.EXPORT_FORMATS[fmt],
+        headers={"Content-Disposition": f'attachment; filename="mails-export.{fmt}"'}
+    )
+
+def notified_mails(db: Session, limit: int = listing.PAGE_SIZE, cursor: str = None):
+    """One page of notified pending mails, newest first, as (rows, next_cursor) - see listing.list_page."""
+    clauses = [models.Mail.notified == True, models.Mail.status == "pending"]
+    return listing.list_page(db, clauses, limit, cursor, columns=listing.MAIL_COLUMNS)
+
+# Notified mails, newest first, a page at a time: pass the X-Next-Cursor response header back
+# as ?cursor= for the next page, as with /mails. Rows are plain column tuples and the JSON is
+# encoded in the threadpool, so a big page doesn't hold up the event loop (and /ws) while it serializes.
 @app.get("/notifications")
-def get_notifications(db: Session = Depends(get_db)):
-    return db.query(models.Mail).filter(
-        models.Mail.notified == True,
-        models.Mail.status == "pending"
-    ).order_by(models.Mail.date_sent.desc()).all()
+async def get_notifications(
+    request: Request,
+    limit: int = Query(listing.PAGE_SIZE, ge=1, le=listing.MAX_PAGE_SIZE),
+    cursor: str = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    async def render():
+        try:
+            rows, next_cursor = await db.run_sync(notified_mails, limit, cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        headers = {"X-Next-Cursor": next_cursor} if next_cursor else {}
+        return (await run_in_threadpool(listing.rows_to_json, rows)).encode(), headers
+
+    return await response_cache.respond_async(request, "notifications", render)
+
+# Hit/miss numbers for the response cache
+@app.get("/cache/stats")
+def get_cache_stats():
+    return response_cache.stats()
+
+# Connection pool: checkout wait times and how close it is to running out
+@app.get("/db/pool")
+def get_pool_stats():
+    return {"sync": pool_stats(engine), "async": pool_stats(async_engine)}
+
+# Prometheus scrape endpoint: request latency per route, SQL per request, spans, plus the
+# pool / cache / alert numbers above as gauges
+@app.get("/metrics")
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+def _metric_gauges():
+    for name, target in (("sync", engine), ("async", async_engine)):
+        for key, value in pool_stats(target).items():
+            yield f"db_pool_{key}", {"engine": name}, value
+    for key, value in response_cache.stats().items():
+        yield f"response_cache_{key}", {}, value
+    for key, value in alerts.broadcaster.stats().items():
+        yield f"alerts_{key}", {}, value
+    yield "scheduler_runs", {}, scheduler.runs
+    # 1 on the worker running the notifier, 0 on the ones standing by
+    yield "leader", {"job": notifier_leader.name}, int(notifier_leader.is_leader)
+    yield "leader_terms", {"job": notifier_leader.name}, notifier_leader.terms
+
+metrics.register_gauges(_metric_gauges)
+
+# Sampling profiler, only with PROFILER_ENABLED=1. Start it, reproduce the slow thing, stop
+# it: the response is folded stacks for flamegraph.pl / speedscope.
+def _require_profiler():
+    if not metrics.PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiler is disabled (set PROFILER_ENABLED=1)")
+
+@app.post("/debug/profiler/start")
+def start_profiler(interval_ms: float = Query(10, ge=1), seconds: float = Query(metrics.PROFILER_MAX_SECONDS, gt=0)):
+    _require_profiler()
+    try:
+        metrics.profiler.start(interval_ms / 1000, seconds)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return metrics.profiler.status()
+
+@app.post("/debug/profiler/stop")
+def stop_profiler():
+    _require_profiler()
+    return PlainTextResponse(metrics.profiler.stop())
+
+@app.get("/debug/profiler")
+def get_profiler_status():
+    _require_profiler()
+    return metrics.profiler.status()
+
+# ✅ Bulk updates: one transaction, per-id results ({"updated": [...], "unchanged": [...], "not_found": [...]})
+# Declared before the /mails/{mail_id}/... routes so "bulk" isn't taken for an id.
+def _bulk_ids(db: Session, selection: BulkSelection) -> list:
+    if (selection.ids is None) == (selection.filter is None):
+        raise HTTPException(status_code=400, detail="Give either ids or filter")
+    clauses = listing.filter_clauses(**selection.filter.model_dump()) if selection.filter else None
+    try:
+        return bulk.resolve_ids(db, selection.ids, clauses)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.put("/mails/bulk/status")
+def bulk_update_status(update: BulkStatusUpdate, db: Session = Depends(get_db)):
+    ids = _bulk_ids(db, update)
+    response_cache.invalidate(*MAIL_VIEWS, db=db)
+    try:
+        results = bulk.set_status(db, ids, update.status)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return results
+
+@app.put("/mails/bulk/duration")
+def bulk_update_duration(update: BulkDurationUpdate, db: Session = Depends(get_db)):
+    if update.hours <= 0:
+        raise HTTPException(status_code=400, detail="hours must be positive")
+    ids = _bulk_ids(db, update)
+    response_cache.invalidate(*MAIL_VIEWS, db=db)
+    results = bulk.set_threshold(db, ids, update.hours)
+    scheduler.refresh()  # deadlines moved
+    return results
+
+@app.put("/mails/bulk/reminder-sent")
+def bulk_mark_reminder_sent(selection: BulkSelection, db: Session = Depends(get_db)):
+    ids = _bulk_ids(db, selection)
+    response_cache.invalidate(*MAIL_VIEWS, db=db)
+    results = bulk.mark_reminders(db, ids)
+    return results
 
 @app.put("/mails/{mail_id}/duration")
 def update_duration(mail_id: int, hours: int, db: Session = Depends(get_db)):
-    mail = db.query(models.Mail).filter(models.Mail.id == mail_id).first()
+    # Locked until commit, so the counter change below matches the row it was computed from
+    mail = db.query(models.Mail).filter(models.Mail.id == mail_id).with_for_update().first()
     if not mail:
         raise HTTPException(status_code=404, detail="Mail not found")
 
+    before = counters.mail_state(mail)
     mail.custom_threshold_hours = hours
+    mail.due_at = compute_due_at(mail.date_sent, hours)
     mail.updated_at = datetime.utcnow()
+    counters.track(db, before, counters.mail_state(mail))
+    events.record(db, [events.for_mail(mail, events.THRESHOLD, mail.updated_at, hours)])
+    response_cache.invalidate(*MAIL_VIEWS, db=db)
     db.commit()
     db.refresh(mail)
+    scheduler.schedule(mail.id, mail.due_at)
     return {"message": f"Custom threshold updated to {hours} hours", "mail": mail}
 
+# Counts per department; a mail's custom_threshold_hours overrides the 24h/48h defaults
 @app.get("/overdue-summary")
-def get_overdue_summary(db: Session = Depends(get_db)):
-    now = datetime.utcnow()
-    # Use raw SQL to avoid column issues
-    from sqlalchemy import text
-    result_incoming = db.execute(text("""
-        SELECT COUNT(*) as count FROM mails
-        WHERE sender IS NOT NULL AND status = 'pending'
-        AND TIMESTAMPDIFF(HOUR, date_sent, NOW()) > 24
-    """))
-    overdue_incoming = result_incoming.fetchone()[0]
-
-    result_outgoing = db.execute(text("""
-        SELECT COUNT(*) as count FROM mails
-        WHERE recipient IS NOT NULL AND status = 'pending'
-        AND TIMESTAMPDIFF(HOUR, date_sent, NOW()) > 48
-    """))
-    overdue_outgoing = result_outgoing.fetchone()[0]
-
-    return {"incoming": overdue_incoming, "outgoing": overdue_outgoing}
+async def get_overdue_summary(db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(overdue.overdue_summary)
+
+# Dashboard totals, kept up to date as mails change (see app/counters.py)
+@app.get("/stats")
+async def get_stats(db: AsyncSession = Depends(get_async_db)):
+    return await db.run_sync(counters.snapshot)
+
+# ✅ A mail's timeline from the event log: every event, and how long it sat in each status.
+# Still answers after the mail itself is deleted.
+@app.get("/mails/{mail_id}/history")
+async def get_mail_history(mail_id: int, db: AsyncSession = Depends(get_async_db)):
+    history = await db.run_sync(events.history, mail_id)
+    if history is None:
+        raise HTTPException(status_code=404, detail="No history for this mail")
+    return history
+
+# Hours from arrival to completion (percentiles), for mails completed in [date_from, date_to),
+# per department or sender; computed from the event log only
+@app.get("/analytics/turnaround")
+async def get_turnaround(
+    by: str = "department",
+    date_from: datetime = None,
+    date_to: datetime = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    if by not in events.TURNAROUND_GROUPS:
+        raise HTTPException(status_code=400, detail=f"by must be one of {', '.join(events.TURNAROUND_GROUPS)}")
+    return await db.run_sync(events.turnaround, by, date_from, date_to)
+
+# ✅ Move completed mails older than older_than_days to mails_archive, batch by batch.
+# Search, export, history and the counters still include them; /mails lists live mails only.
+@app.post("/archive")
+def run_archive(
+    older_than_days: int = Query(archive.ARCHIVE_AFTER_DAYS, ge=1),
+    batch_size: int = Query(archive.ARCHIVE_BATCH_SIZE, ge=1, le=50000),
+    max_batches: int = Query(None, ge=1),
+    db: Session = Depends(get_db)
+):
+    try:
+        return archive.archive_mails(db, older_than_days, batch_size, max_batches)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+@app.get("/archive")
+async def get_archive_stats(
+    older_than_days: int = Query(archive.ARCHIVE_AFTER_DAYS, ge=1),
+    db: AsyncSession = Depends(get_async_db)
+):
+    return await db.run_sync(archive.archive_stats, older_than_days)
 
 @app.get("/overdue-mails")
-def get_overdue_mails(db: Session = Depends(get_db)):
-    now = datetime.utcnow()
-    mails = db.query(models.Mail).filter(
-        models.Mail.status == "pending",
-        ((models.Mail.sender.isnot(None) & ((now - models.Mail.date_sent) > timedelta(hours=24))) |
-         (models.Mail.recipient.isnot(None) & ((now - models.Mail.date_sent) > timedelta(hours=48)))),
-        (models.Mail.reminder_sent_at.is_(None) | ((now - models.Mail.reminder_sent_at) > timedelta(hours=24)))
-    ).all()
-    return mails
+async def get_overdue_mails(request: Request, db: AsyncSession = Depends(get_async_db)):
+    async def render():
+        rows = await db.run_sync(overdue.overdue_rows)
+        return (await run_in_threadpool(listing.rows_to_json, rows)).encode(), {}
+
+    return await response_cache.respond_async(request, "overdue", render, ttl=OVERDUE_TTL_SECONDS)
 
 @app.put("/mails/{mail_id}/reminder-sent")
 def mark_reminder_sent(mail_id: int, db: Session = Depends(get_db)):
-    # Use raw SQL to avoid column issues
-    from sqlalchemy import text
-    result = db.execute(text("""
-        UPDATE mails SET reminder_sent_at = NOW() WHERE id = :mail_id
-    """), {"mail_id": mail_id})
-    if result.rowcount == 0:
+    response_cache.invalidate(*MAIL_VIEWS, db=db)
+    if bulk.mark_reminders(db, [mail_id])[bulk.NOT_FOUND]:
         raise HTTPException(status_code=404, detail="Mail not found")
-    db.commit()
     return {"message": "Reminder sent marked"}
 
+# ✅ Email every recipient a digest of their overdue mails and mark them reminded in one go
+# (replaces calling /mails/{id}/reminder-sent per mail). Reports messages/s and failures.
+@app.post("/reminders/send")
+def send_reminders(db: Session = Depends(get_db)):
+    try:
+        return reminders.dispatch_reminders(db)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
 @app.delete("/mails/all")
 def delete_all_mails(db: Session = Depends(get_db)):
+    events.record_deleted(db)
+    events.record_deleted(db, model=models.MailArchive)
     db.query(models.Mail).delete()
+    db.query(models.MailArchive).delete()
+    counters.reset(db)
+    response_cache.invalidate(*MAIL_VIEWS, db=db)
     db.commit()
     return {"message": "All mails deleted successfully"}
 
@@ -153,11 +454,18 @@ def create_mail(mail: MailCreate, db: Session = Depends(get_db)):
             recipient=mail.recipient,
             date_sent=date_sent,
             status=mail.status,
-            eksu_ref=eksu_ref
+            eksu_ref=eksu_ref,
+            due_at=compute_due_at(date_sent)
         )
         db.add(new_mail)
+        counters.track(db, after=counters.mail_state(new_mail))
+        db.flush()  # for the id
+        events.record(db, [events.for_mail(new_mail, events.CREATED, date_sent, new_mail.status)])
+        # A new mail isn't notified yet, so /notifications can't change
+        response_cache.invalidate("mails", "overdue", db=db)
         db.commit()
         db.refresh(new_mail)
+        scheduler.schedule(new_mail.id, new_mail.due_at)
         return new_mail
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Failed to create mail: {str(e)}")
@@ -165,84 +473,220 @@ def create_mail(mail: MailCreate, db: Session = Depends(get_db)):
 # ✅ Update mail status
 @app.put("/mails/{mail_id}/status")
 def update_mail_status(mail_id: int, status_update: MailStatusUpdate, db: Session = Depends(get_db)):
-    mail = db.query(models.Mail).filter(models.Mail.id == mail_id).first()
+    # Locked until commit, so the counter change below matches the row it was computed from
+    mail = db.query(models.Mail).filter(models.Mail.id == mail_id).with_for_update().first()
     if not mail:
         raise HTTPException(status_code=404, detail="Mail not found")
 
+    before = counters.mail_state(mail)
     mail.status = status_update.status
     mail.updated_at = datetime.utcnow()
+    counters.track(db, before, counters.mail_state(mail))
+    if counters.mail_state(mail)[1] != before[1]:
+        events.record(db, [events.for_mail(mail, events.STATUS, mail.updated_at, status_update.status)])
+    response_cache.invalidate(*MAIL_VIEWS, db=db)
     db.commit()
     db.refresh(mail)
     return {"message": "Status updated", "mail": mail}
 
 @app.on_event("startup")
-@repeat_every(seconds=3600)  # every 1 hour
-def check_pending_mails_task():
+async def bind_alert_broadcaster():
+    # The notifier runs in a worker thread; alerts are handed back to this loop for fan-out
+    alerts.broadcaster.bind(asyncio.get_running_loop())
+
+# Only the notifier's leader creates alerts; every worker (the leader too, in case its own
+# publish was missed) reads them back from the database for its WebSockets. It only looks
+# while a WebSocket is connected, starts with a single probe of the notified_at index, and
+# backs off from ALERT_POLL_SECONDS to ALERT_POLL_MAX_SECONDS while nothing new turns up.
+async def follow_alerts():
+    cursor, interval = None, alerts.ALERT_POLL_SECONDS
+    while True:
+        woken = alerts.broadcaster.subscribed
+        if not alerts.broadcaster.has_subscribers():
+            # Nobody to send to: wait for a WebSocket, then follow from the newest alert
+            cursor, interval = None, alerts.ALERT_POLL_SECONDS
+            await woken.wait()
+        elif interval:
+            try:
+                await asyncio.wait_for(woken.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+        woken.clear()
+        try:
+            new_alerts = []
+            async with AsyncSessionLocal() as db:
+                latest = await db.run_sync(alerts.latest_cursor)
+                if cursor is None:
+                    cursor = latest
+                if alerts.broadcaster.last_cursor is not None:
+                    # Past anything this worker has already fanned out (its own notifier's alerts)
+                    cursor = max(cursor, alerts.broadcaster.last_cursor)
+                if latest > cursor:
+                    with metrics.span("alerts.feed"):
+                        new_alerts = await db.run_sync(alerts.load_alerts_since, cursor)
+            if new_alerts:
+                cursor = alerts.parse_cursor(new_alerts[-1]["cursor"])
+                alerts.broadcaster.publish(new_alerts)
+            if len(new_alerts) == alerts.ALERT_REPLAY_LIMIT:
+                interval = 0  # more waiting
+            elif new_alerts:
+                interval = alerts.ALERT_POLL_SECONDS
+            else:
+                interval = min(max(interval, alerts.ALERT_POLL_SECONDS) * 2, alerts.ALERT_POLL_MAX_SECONDS)
+        except Exception:
+            traceback.print_exc()
+            interval = alerts.ALERT_POLL_MAX_SECONDS
+
+@app.on_event("startup")
+async def start_alert_feed():
+    app.state.alert_feed = asyncio.ensure_future(follow_alerts())
+
+@app.on_event("shutdown")
+async def stop_alert_feed():
+    app.state.alert_feed.cancel()
+
+async def watch_cache_generations():
+    while True:
+        await asyncio.sleep(CACHE_SYNC_SECONDS)
+        try:
+            await run_in_threadpool(response_cache.backend.sync_counters)
+        except Exception:
+            traceback.print_exc()
+
+# Cache generations live in the database, so a write through any worker invalidates the
+# cached views of all of them (within CACHE_SYNC_SECONDS, see app/cache.py)
+@app.on_event("startup")
+async def share_cache_generations():
+    await run_in_threadpool(response_cache.share_generations, engine)
+    app.state.cache_sync = asyncio.ensure_future(watch_cache_generations())
+
+@app.on_event("shutdown")
+async def stop_cache_sync():
+    app.state.cache_sync.cancel()
+
+def notify_overdue_mails(now: datetime = None):
     db = SessionLocal()
     try:
-        now = datetime.utcnow()
-        pending_mails = db.query(models.Mail).filter(
-            models.Mail.status == "pending",
-            models.Mail.notified == False
-        ).all()
-
-        for mail in pending_mails:
-            threshold_hours = mail.custom_threshold_hours or 48
-            time_elapsed = now - mail.date_sent
-
-            if time_elapsed > timedelta(hours=threshold_hours):
-                # 🚨 Send system notification here
-                print(f"⚠️ Mail '{mail.eksku_ref}' has not been attended to for {threshold_hours} hours!")
-
-                # Mark as notified
-                mail.notified = True
-                mail.notified_at = datetime.utcnow()
-                db.add(mail)
-        db.commit()
+        with metrics.span("notifier"):
+            new_alerts = notify_due_mails(db, now)
+        for alert in new_alerts:
+            # 🚨 Send system notification here
+            print(f"⚠️ {alert['message']}")
+        alerts.broadcaster.publish(new_alerts)
+        return new_alerts
     finally:
         db.close()
 
+def load_upcoming_deadlines(until: datetime):
+    db = SessionLocal()
+    try:
+        return load_deadlines(db, until)
+    finally:
+        db.close()
 
-# ✅ Root test endpoint
-@app.get("/")
-def home():
-    return {"message": "EKSU Mail Tracking System API is running successfully!"}
+# Only the worker holding the notifier lease runs the scheduler; the others stand by
+# and one of them takes over if it dies (see app/leases.py)
+notifier_leader = leases.Leader("notifier")
 
-def get_new_alerts_from_db():
+@app.on_event("startup")
+async def start_deadline_scheduler():
+    # Wakes when the next mail becomes overdue (replaces the hourly full scan)
+    app.state.notifier = asyncio.ensure_future(notifier_leader.run(
+        lambda: scheduler.run(load_upcoming_deadlines, notify_overdue_mails), lambda: SessionLocal()
+    ))
+
+@app.on_event("shutdown")
+async def stop_deadline_scheduler():
+    # Hands the lease back, so another worker doesn't have to wait for it to expire
+    app.state.notifier.cancel()
+    await asyncio.wait({app.state.notifier})
+
+def sweep_upload_jobs():
     db = SessionLocal()
     try:
-        alerts = []
-        # Fetch mails that have been notified in the last 10 seconds
-        ten_seconds_ago = datetime.utcnow() - timedelta(seconds=10)
-        # Use raw SQL to avoid column issues if migration hasn't run
-        from sqlalchemy import text
-        result = db.execute(text("""
-            SELECT id, eksu_ref, sender, recipient, custom_threshold_hours, notified_at
-            FROM mails
-            WHERE notified = 1 AND notified_at >= :ten_seconds_ago
-        """), {"ten_seconds_ago": ten_seconds_ago})
-
-        for row in result:
-            alerts.append({
-                "ref": row.eksu_ref,
-                "message": f"Mail {row.eksu_ref} from {row.sender} to {row.recipient} has not been attended to in {row.custom_threshold_hours or 48} hours.",
-                "time": row.notified_at.isoformat() if row.notified_at else None
-            })
-        return alerts
-    except Exception as e:
-        print(f"Error in get_new_alerts_from_db: {e}")
-        return []
+        jobs.touch_jobs(db)
+        jobs.recover_jobs(db)
     finally:
         db.close()
 
+async def watch_upload_jobs():
+    while True:
+        try:
+            await run_in_threadpool(sweep_upload_jobs)
+        except Exception:
+            traceback.print_exc()
+        await asyncio.sleep(jobs.JOB_HEARTBEAT_SECONDS)
+
+# Upload jobs left queued/running by a worker that stopped (crash, restart) are failed and
+# their spool files removed; this worker's own jobs are marked alive so nobody else does that
+@app.on_event("startup")
+async def start_upload_job_watch():
+    app.state.upload_jobs = asyncio.ensure_future(watch_upload_jobs())
+
+@app.on_event("shutdown")
+async def stop_upload_job_watch():
+    app.state.upload_jobs.cancel()
+
+
+# ✅ Root test endpoint
+@app.get("/")
+def home():
+    return {"message": "EKSU Mail Tracking System API is running successfully!"}
+
+async def load_alerts_since(cursor):
+    async with AsyncSessionLocal() as db:
+        with metrics.span("ws.replay"):
+            return await db.run_sync(alerts.load_alerts_since, cursor)
+
+
+async def _wait_for_disconnect(websocket: WebSocket):
+    while (await websocket.receive())["type"] != "websocket.disconnect":
+        pass
+
 
 # ✅ WebSocket endpoint for real-time alerts
+# Pass ?since=<cursor of the last alert received> on reconnect to replay what was missed.
 @app.websocket("/ws")
-async def alerts_ws(websocket: WebSocket):
+async def alerts_ws(websocket: WebSocket, since: str = None):
     await websocket.accept()
-    while True:
-        alerts = get_new_alerts_from_db()
-        if alerts:
-            for alert in alerts:
+    subscription = alerts.broadcaster.subscribe()
+    disconnected = asyncio.ensure_future(_wait_for_disconnect(websocket))
+    try:
+        cursor = alerts.parse_cursor(since) if since else None
+
+        async def send(alert):
+            nonlocal cursor
+            alert_cursor = alerts.parse_cursor(alert["cursor"])
+            if cursor is None or alert_cursor > cursor:  # skip anything already replayed
                 await websocket.send_json(alert)
-        await asyncio.sleep(10)  # check every 10 seconds
+                metrics.WS_ALERTS_SENT.inc()
+                cursor = alert_cursor
+
+        async def catch_up():
+            # Replay from the database in pages until we are level with the live stream
+            while cursor is not None:
+                missed = await load_alerts_since(cursor)
+                for alert in missed:
+                    await send(alert)
+                if len(missed) < alerts.ALERT_REPLAY_LIMIT:
+                    break
+
+        await catch_up()
+        while True:
+            next_alert = asyncio.ensure_future(subscription.queue.get())
+            done, _ = await asyncio.wait({next_alert, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+            if disconnected in done:
+                next_alert.cancel()
+                break
+            alert = next_alert.result()
+            if alert is alerts.Subscription.LAGGED:
+                subscription.lagged = False
+                cursor = cursor or subscription.resume_cursor
+                await catch_up()
+            else:
+                await send(alert)
+    except (WebSocketDisconnect, ValueError):
+        pass
+    finally:
+        disconnected.cancel()
+        alerts.broadcaster.unsubscribe(subscription)
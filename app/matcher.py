@@ -0,0 +1,135 @@
+from datetime import datetime
+
+# Length of the n-grams used as index keys
+GRAM = 3
+# Lookups of one pair before its mails are indexed (see _PairIndex); benchmarks/bench_matcher.py
+# shows the crossover
+INDEX_AFTER_LOOKUPS = 100
+
+
+def pending_order(state) -> tuple:
+    """Same order as ORDER BY date_sent ASC, id ASC (NULLs first, unsaved rows after saved ones)."""
+    return (state["date_sent"] is not None, state["date_sent"] or datetime.min, state["seq"])
+
+
+def pair_key(sender, recipient, fold=None) -> tuple:
+    """(sender, recipient), with `fold` applied to both when the database ignores their case."""
+    return (sender, recipient) if fold is None else (fold(sender), fold(recipient))
+
+
+def _grams(text: str, n: int) -> set:
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+class _PairIndex:
+    """
+    Pending mails for one (sender, recipient) pair, each filed under one "anchor" n-gram of
+    its normalized document. A mail can only be a substring of a reply if its anchor occurs
+    in the reply, so a lookup only verifies the mails filed under the reply's own n-grams.
+
+    Filing a mail costs about as much as scanning past it on a hundred lookups, so a
+    pair is only indexed once it has been looked up INDEX_AFTER_LOOKUPS times; until then
+    lookups walk its mails oldest first, like the per-row query did.
+    """
+    __slots__ = ("mails", "in_order", "lookups", "by_anchor", "gram_counts", "short_lengths")
+
+    def __init__(self):
+        self.mails = []
+        self.in_order = True
+        self.lookups = 0
+        self.by_anchor = None
+        self.gram_counts = {}
+        self.short_lengths = set()  # documents shorter than GRAM are filed under the whole text
+
+    def add(self, doc: str, state):
+        self.mails.append((doc, state))
+        self.in_order = False
+        if self.by_anchor is not None:
+            self._file(doc, state)
+
+    def _file(self, doc: str, state):
+        if len(doc) < GRAM:
+            anchor = doc
+            self.short_lengths.add(len(doc))
+        else:
+            grams = _grams(doc, GRAM)
+            for g in grams:
+                self.gram_counts[g] = self.gram_counts.get(g, 0) + 1
+            # The rarest n-gram seen so far keeps the buckets small
+            anchor = min(grams, key=lambda g: (self.gram_counts[g], g))
+        self.by_anchor.setdefault(anchor, []).append((doc, state))
+
+    def candidates(self, doc: str):
+        """(oldest_first, mails): the mails that could be a substring of `doc`."""
+        self.lookups += 1
+        if self.by_anchor is None:
+            if self.lookups < INDEX_AFTER_LOOKUPS:
+                if not self.in_order:
+                    self.mails.sort(key=lambda mail: pending_order(mail[1]))
+                    self.in_order = True
+                return True, self.mails
+            self.by_anchor = {}
+            for mail in self.mails:
+                self._file(*mail)
+        keys = _grams(doc, GRAM)
+        for n in self.short_lengths:
+            keys |= _grams(doc, n)
+        return False, (mail for key in keys for mail in self.by_anchor.get(key, ()))
+
+
+class ReplyMatcher:
+    """
+    Finds the pending mail an incoming reply answers: the oldest pending mail from the
+    reply's recipient to its sender whose document is a (case-insensitive) substring of
+    the reply's document.
+
+    Mails and replies are plain dicts with sender, recipient, document, date_sent, status
+    and seq (tie-break after date_sent). Only pairs passed to the constructor are indexed;
+    status is checked at match time, so callers can flip it after indexing. With `fold`,
+    pairs are compared as pair_key(..., fold) gives them (and `pairs` must be given so).
+    """
+
+    def __init__(self, pairs, fold=None):
+        self._index = {pair: _PairIndex() for pair in pairs}
+        self.fold = fold
+        self.indexed = 0
+        self.replies = 0
+        self.matched = 0
+        self.candidates_checked = 0
+
+    def add(self, state):
+        index = self._index.get(pair_key(state["sender"], state["recipient"], self.fold))
+        if index is None or not state["document"]:
+            return
+        index.add(state["document"].lower(), state)
+        self.indexed += 1
+
+    def match(self, reply):
+        """Return the mail `reply` answers, or None. Does not change either row."""
+        self.replies += 1
+        index = self._index.get(pair_key(reply["recipient"], reply["sender"], self.fold))
+        if index is None or not reply["document"]:
+            return None
+        doc = reply["document"].lower()
+        best = None
+        oldest_first, candidates = index.candidates(doc)
+        for candidate_doc, state in candidates:
+            if state["status"] != "pending":
+                continue
+            self.candidates_checked += 1
+            if candidate_doc in doc and (best is None or pending_order(state) < pending_order(best)):
+                best = state
+                if oldest_first:
+                    break
+        if best is not None:
+            self.matched += 1
+        return best
+
+    def stats(self) -> dict:
+        return {
+            "pairs": len(self._index),
+            "indexed": self.indexed,
+            "replies": self.replies,
+            "matched": self.matched,
+            "candidates_checked": self.candidates_checked,
+        }
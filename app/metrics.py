@@ -0,0 +1,300 @@
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+# Everything here is cheap enough to leave on; METRICS_ENABLED=0 turns it off entirely
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") not in ("0", "false", "False")
+# The same statement this many times in one request (or span) is flagged as a likely N+1
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "20"))
+# The sampling profiler endpoints only exist when this is set
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "0") in ("1", "true", "True")
+PROFILER_MAX_SECONDS = float(os.getenv("PROFILER_MAX_SECONDS", "60"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{str(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Histogram:
+    """Prometheus-style histogram: cumulative buckets, sum and count per label set."""
+
+    def __init__(self, name: str, help: str, buckets: tuple, labels: tuple = ()):
+        self.name, self.help, self.buckets, self.labels = name, help, buckets, labels
+        self._series = {}  # label values -> [count per bucket..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[i] += 1
+            series[-1] += value
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        for values, counts in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                labels = _labels((*self.labels, "le"), (*values, bound))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _labels(self.labels, values)
+            lines.append(f"{self.name}_sum{labels} {counts[-1]:.6f}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class CounterMetric:
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name, self.help, self.labels = name, help, labels
+        self._values = Counter()
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, *label_values):
+        with self._lock:
+            self._values[label_values] += amount
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for label_values, value in sorted(values.items()):
+            lines.append(f"{self.name}{_labels(self.labels, label_values)} {value}")
+        return lines
+
+
+REQUEST_SECONDS = Histogram("http_request_duration_seconds", "Request latency by route",
+                            LATENCY_BUCKETS, ("method", "route", "status"))
+REQUEST_SQL_STATEMENTS = Histogram("http_request_sql_statements", "SQL statements per request",
+                                   COUNT_BUCKETS, ("route",))
+REQUEST_SQL_SECONDS = Histogram("http_request_sql_seconds", "Time in SQL per request",
+                                LATENCY_BUCKETS, ("route",))
+SPAN_SECONDS = Histogram("span_duration_seconds", "Time spent in an instrumented step",
+                         LATENCY_BUCKETS, ("span",))
+SPAN_SQL_STATEMENTS = CounterMetric("span_sql_statements_total", "SQL statements run inside a span", ("span",))
+SPAN_ITEMS = CounterMetric("span_items_total", "Rows / alerts / items a span processed", ("span",))
+REPEATED_STATEMENTS = CounterMetric("sql_repeated_statement_total",
+                                    "Requests or spans that ran one statement N_PLUS_ONE_THRESHOLD+ times",
+                                    ("where",))
+WS_ALERTS_SENT = CounterMetric("ws_alerts_sent_total", "Alerts sent to WebSocket clients")
+REMINDER_MESSAGES = CounterMetric("reminder_messages_total", "Reminder digests by outcome (sent, failed, retried)",
+                                  ("outcome",))
+
+METRICS = [REQUEST_SECONDS, REQUEST_SQL_STATEMENTS, REQUEST_SQL_SECONDS, SPAN_SECONDS,
+           SPAN_SQL_STATEMENTS, SPAN_ITEMS, REPEATED_STATEMENTS, WS_ALERTS_SENT,
+           REMINDER_MESSAGES]
+# Callables returning (name, {label: value}, value) for values read at scrape time (pool, cache...)
+_gauge_collectors = []
+
+
+def register_gauges(collect):
+    _gauge_collectors.append(collect)
+
+
+def render() -> str:
+    """Every metric in the Prometheus text format."""
+    lines = []
+    for metric in METRICS:
+        lines += metric.render()
+    declared = set()
+    for collect in _gauge_collectors:
+        for name, labels, value in collect():
+            if value is None:
+                continue
+            if name not in declared:
+                lines.append(f"# TYPE {name} gauge")
+                declared.add(name)
+            lines.append(f"{name}{_labels(tuple(labels), tuple(labels.values()))} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# --- SQL statement counting ---
+class _Tally:
+    """Statements run (and time spent in them) while a request or span is active."""
+
+    __slots__ = ("statements", "seconds", "repeats")
+
+    def __init__(self):
+        self.statements = 0
+        self.seconds = 0.0
+        self.repeats = Counter()
+
+
+# Every tally that is open in this context (the request's and any enclosing spans')
+_tallies = ContextVar("sql_tallies", default=())
+_flagged = set()  # (where, statement) already printed
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _tallies.get():
+        context._metrics_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    tallies = _tallies.get()
+    started = getattr(context, "_metrics_started", None)
+    if not tallies or started is None:
+        return
+    elapsed = time.perf_counter() - started
+    for tally in tallies:
+        tally.statements += 1
+        tally.seconds += elapsed
+        tally.repeats[statement] += 1
+
+
+def watch_engine(sync_engine):
+    """Count and time every statement the engine runs (see make_engine / make_async_engine)."""
+    if METRICS_ENABLED:
+        event.listen(sync_engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def _open_tally():
+    tally = _Tally()
+    return tally, _tallies.set(_tallies.get() + (tally,))
+
+
+def _check_repeats(tally: _Tally, where: str):
+    if not tally.repeats:
+        return
+    statement, times = tally.repeats.most_common(1)[0]
+    if times >= N_PLUS_ONE_THRESHOLD:
+        REPEATED_STATEMENTS.inc(1, where)
+        if (where, statement) not in _flagged:
+            _flagged.add((where, statement))
+            print(f"⚠️ {where}: same statement ran {times} times (N+1?): {' '.join(statement.split())[:200]}")
+
+
+@contextmanager
+def span(name: str, items: int = None):
+    """
+    Time a step (and count its SQL statements) under span_duration_seconds{span=name}.
+    `items` is how many rows/alerts it handled, so per-item costs can be derived.
+    """
+    if not METRICS_ENABLED:
+        yield
+        return
+    tally, token = _open_tally()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _tallies.reset(token)
+        SPAN_SECONDS.observe(time.perf_counter() - started, name)
+        SPAN_SQL_STATEMENTS.inc(tally.statements, name)
+        if items:
+            SPAN_ITEMS.inc(items, name)
+        _check_repeats(tally, name)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware: latency per route template (not per URL, so ids don't explode the
+    label set), plus the number of SQL statements and time in SQL for each request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        tally, token = _open_tally()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            _tallies.reset(token)
+            route = getattr(scope.get("route"), "path", "unmatched")
+            REQUEST_SECONDS.observe(elapsed, scope["method"], route, status)
+            REQUEST_SQL_STATEMENTS.observe(tally.statements, route)
+            REQUEST_SQL_SECONDS.observe(tally.seconds, route)
+            _check_repeats(tally, f"{scope['method']} {route}")
+
+
+# --- Opt-in sampling profiler ---
+class SamplingProfiler:
+    """
+    Samples every thread's Python stack every `interval` seconds and counts identical
+    stacks, in the folded format flamegraph.pl and speedscope read. Costs nothing
+    until started; stops itself after PROFILER_MAX_SECONDS.
+    """
+
+    def __init__(self):
+        self._thread = None
+        self._stop = threading.Event()
+        self.samples = Counter()
+        self.interval = None
+        self.started_at = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval: float = 0.01, seconds: float = PROFILER_MAX_SECONDS):
+        if self.running:
+            raise ValueError("profiler already running")
+        self.samples = Counter()
+        self.interval = interval
+        self.started_at = time.time()
+        self._stop.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(min(seconds, PROFILER_MAX_SECONDS),), name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> str:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return self.folded()
+
+    def _run(self, seconds: float):
+        me = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)})")
+                    frame = frame.f_back
+                self.samples[";".join(reversed(stack))] += 1
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+    def status(self) -> dict:
+        return {"running": self.running, "interval": self.interval, "started_at": self.started_at,
+                "samples": sum(self.samples.values()), "stacks": len(self.samples)}
+
+
+profiler = SamplingProfiler()
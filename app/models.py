@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, Enum, func, Boolean
+from sqlalchemy import Column, Integer, String, DateTime, Text, Enum, func, Boolean, Index
 from .database import Base
 from datetime import datetime, timedelta
 import enum
@@ -10,10 +10,8 @@ class MailStatus(enum.Enum):
     completed = "completed"
     overdue = "overdue"
 
-# --- Main Table ---
-class Mail(Base):
-    __tablename__ = "mails"
-
+# --- Columns shared by the live table and its archive ---
+class MailColumns:
     id = Column(Integer, primary_key=True, index=True)
     eksu_ref = Column(String(20), unique=True, index=True)  # ✅ new column
     name = Column(String(200), nullable=True)
@@ -31,4 +29,137 @@ class Mail(Base):
     notified_at = Column(DateTime, nullable=True)
     notification_type = Column(String(50), default="system")  # 'system' or 'email'
     reminder_sent_at = Column(DateTime, nullable=True)  # Track when reminder was sent
+    due_at = Column(DateTime, nullable=True)  # date_sent + threshold, see scheduler.compute_due_at
+
+
+# --- Main Table ---
+class Mail(MailColumns, Base):
+    __tablename__ = "mails"
+
+    # One index per hot access path; check_query_plans.py fails if a query stops using them
+    __table_args__ = (
+        # Notifier: pending, not yet notified, due_at <= now
+        Index("ix_mails_status_notified_due_at", "status", "notified", "due_at"),
+        # /notifications: notified pending mails, newest first
+        Index("ix_mails_status_notified_date_sent", "status", "notified", "date_sent"),
+        # /ws replay: notified mails after a (notified_at, id) cursor
+        Index("ix_mails_notified_at_id", "notified_at", "id"),
+        # Upload matching: natural key lookup, and pending mails of a (sender, recipient) pair
+        Index("ix_mails_sender_recipient_date_sent", "sender", "recipient", "date_sent"),
+        Index("ix_mails_sender_recipient_status", "sender", "recipient", "status"),
+        # Overdue queries: pending and past due_at (custom thresholds); the date_sent side
+        # of the same OR uses ix_mails_status_date_sent_id
+        Index("ix_mails_status_due_at", "status", "due_at"),
+        # /mails keyset paging (date_sent DESC, id DESC), unfiltered and per filter
+        Index("ix_mails_date_sent_id", "date_sent", "id"),
+        Index("ix_mails_status_date_sent_id", "status", "date_sent", "id"),
+        Index("ix_mails_sender_date_sent_id", "sender", "date_sent", "id"),
+        Index("ix_mails_recipient_date_sent_id", "recipient", "date_sent", "id"),
+        Index("ix_mails_name_date_sent_id", "name", "date_sent", "id"),
+        # /mails/search on MySQL; SQLite uses the FTS5 table from app/search.py instead
+        Index("ft_mails_document_sender_recipient", "document", "sender", "recipient",
+              mysql_prefix="FULLTEXT").ddl_if(dialect="mysql"),
+    )
+
+
+# --- Cold tier: old completed mails, moved out of `mails` by app/archive.py ---
+class MailArchive(MailColumns, Base):
+    __tablename__ = "mails_archive"
+
+    archived_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        # Upload de-duplication: natural key lookup (app/utils.py)
+        Index("ix_mails_archive_sender_recipient_date_sent", "sender", "recipient", "date_sent"),
+        # /export reads both tiers in (date_sent, id) order
+        Index("ix_mails_archive_date_sent_id", "date_sent", "id"),
+        # /mails/search on MySQL; SQLite uses mails_archive_fts (app/search.py)
+        Index("ft_mails_archive_document_sender_recipient", "document", "sender", "recipient",
+              mysql_prefix="FULLTEXT").ddl_if(dialect="mysql"),
+    )
+
+
+# --- Sequence counters (e.g. EKSU refs), see app/refs.py ---
+class RefCounter(Base):
+    __tablename__ = "ref_counters"
+
+    name = Column(String(50), primary_key=True)
+    next_value = Column(Integer, nullable=False)  # next number to hand out
+
+# --- Background job leases (which worker runs each periodic job), see app/leases.py ---
+class JobLease(Base):
+    __tablename__ = "job_leases"
+
+    name = Column(String(50), primary_key=True)  # e.g. notifier
+    holder = Column(String(100), nullable=True)  # worker id (host:pid:random) of the leader
+    expires_at = Column(DateTime, nullable=False)  # leader must renew before this, or anyone may take over
+    acquired_at = Column(DateTime, nullable=True)  # when the current holder became leader
+
+# --- Response cache generations shared by every worker, see app/cache.py ---
+class CacheGeneration(Base):
+    __tablename__ = "cache_generations"
+
+    key = Column(String(50), primary_key=True)  # gen:<view>, e.g. gen:mails
+    generation = Column(Integer, nullable=False, default=0)  # bumped by every write the view can show
+
+# --- Dashboard counters (mails per status / department / overdue bucket), see app/counters.py ---
+class MailCounter(Base):
+    __tablename__ = "mail_counters"
+
+    scope = Column(String(30), primary_key=True)  # status, department, overdue, overdue_department
+    key = Column(String(200), primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
+
+# --- Append-only mail timeline (created, status changes, notifications...), see app/events.py ---
+class MailEvent(Base):
+    __tablename__ = "mail_events"
+
+    id = Column(Integer, primary_key=True)
+    mail_id = Column(Integer, nullable=False)  # no foreign key: the history outlives the mail
+    kind = Column(String(20), nullable=False)  # created, status, matched, notified, reminder, threshold, deleted
+    at = Column(DateTime, nullable=False)  # when it happened in the mail's timeline (e.g. the reply's date)
+    value = Column(String(50), nullable=True)  # new status, threshold hours or matched mail id
+    department = Column(String(200), nullable=True)  # copied from the mail so reports don't touch mails
+    sender = Column(String(200), nullable=True)
+    recorded_at = Column(DateTime, server_default=func.now())
+
+    __table_args__ = (
+        # /mails/{id}/history: one mail's events in order
+        Index("ix_mail_events_mail_id_id", "mail_id", "id"),
+        # /analytics/turnaround: completions in a time window
+        Index("ix_mail_events_kind_value_at", "kind", "value", "at"),
+    )
+
+# --- Background upload jobs, see app/jobs.py ---
+class UploadJob(Base):
+    __tablename__ = "upload_jobs"
+
+    id = Column(String(36), primary_key=True)
+    filename = Column(String(255), nullable=True)
+    status = Column(String(20), default="queued")  # queued, running, completed, failed
+    rows_parsed = Column(Integer, default=0)
+    inserted = Column(Integer, default=0)
+    updated = Column(Integer, default=0)
+    matched = Column(Integer, default=0)
+    failed = Column(Integer, default=0)
+    error = Column(Text, nullable=True)  # why the whole job failed, if it did
+    created_at = Column(DateTime, server_default=func.now())
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    worker = Column(String(64), nullable=True)  # leases.WORKER_ID of the process running it
+    heartbeat_at = Column(DateTime, nullable=True)  # refreshed while that process is alive
+
+    __table_args__ = (
+        # jobs.recover_jobs: queued/running jobs whose worker stopped refreshing them
+        Index("ix_upload_jobs_status_heartbeat_at", "status", "heartbeat_at"),
+    )
+
+
+class UploadJobError(Base):
+    __tablename__ = "upload_job_errors"
 
+    id = Column(Integer, primary_key=True)
+    job_id = Column(String(36), index=True)
+    row_number = Column(Integer)  # data row in the uploaded sheet, 1 = first row after the header
+    error = Column(Text)
+    data = Column(Text)  # the parsed row as JSON
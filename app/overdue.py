@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import and_, case, func, or_, select
+from sqlalchemy.orm import Session
+
+from .listing import MAIL_COLUMNS, list_columns, select_rows
+from .models import Mail
+
+# Default reply windows; a mail's custom_threshold_hours replaces both (its due_at already holds it)
+INCOMING_THRESHOLD_HOURS = 24
+OUTGOING_THRESHOLD_HOURS = 48
+# A reminder isn't due again until this long after the last one
+REMINDER_INTERVAL_HOURS = 24
+
+
+def _past_threshold(now: datetime, default_hours: int):
+    # Plain column-vs-constant comparisons so both branches stay index range scans
+    return or_(
+        and_(Mail.custom_threshold_hours.is_(None), Mail.date_sent < now - timedelta(hours=default_hours)),
+        and_(Mail.custom_threshold_hours.isnot(None), Mail.due_at < now),
+    )
+
+
+def incoming_overdue(now: datetime):
+    return and_(Mail.sender.isnot(None), _past_threshold(now, INCOMING_THRESHOLD_HOURS))
+
+
+def outgoing_overdue(now: datetime):
+    return and_(Mail.recipient.isnot(None), _past_threshold(now, OUTGOING_THRESHOLD_HOURS))
+
+
+def overdue_candidates(now: datetime) -> list:
+    """
+    Index-friendly superset of every overdue mail: pending, and either older than the
+    shortest default window or past its own due_at. Narrow with incoming/outgoing_overdue.
+    """
+    shortest = min(INCOMING_THRESHOLD_HOURS, OUTGOING_THRESHOLD_HOURS)
+    return [
+        Mail.status == "pending",
+        or_(Mail.date_sent < now - timedelta(hours=shortest), Mail.due_at < now),
+    ]
+
+
+def _reminder_due(now: datetime) -> list:
+    """Overdue mails that haven't had a reminder in the last REMINDER_INTERVAL_HOURS."""
+    return [
+        *overdue_candidates(now),
+        or_(incoming_overdue(now), outgoing_overdue(now)),
+        or_(Mail.reminder_sent_at.is_(None),
+            Mail.reminder_sent_at < now - timedelta(hours=REMINDER_INTERVAL_HOURS)),
+    ]
+
+
+def overdue_mails(db: Session, now: datetime = None) -> list:
+    """Overdue mails that haven't had a reminder in the last REMINDER_INTERVAL_HOURS."""
+    return db.query(Mail).filter(*_reminder_due(now or datetime.utcnow())).all()
+
+
+def overdue_rows(db: Session, now: datetime = None) -> list:
+    """overdue_mails() as plain dicts of every column, for /overdue-mails (no ORM objects to build)."""
+    query = select(*list_columns(MAIL_COLUMNS)).where(*_reminder_due(now or datetime.utcnow()))
+    return select_rows(db, query, MAIL_COLUMNS)
+
+
+def overdue_summary(db: Session, now: datetime = None) -> dict:
+    """Incoming/outgoing overdue counts, overall and per department, from one grouped query."""
+    now = now or datetime.utcnow()
+    rows = db.query(
+        Mail.name,
+        func.sum(case((incoming_overdue(now), 1), else_=0)),
+        func.sum(case((outgoing_overdue(now), 1), else_=0)),
+    ).filter(*overdue_candidates(now)).group_by(Mail.name).order_by(Mail.name).all()
+
+    by_department = [
+        {"department": name, "incoming": int(incoming or 0), "outgoing": int(outgoing or 0)}
+        for name, incoming, outgoing in rows
+        if incoming or outgoing
+    ]
+    return {
+        "incoming": sum(d["incoming"] for d in by_department),
+        "outgoing": sum(d["outgoing"] for d in by_department),
+        "by_department": by_department,
+    }
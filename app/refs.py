@@ -0,0 +1,71 @@
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from .models import Mail, MailArchive, RefCounter
+
+EKSU_PREFIX = "EKSU"
+EKSU_COUNTER = "eksu_ref"
+
+
+def format_eksu_ref(number: int) -> str:
+    return f"{EKSU_PREFIX}{number:04d}"
+
+
+def _highest_existing_number(conn) -> int:
+    # Archived mails keep their refs, so both tiers count
+    highest = 0
+    for model in (Mail, MailArchive):
+        # Longest ref first, so EKSU10000 sorts above EKSU9999
+        last = conn.execute(
+            select(model.eksu_ref)
+            .where(model.eksu_ref.like(f"{EKSU_PREFIX}%"))
+            .order_by(func.length(model.eksu_ref).desc(), model.eksu_ref.desc())
+            .limit(1)
+        ).scalar()
+        try:
+            highest = max(highest, int(last[len(EKSU_PREFIX):]) if last else 0)
+        except ValueError:
+            pass
+    return highest
+
+
+def _reserve(conn, count: int):
+    result = conn.execute(
+        update(RefCounter)
+        .where(RefCounter.name == EKSU_COUNTER)
+        .values(next_value=RefCounter.next_value + count)
+    )
+    if result.rowcount == 0:
+        return None
+    end = conn.execute(select(RefCounter.next_value).where(RefCounter.name == EKSU_COUNTER)).scalar_one()
+    return range(end - count, end)
+
+
+def allocate_eksu_numbers(db: Session, count: int = 1) -> range:
+    """
+    Reserve `count` consecutive EKSU numbers in one round trip.
+
+    The counter row is bumped with a single UPDATE in its own short transaction, so the
+    row lock serializes concurrent callers without being held for the caller's whole
+    transaction. Numbers reserved by a transaction that later fails are not reused.
+    The counter is seeded from the highest existing eksu_ref the first time it is used.
+    """
+    if count <= 0:
+        return range(0)
+    engine = db.get_bind()
+    while True:
+        with engine.begin() as conn:
+            block = _reserve(conn, count)
+            if block is not None:
+                return block
+        try:
+            with engine.begin() as conn:
+                conn.execute(insert(RefCounter).values(
+                    name=EKSU_COUNTER, next_value=_highest_existing_number(conn) + 1
+                ))
+        except IntegrityError:
+            pass  # another worker seeded it first
+
+
+def allocate_eksu_refs(db: Session, count: int = 1) -> list:
+    return [format_eksu_ref(n) for n in allocate_eksu_numbers(db, count)]
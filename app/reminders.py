@@ -0,0 +1,285 @@
+import os
+import queue
+import smtplib
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from datetime import datetime
+from email.message import EmailMessage
+
+from sqlalchemy.orm import Session
+
+from . import bulk, leases, metrics, overdue
+from .cache import MAIL_VIEWS, response_cache
+
+# --- SMTP settings ---
+SMTP_HOST = os.getenv("SMTP_HOST", "localhost")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "25"))
+SMTP_USER = os.getenv("SMTP_USER")
+SMTP_PASSWORD = os.getenv("SMTP_PASSWORD")
+SMTP_STARTTLS = os.getenv("SMTP_STARTTLS", "0") in ("1", "true", "True")
+SMTP_TIMEOUT_SECONDS = float(os.getenv("SMTP_TIMEOUT_SECONDS", "30"))
+# Sender of the reminders; dispatch_reminders refuses to run without it
+REMINDER_FROM = os.getenv("REMINDER_FROM")
+# Recipients stored as department names ("bursary") are mailed at this domain; unset, only
+# recipients stored as addresses get reminders
+REMINDER_DOMAIN = os.getenv("REMINDER_DOMAIN")
+
+# --- Dispatch settings ---
+# Open SMTP connections, each reused for many messages; also the number of concurrent sends
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", "4"))
+# Messages per second across the whole pool (most relays throttle or block above their limit)
+SMTP_RATE_PER_SECOND = float(os.getenv("SMTP_RATE_PER_SECOND", "10"))
+# Retries for a temporary failure (4xx, dropped connection), waiting SMTP_BACKOFF_SECONDS * 2^n
+SMTP_RETRIES = int(os.getenv("SMTP_RETRIES", "3"))
+SMTP_BACKOFF_SECONDS = float(os.getenv("SMTP_BACKOFF_SECONDS", "1"))
+# Mails listed per digest; a recipient with more gets several messages
+DIGEST_MAX_MAILS = int(os.getenv("DIGEST_MAX_MAILS", "100"))
+# Lease held while a dispatch runs, so two workers never send the same reminders
+REMINDER_LEASE = "reminders"
+
+
+def recipient_address(recipient: str):
+    """The address a mail's recipient is reminded at, or None if it has none."""
+    recipient = (recipient or "").strip()
+    if "@" in recipient:
+        return recipient.lower()
+    if not REMINDER_DOMAIN:
+        return None
+    local = "".join(c for c in recipient.lower() if c.isalnum() or c == " ").replace(" ", ".")
+    return f"{local}@{REMINDER_DOMAIN}" if local else None
+
+
+def build_digests(mails: list, now: datetime) -> list:
+    """
+    One message per recipient listing every overdue mail waiting on them (split at
+    DIGEST_MAX_MAILS), as dicts {"to", "mail_ids", "message"}. Mails without a usable
+    recipient are left out.
+    """
+    by_address = defaultdict(list)
+    for mail in mails:
+        address = recipient_address(mail.recipient)
+        if address:
+            by_address[address].append(mail)
+
+    digests = []
+    for address, waiting in sorted(by_address.items()):
+        waiting.sort(key=lambda m: (m.date_sent or now, m.id))
+        for start in range(0, len(waiting), DIGEST_MAX_MAILS):
+            part = waiting[start:start + DIGEST_MAX_MAILS]
+            digests.append({"to": address, "mail_ids": [m.id for m in part], "message": _message(address, part, now)})
+    return digests
+
+
+def _message(address: str, mails: list, now: datetime) -> EmailMessage:
+    lines = [f"The following {len(mails)} mail(s) are awaiting your response:", ""]
+    for m in mails:
+        waiting = f"{int((now - m.date_sent).total_seconds() // 3600)}h" if m.date_sent else "unknown"
+        lines.append(f"- {m.eksu_ref or m.id}: {m.document or '(no subject)'} from {m.sender or 'unknown'}, "
+                     f"waiting {waiting}")
+    lines += ["", "EKSU Mail Tracking System"]
+    msg = EmailMessage()
+    msg["From"] = REMINDER_FROM
+    msg["To"] = address
+    msg["Subject"] = f"Reminder: {len(mails)} overdue mail(s) awaiting response"
+    msg.set_content("\n".join(lines))
+    return msg
+
+
+class RateLimiter:
+    """Token bucket shared by the sending threads: at most `rate` acquires per second, bursts of `burst`."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class SMTPPool:
+    """
+    Up to `size` logged-in SMTP connections, handed out one per send and put back after,
+    so a dispatch pays for the TCP/TLS/AUTH handshake once per connection, not per message.
+    A connection that drops or times out is closed instead of returned.
+    """
+
+    def __init__(self, size: int = SMTP_POOL_SIZE, host: str = SMTP_HOST, port: int = SMTP_PORT):
+        self.host, self.port = host, port
+        self.opened = 0
+        self._opened_lock = threading.Lock()
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self) -> smtplib.SMTP:
+        smtp = smtplib.SMTP(self.host, self.port, timeout=SMTP_TIMEOUT_SECONDS)
+        if SMTP_STARTTLS:
+            smtp.starttls()
+        if SMTP_USER:
+            smtp.login(SMTP_USER, SMTP_PASSWORD)
+        with self._opened_lock:
+            self.opened += 1
+        return smtp
+
+    @contextmanager
+    def connection(self):
+        with self._slots:
+            try:
+                smtp = self._idle.get_nowait()
+            except queue.Empty:
+                smtp = self._connect()
+            try:
+                yield smtp
+            except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused):
+                # The server answered, so the connection is still good: reset it and keep it
+                try:
+                    smtp.rset()
+                    self._idle.put(smtp)
+                except (smtplib.SMTPException, OSError):
+                    _quietly_close(smtp)
+                raise
+            except BaseException:
+                _quietly_close(smtp)
+                raise
+            self._idle.put(smtp)
+
+    def close(self):
+        while not self._idle.empty():
+            _quietly_close(self._idle.get_nowait())
+
+
+def _quietly_close(smtp: smtplib.SMTP):
+    try:
+        smtp.quit()
+    except (smtplib.SMTPException, OSError):
+        smtp.close()
+
+
+def _permanent(error: Exception) -> bool:
+    # 5xx replies (bad address, rejected content) fail the same way every time; everything
+    # else (4xx, timeouts, dropped connections) is worth another try
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(code >= 500 for code, _ in error.recipients.values())
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+
+def send_with_retry(pool: SMTPPool, limiter: RateLimiter, message: EmailMessage,
+                    retries: int = SMTP_RETRIES, backoff: float = SMTP_BACKOFF_SECONDS):
+    """Send `message`, retrying temporary failures with exponential backoff. Returns the last error, or None."""
+    for attempt in range(retries + 1):
+        limiter.acquire()
+        try:
+            with pool.connection() as smtp:
+                smtp.send_message(message)
+            return None
+        except (smtplib.SMTPException, OSError) as e:
+            if _permanent(e) or attempt == retries:
+                return e
+            metrics.REMINDER_MESSAGES.inc(1, "retried")
+            time.sleep(backoff * 2 ** attempt)
+
+
+def _send_all(db: Session, pool: SMTPPool, limiter: RateLimiter, digests: list, pool_size: int,
+              retries: int, backoff: float) -> list:
+    """
+    Send the digests concurrently; the error for each, or None if it went out. Renews
+    the reminders lease every LEASE_SECONDS / 3 while sending, so a long dispatch keeps
+    it. If it's lost, the digests not started yet are dropped rather than sent twice.
+    """
+    errors = [None] * len(digests)
+    renew_every = leases.LEASE_SECONDS / 3
+    with ThreadPoolExecutor(max_workers=pool_size) as executor:
+        futures = {
+            executor.submit(send_with_retry, pool, limiter, d["message"], retries, backoff): i
+            for i, d in enumerate(digests)
+        }
+        pending = set(futures)
+        while pending:
+            done, pending = wait(pending, timeout=renew_every)
+            for future in done:
+                errors[futures[future]] = future.result()
+            if pending and not leases.try_acquire(db, REMINDER_LEASE):
+                print("⚠️ Lost the reminders lease, stopping the dispatch.")
+                for future in pending:
+                    future.cancel()
+                break
+    for future in pending:
+        errors[futures[future]] = (RuntimeError("not sent: the reminders lease was lost") if future.cancelled()
+                                   else future.result())
+    return errors
+
+
+def dispatch_reminders(db: Session, now: datetime = None, pool_size: int = SMTP_POOL_SIZE,
+                       rate: float = SMTP_RATE_PER_SECOND, retries: int = SMTP_RETRIES,
+                       backoff: float = SMTP_BACKOFF_SECONDS, pool: SMTPPool = None) -> dict:
+    """
+    Email every recipient a digest of their overdue mails (the /overdue-mails set), over
+    `pool_size` concurrent reused connections at no more than `rate` messages per second,
+    then stamp reminder_sent_at for every mail whose digest went out, in one bulk update.
+    Mails in a failed digest stay unstamped, so the next run tries them again.
+
+    Raises RuntimeError if REMINDER_FROM isn't set, ValueError if another worker is dispatching.
+    """
+    if not REMINDER_FROM:
+        raise RuntimeError("reminders are not configured: set REMINDER_FROM (and REMINDER_DOMAIN to mail departments)")
+    now = now or datetime.utcnow()
+    if not leases.try_acquire(db, REMINDER_LEASE):
+        raise ValueError("a reminder dispatch is already in progress")
+    own_pool = pool is None
+    pool = pool or SMTPPool(pool_size)
+    try:
+        with metrics.span("reminders.select"):
+            digests = build_digests(overdue.overdue_mails(db, now), now)
+        limiter = RateLimiter(rate, burst=pool_size)
+        started = time.perf_counter()
+        with metrics.span("reminders.send", items=len(digests)):
+            errors = _send_all(db, pool, limiter, digests, pool_size, retries, backoff)
+        seconds = time.perf_counter() - started
+
+        sent_ids, failures = [], []
+        for digest, error in zip(digests, errors):
+            if error is None:
+                sent_ids.extend(digest["mail_ids"])
+            else:
+                failures.append({"to": digest["to"], "mail_ids": digest["mail_ids"], "error": str(error)})
+        sent = len(digests) - len(failures)
+        metrics.REMINDER_MESSAGES.inc(sent, "sent")
+        metrics.REMINDER_MESSAGES.inc(len(failures), "failed")
+
+        if sent_ids:
+            with metrics.span("reminders.mark", items=len(sent_ids)):
+                response_cache.invalidate(*MAIL_VIEWS, db=db)
+                bulk.mark_reminders(db, sent_ids, now)
+    finally:
+        if own_pool:
+            pool.close()
+        leases.release(db, REMINDER_LEASE)
+
+    for failure in failures:
+        print(f"⚠️ Reminder to {failure['to']} failed: {failure['error']}")
+    return {
+        "messages": len(digests),
+        "sent": sent,
+        "failed": len(failures),
+        "mails_reminded": len(sent_ids),
+        "connections": pool.opened,
+        "seconds": round(seconds, 3),
+        "messages_per_second": round(sent / seconds, 1) if seconds else 0.0,
+        "failures": failures,
+    }
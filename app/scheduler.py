@@ -0,0 +1,196 @@
+import asyncio
+import heapq
+import os
+import traceback
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+
+from .models import Mail
+from . import alerts, counters, events
+from .cache import MAIL_VIEWS, response_cache
+
+# Threshold used when a mail has no custom_threshold_hours
+DEFAULT_THRESHOLD_HOURS = 48
+# Deadlines further out than this are not kept in memory; the heap is reloaded when it runs out
+SCHEDULER_HORIZON = timedelta(hours=int(os.getenv("SCHEDULER_HORIZON_HOURS", "6")))
+# Deadlines set through other workers never reach this worker's heap directly; the leader
+# reloads it at least this often so they are picked up anyway (see app/leases.py)
+SCHEDULER_RESYNC = timedelta(seconds=int(os.getenv("SCHEDULER_RESYNC_SECONDS", "60")))
+# Due mails are claimed and committed this many at a time
+NOTIFY_BATCH_SIZE = int(os.getenv("NOTIFY_BATCH_SIZE", "500"))
+
+
+def compute_due_at(date_sent, threshold_hours=None):
+    """When a mail becomes overdue (naive UTC, like the rest of the table)."""
+    if date_sent is None:
+        return None
+    if date_sent.tzinfo is not None:
+        date_sent = date_sent.astimezone(timezone.utc).replace(tzinfo=None)
+    return date_sent + timedelta(hours=threshold_hours or DEFAULT_THRESHOLD_HOURS)
+
+
+def _due_filter(now: datetime):
+    return (Mail.status == "pending", Mail.notified == False, Mail.due_at <= now)
+
+
+def load_deadlines(db: Session, until: datetime) -> list:
+    """(due_at, id) of every pending, un-notified mail due by `until` - an index range scan."""
+    return [tuple(row) for row in db.query(Mail.due_at, Mail.id).filter(*_due_filter(until)).all()]
+
+
+ALERT_COLUMNS = (Mail.id, Mail.eksu_ref, Mail.sender, Mail.recipient, Mail.custom_threshold_hours, Mail.name)
+
+
+def _claim_due(db: Session, now: datetime, stamp: datetime, limit: int) -> list:
+    """
+    Mark up to `limit` due mails as notified and return them, oldest id first. Callers
+    running at the same time (e.g. a new leader while the old one finishes) each get
+    different mails, so nobody sends an alert twice.
+    """
+    if db.get_bind().dialect.update_returning:
+        # SQLite 3.35+: one UPDATE ... RETURNING picks the batch and claims it atomically
+        batch = select(Mail.id).where(*_due_filter(now)).order_by(Mail.id).limit(limit).scalar_subquery()
+        rows = db.execute(
+            update(Mail).where(Mail.id.in_(batch), *_due_filter(now))
+            .values(notified=True, notified_at=stamp).returning(*ALERT_COLUMNS),
+            execution_options={"synchronize_session": False}
+        ).all()
+        return sorted(rows, key=lambda row: row.id)
+    # MySQL: lock the batch, skipping rows another transaction is claiming
+    rows = db.execute(
+        select(*ALERT_COLUMNS).where(*_due_filter(now)).order_by(Mail.id).limit(limit)
+        .with_for_update(skip_locked=True)
+    ).all()
+    if rows:
+        db.execute(
+            update(Mail).where(Mail.id.in_([row.id for row in rows])).values(notified=True, notified_at=stamp),
+            execution_options={"synchronize_session": False}
+        )
+    return rows
+
+
+def _next_stamp(db: Session, now: datetime) -> datetime:
+    """
+    notified_at for this run: `now` in whole seconds (what MySQL DATETIME columns store), but
+    always later than any stamp already handed out. Alert cursors are (notified_at, id), so
+    this keeps them increasing even when the scheduler fires twice in one second and the
+    second run claims lower ids; otherwise clients past the first run would skip those alerts.
+    """
+    stamp = now.replace(microsecond=0)
+    latest = db.query(func.max(Mail.notified_at)).scalar()  # ix_mails_notified_at_id
+    if latest is not None and stamp <= latest:
+        stamp = latest.replace(microsecond=0) + timedelta(seconds=1)
+    return stamp
+
+
+def notify_due_mails(db: Session, now: datetime = None, batch_size: int = NOTIFY_BATCH_SIZE) -> list:
+    """
+    Mark every mail that is due by `now` as notified and return the alerts for them.
+    Mails are claimed and committed `batch_size` at a time, so row locks stay short.
+    """
+    now = now or datetime.utcnow()
+    stamp = _next_stamp(db, now)
+    claimed = []
+    while True:
+        rows = _claim_due(db, now, stamp, batch_size)
+        if not rows:
+            break
+        delta = Counter()
+        for row in rows:
+            counters.diff((row.name, "pending", False, row.custom_threshold_hours),
+                          (row.name, "pending", True, row.custom_threshold_hours), delta)
+        counters.apply(db, delta)
+        events.record(db, [events.for_mail(row, events.NOTIFIED, stamp) for row in rows])
+        response_cache.invalidate(*MAIL_VIEWS, db=db)
+        db.commit()
+        claimed += rows
+        if len(rows) < batch_size:
+            break
+    return [alerts.make_alert(*row[:5], stamp) for row in claimed]
+
+
+class DeadlineScheduler:
+    """
+    Sleeps until the next mail deadline instead of polling.
+
+    Keeps a min-heap of (due_at, mail id) for deadlines inside SCHEDULER_HORIZON and wakes
+    up when the earliest one passes (or when the heap is due a reload: the horizon ran out,
+    or SCHEDULER_RESYNC passed). The database stays the source of truth: a wake-up just runs `fire`, which
+    notifies whatever is due by then, so stale heap entries cost nothing but a wake-up.
+    """
+
+    def __init__(self, horizon: timedelta = SCHEDULER_HORIZON, resync: timedelta = SCHEDULER_RESYNC):
+        self.horizon = horizon
+        self.resync = resync
+        self._heap = []
+        self._horizon_end = None
+        self._reload_at = None
+        self._loop = None
+        self._wakeup = None
+        self._stale = True
+        self.runs = 0
+
+    def schedule(self, mail_id: int, due_at: datetime):
+        """Thread-safe: a mail got a new (or earlier) deadline."""
+        if self._loop is not None and due_at is not None:
+            self._loop.call_soon_threadsafe(self._push, due_at, mail_id)
+
+    def refresh(self):
+        """Thread-safe: many deadlines changed (e.g. after an upload); reload the heap."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._mark_stale)
+
+    def _push(self, due_at, mail_id):
+        if self._horizon_end is None or due_at <= self._horizon_end:
+            heapq.heappush(self._heap, (due_at, mail_id))
+            self._wakeup.set()
+
+    def _mark_stale(self):
+        self._stale = True
+        self._wakeup.set()
+
+    def next_deadline(self):
+        return self._heap[0][0] if self._heap else None
+
+    async def run(self, load, fire):
+        """
+        `load(until)` returns (due_at, id) pairs due by `until`; `fire(now)` notifies what is
+        due. Both are blocking and run in the threadpool.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._stale = True  # e.g. a worker that just became leader: the heap is someone else's history
+        while True:
+            try:
+                self._wakeup.clear()
+                now = datetime.utcnow()
+                if self._stale or now >= self._reload_at:
+                    self._stale = False
+                    self._horizon_end = now + self.horizon
+                    self._reload_at = min(self._horizon_end, now + self.resync)
+                    self._heap = await run_in_threadpool(load, self._horizon_end)
+                    heapq.heapify(self._heap)
+                if self._heap and self._heap[0][0] <= now:
+                    while self._heap and self._heap[0][0] <= now:
+                        heapq.heappop(self._heap)
+                    self.runs += 1
+                    await run_in_threadpool(fire, now)
+                    continue
+                wake_at = min(self.next_deadline() or self._reload_at, self._reload_at)
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), (wake_at - now).total_seconds())
+                except asyncio.TimeoutError:
+                    pass
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                traceback.print_exc()
+                self._stale = True
+                await asyncio.sleep(5)
+
+
+scheduler = DeadlineScheduler()
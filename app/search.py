@@ -0,0 +1,147 @@
+import os
+import re
+
+from sqlalchemy import DDL, column, event, func, literal_column, select, table, text
+from sqlalchemy.dialects.mysql import match
+from sqlalchemy.orm import Session
+
+from .listing import LIST_COLUMNS, list_columns
+from .archive import for_archive
+from .models import Mail, MailArchive
+
+SEARCH_LIMIT = 50
+MAX_SEARCH_LIMIT = 200
+# Shortest term searched for; shorter fragments match too much to be useful
+MIN_TERM_LENGTH = 2
+# InnoDB doesn't index words shorter than innodb_ft_min_token_size (3 by default), and a
+# required +term* below it matches nothing, so on MySQL shorter terms are left out of the
+# query. Set this to the server's value if it's been changed.
+MYSQL_MIN_TERM_LENGTH = int(os.getenv("MYSQL_FT_MIN_TOKEN_SIZE", "3"))
+# Ranking is done over at most this many matches, the newest ones. Scoring every hit of
+# a word found in a fifth of a million mails takes hundreds of ms; this keeps it to ~20ms
+SEARCH_RANK_WINDOW = int(os.getenv("SEARCH_RANK_WINDOW", "5000"))
+
+# --- SQLite: FTS5 index over the text columns ---
+# An external-content table (the text stays in mails, the index holds only tokens),
+# kept in sync by triggers so every write path (create_mail, uploads, deletes) updates it.
+# prefix='2 3' pre-indexes short prefixes so "fin*" is as cheap as a whole word.
+# The archive (app/archive.py) has its own, so moving a mail moves it between indexes.
+FTS_TABLES = {"mails": "mails_fts", "mails_archive": "mails_archive_fts"}
+FTS_TABLE = FTS_TABLES["mails"]
+
+
+def fts_ddl(source: str, fts: str) -> tuple:
+    return (
+        f"""CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+            document, sender, recipient,
+            content='{source}', content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+        )""",
+        f"""CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {source} BEGIN
+            INSERT INTO {fts}(rowid, document, sender, recipient)
+            VALUES (new.id, new.document, new.sender, new.recipient);
+        END""",
+        f"""CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {source} BEGIN
+            INSERT INTO {fts}({fts}, rowid, document, sender, recipient)
+            VALUES ('delete', old.id, old.document, old.sender, old.recipient);
+        END""",
+        # Only edits to the indexed columns touch the index; status updates don't
+        f"""CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF document, sender, recipient ON {source} BEGIN
+            INSERT INTO {fts}({fts}, rowid, document, sender, recipient)
+            VALUES ('delete', old.id, old.document, old.sender, old.recipient);
+            INSERT INTO {fts}(rowid, document, sender, recipient)
+            VALUES (new.id, new.document, new.sender, new.recipient);
+        END""",
+    )
+
+
+# Fresh databases (create_all) get the index with the table; existing ones via ensure_index
+for _model in (Mail, MailArchive):
+    for _statement in fts_ddl(_model.__tablename__, FTS_TABLES[_model.__tablename__]):
+        event.listen(_model.__table__, "after_create", DDL(_statement).execute_if(dialect="sqlite"))
+
+
+def ensure_index(bind):
+    """
+    Create the SQLite FTS5 indexes and triggers if they're missing, and index the mails
+    already there. MySQL's FULLTEXT indexes are declared on the models and kept up to
+    date by InnoDB itself, so there's nothing to do there.
+    """
+    if bind.dialect.name != "sqlite":
+        return
+    with bind.begin() as conn:
+        for source, fts in FTS_TABLES.items():
+            exists = conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": fts}
+            ).first()
+            for statement in fts_ddl(source, fts):
+                conn.execute(text(statement))
+            if not exists:
+                conn.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+                print(f"✅ Search index {fts} built.")
+
+
+def min_term_length(db: Session) -> int:
+    return MYSQL_MIN_TERM_LENGTH if db.get_bind().dialect.name == "mysql" else MIN_TERM_LENGTH
+
+
+def search_terms(query: str, min_length: int = MIN_TERM_LENGTH) -> list:
+    """The words of a search box query; punctuation, operators and words under `min_length` are dropped."""
+    return [t for t in re.findall(r"\w+", query) if len(t) >= min_length]
+
+
+def _fts5_query(terms: list) -> str:
+    # Every term required, each as a prefix: "fin rep" finds "Finance report"
+    return " ".join(f'"{t}"*' for t in terms)
+
+
+def _boolean_mode_query(terms: list) -> str:
+    return " ".join(f"+{t}*" for t in terms)
+
+
+def _ranked(db: Session, model, terms: list, clauses: list, limit: int):
+    """One tier's best `limit` rows among its newest SEARCH_RANK_WINDOW matches."""
+    if db.get_bind().dialect.name == "mysql":
+        score = match(model.document, model.sender, model.recipient,
+                      against=_boolean_mode_query(terms)).in_boolean_mode()
+        matches = select(*list_columns(model=model), score.label("score")).where(score)
+        newest = model.id.desc()
+    else:
+        fts_name = FTS_TABLES[model.__tablename__]
+        fts = table(fts_name, column("rowid"))
+        # bm25() is lower-is-better; negate it so both backends rank the same way
+        score = -func.bm25(literal_column(fts_name))
+        matches = (
+            select(*list_columns(model=model), score.label("score"))
+            .select_from(fts)
+            .join(model, model.id == fts.c.rowid)
+            .where(literal_column(fts_name).op("MATCH")(_fts5_query(terms)))
+        )
+        # The index returns rowids in order, so this stops after the window; scores are
+        # only computed for the rows it returns
+        newest = fts.c.rowid.desc()
+
+    window = matches.where(*clauses).order_by(newest).limit(SEARCH_RANK_WINDOW).subquery()
+    return db.execute(select(window).order_by(window.c.score.desc(), window.c.id.desc()).limit(limit)).all()
+
+
+def search_mails(db: Session, query: str, clauses: list, limit: int = SEARCH_LIMIT, skip: int = 0,
+                 include_archived: bool = True) -> list:
+    """
+    Mails whose document, sender or recipient contain every word of `query` (as a
+    prefix), best match first among the newest SEARCH_RANK_WINDOW matches of each tier
+    (live and, with `include_archived`, mails_archive). Each row is a /mails row plus
+    its relevance `score` (higher is better). Raises ValueError if the query has no
+    searchable words.
+    """
+    min_length = min_term_length(db)
+    terms = search_terms(query, min_length)
+    if not terms:
+        raise ValueError(f"nothing to search for in {query!r}; use words of {min_length}+ characters")
+
+    rows = _ranked(db, Mail, terms, clauses, skip + limit)
+    if include_archived:
+        archived = _ranked(db, MailArchive, terms, [for_archive(c) for c in clauses], skip + limit)
+        rows = sorted([*rows, *archived], key=lambda row: (row.score, row.id), reverse=True)
+    keys = [*LIST_COLUMNS, "score"]
+    return [dict(zip(keys, row)) for row in rows[skip:skip + limit]]
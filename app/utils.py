@@ -1,8 +1,18 @@
 from datetime import datetime, timedelta
+from collections import Counter
+from sqlalchemy import false, insert, or_, update
 from sqlalchemy.orm import Session
-from .models import Mail
+from .models import Mail, MailArchive, MailStatus
+from . import counters, events, metrics, refs
+from .cache import MAIL_VIEWS, response_cache
+from .matcher import ReplyMatcher, pair_key
+from .scheduler import compute_due_at, scheduler
 from dateutil import parser
+import numpy as np
+import openpyxl
 import pandas as pd
+import itertools
+import os
 import random
 
 # --- EKSU Reference Generator ---
@@ -10,27 +20,216 @@ def generate_eksu_ref(db: Session):
     """
     Generates a new sequential EKSU reference like EKSU0001, EKSU0002, etc.
     """
-    # Get the highest existing EKSU ref
-    last_ref = db.query(Mail.eksu_ref).filter(Mail.eksu_ref.isnot(None)).order_by(Mail.eksu_ref.desc()).first()
-    if last_ref and last_ref[0]:
-        # Extract the number part, e.g., from "EKSU0001" get 1
-        num_str = last_ref[0][4:]  # Skip "EKSU"
-        try:
-            num = int(num_str)
-            next_num = num + 1
-        except ValueError:
-            next_num = 1
-    else:
-        next_num = 1
-    return f"EKSU{next_num:04d}"
+    return refs.allocate_eksu_refs(db, 1)[0]
+
+
+def generate_eksu_refs(db: Session, count: int) -> list:
+    """
+    Generates `count` consecutive EKSU references with a single counter update.
+    """
+    return refs.allocate_eksu_refs(db, count)
 
 # --- Excel Parsing ---
-def parse_excel_to_rows(file_like) -> list:
+# Column aliases, checked in order: the first truthy value wins (same as `a or b or c`)
+NAME_COLUMNS = ("name", "department", "dept")
+SENDER_COLUMNS = ("sender", "from", "sender_email")
+DOCUMENT_COLUMNS = ("document", "subject", "mail_subject")
+RECIPIENT_COLUMNS = ("recipient", "to", "receiver", "recipient_email")
+DATE_SENT_COLUMNS = ("date", "date_sent", "sent_date")
+STATUS_COLUMNS = ("status",)
+RESPONSE_DATE_COLUMNS = ("response_date", "reply_date", "received_date")
+
+# Formats tried on whole date columns before falling back to dateutil per cell.
+# All of them are strict, so anything they accept dateutil parses the same way.
+KNOWN_DATE_FORMATS = (
+    "%Y-%m-%d",
+    "%Y-%m-%d %H:%M:%S",
+    "%Y-%m-%d %H:%M",
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y/%m/%d",
+    "%Y/%m/%d %H:%M",
+    "%m/%d/%Y",
+    "%m/%d/%Y %H:%M",
+    "%d %b %Y",
+)
+
+PARSE_BATCH_SIZE = 5000
+
+
+def _read_sheet(file_like) -> pd.DataFrame:
     try:
         df = pd.read_excel(file_like)
     except Exception:
         df = pd.read_csv(file_like)
     df.columns = [c.strip().lower() for c in df.columns]
+    return df
+
+
+def _coalesce_columns(df: pd.DataFrame, aliases, default=None) -> list:
+    """
+    Column-wise version of `r.get(a) or r.get(b) or ...` - aliases are resolved once per frame.
+    """
+    columns = [df[c].tolist() if c in df.columns else None for c in aliases]
+    result = columns[0] if columns[0] is not None else [None] * len(df)
+    for col in columns[1:]:
+        if col is None:
+            result = [v or None for v in result]
+        else:
+            result = [v or alt for v, alt in zip(result, col)]
+    if default is not None:
+        result = [v or default for v in result]
+    return result
+
+
+def _parse_date_column(values: list) -> list:
+    """
+    Parse a whole column of date cells. Falsy/NaN/unparseable cells become None.
+    Strings matching KNOWN_DATE_FORMATS and datetime cells are converted in bulk;
+    only the leftovers go through dateutil one at a time.
+    """
+    out = [None] * len(values)
+    strings = {}
+    leftovers = []
+    for i, v in enumerate(values):
+        if not v:
+            continue
+        if isinstance(v, str):
+            strings[i] = v
+        elif v is pd.NaT or (isinstance(v, float) and v != v):
+            continue  # NaT/NaN never parse
+        elif isinstance(v, pd.Timestamp):
+            if v.tzinfo is not None or v.nanosecond:
+                leftovers.append(i)
+            else:
+                out[i] = v.to_pydatetime()
+        elif isinstance(v, datetime) and v.tzinfo is None:
+            out[i] = v  # openpyxl read-only cells
+        else:
+            leftovers.append(i)
+
+    for fmt in KNOWN_DATE_FORMATS:
+        if not strings:
+            break
+        idx = list(strings)
+        parsed = pd.to_datetime(pd.Series([strings[i] for i in idx]), format=fmt, errors="coerce")
+        ok = parsed.notna().to_numpy()
+        converted = pd.DatetimeIndex(parsed[ok]).to_pydatetime()
+        for i, dt in zip((i for i, hit in zip(idx, ok) if hit), converted):
+            out[i] = dt
+            del strings[i]
+
+    leftovers.extend(strings)
+    for i in leftovers:
+        try:
+            out[i] = parser.parse(str(values[i]))
+        except Exception:
+            out[i] = None
+    return out
+
+
+def _frame_to_rows(df: pd.DataFrame) -> list:
+    names = _coalesce_columns(df, NAME_COLUMNS)
+    senders = _coalesce_columns(df, SENDER_COLUMNS)
+    documents = _coalesce_columns(df, DOCUMENT_COLUMNS)
+    recipients = _coalesce_columns(df, RECIPIENT_COLUMNS)
+    dates_sent = _parse_date_column(_coalesce_columns(df, DATE_SENT_COLUMNS))
+    statuses = _coalesce_columns(df, STATUS_COLUMNS, default="pending")
+    response_dates = _parse_date_column(_coalesce_columns(df, RESPONSE_DATE_COLUMNS))
+    return [
+        {
+            "name": name,
+            "sender": sender,
+            "document": document,
+            "recipient": recipient,
+            "date_sent": date_sent,
+            "status": status,
+            "response_date": response_date
+        }
+        for name, sender, document, recipient, date_sent, status, response_date in zip(
+            names, senders, documents, recipients, dates_sent, statuses, response_dates
+        )
+    ]
+
+
+def iter_excel_row_batches(file_like, batch_size: int = PARSE_BATCH_SIZE):
+    """
+    Parse an Excel/CSV upload column-by-column and yield the rows in lists of `batch_size`.
+    """
+    df = _read_sheet(file_like)
+    for start in range(0, len(df), batch_size):
+        yield _frame_to_rows(df.iloc[start:start + batch_size])
+
+
+def _iter_csv_frames(file_like, batch_size: int):
+    for df in pd.read_csv(file_like, chunksize=batch_size):
+        df.columns = [c.strip().lower() for c in df.columns]
+        yield df
+
+
+def _iter_xlsx_frames(file_like, batch_size: int):
+    wb = openpyxl.load_workbook(file_like, read_only=True, data_only=True)
+    try:
+        cells = wb.active.iter_rows(values_only=True)
+        header = next(cells, None)
+        if header is None:
+            return
+        # Same column names read_excel would give, lowercased
+        columns = [
+            str(c).strip().lower() if c is not None else f"unnamed: {i}"
+            for i, c in enumerate(header)
+        ]
+        batch = []
+        blank = 0  # blank rows not added yet: read_excel keeps them, except after the last row with data
+        for values in cells:
+            if all(v is None for v in values):
+                blank += 1
+                continue
+            if len(values) < len(columns):
+                # Sheets without a stored dimension (e.g. written in write-only mode) drop trailing empty cells
+                values = values + (None,) * (len(columns) - len(values))
+            for row in itertools.chain(itertools.repeat((None,) * len(columns), blank), [values]):
+                batch.append(row)
+                if len(batch) == batch_size:
+                    yield _cells_to_frame(batch, columns)
+                    batch = []
+            blank = 0
+        if batch:
+            yield _cells_to_frame(batch, columns)
+    finally:
+        wb.close()
+
+
+def _cells_to_frame(batch: list, columns: list) -> pd.DataFrame:
+    df = pd.DataFrame.from_records(batch, columns=columns)
+    # Empty cells come back as None; read_excel would have given NaN
+    return df.astype(object).where(df.notna(), np.nan)
+
+
+def iter_upload_row_batches(file_like, filename: str, batch_size: int = PARSE_BATCH_SIZE):
+    """
+    Streaming variant of iter_excel_row_batches: CSV is read `batch_size` rows at a time and
+    XLSX through openpyxl's read-only mode, so only one batch is ever held in memory.
+    """
+    if filename.lower().endswith(".csv"):
+        frames = _iter_csv_frames(file_like, batch_size)
+    else:
+        frames = _iter_xlsx_frames(file_like, batch_size)
+    for df in frames:
+        yield _frame_to_rows(df)
+
+
+def parse_excel_to_rows(file_like) -> list:
+    rows = []
+    for batch in iter_excel_row_batches(file_like):
+        rows.extend(batch)
+    return rows
+
+
+def parse_excel_to_rows_iterrows(file_like) -> list:
+    """
+    Original row-by-row parser. Kept as the reference implementation for benchmarks/bench_parse.py.
+    """
+    df = _read_sheet(file_like)
     rows = []
     for _, r in df.iterrows():
         date_val = None
@@ -67,7 +266,277 @@ def parse_excel_to_rows(file_like) -> list:
     return rows
 
 # --- Matching + Database Logic ---
-def simple_match_and_upsert(rows: list, db: Session):
+# Rows per transaction in simple_match_and_upsert
+UPSERT_CHUNK_SIZE = int(os.getenv("UPSERT_CHUNK_SIZE", "1000"))
+VALID_STATUSES = {s.value for s in MailStatus}
+
+
+def _casefold(value):
+    return value.casefold() if isinstance(value, str) else value
+
+
+def _key_fold(db: Session):
+    """
+    How the database compares the text columns of a natural key, for matching in Python:
+    MySQL's default *_ci collations ignore case, SQLite's BINARY doesn't.
+    """
+    return _casefold if db.get_bind().dialect.name == "mysql" else None
+
+
+def _natural_key(r, fold=None) -> tuple:
+    if fold is None:
+        return (r["sender"], r["recipient"], r["document"], r["date_sent"])
+    return (fold(r["sender"]), fold(r["recipient"]), fold(r["document"]), r["date_sent"])
+
+
+def _in_or_null(column, values):
+    """`column IN (...)`, plus `OR column IS NULL` when None is among the values."""
+    present = {v for v in values if v is not None}
+    clauses = []
+    if present:
+        clauses.append(column.in_(present))
+    if len(present) < len(values):
+        clauses.append(column.is_(None))
+    return or_(*clauses) if clauses else false()
+
+
+def _status_value(status):
+    return status.value if isinstance(status, MailStatus) else status
+
+
+# Extra columns read for existing mails so the dashboard counters can be adjusted
+COUNTED_COLUMNS = (Mail.name, Mail.notified, Mail.custom_threshold_hours)
+
+
+def _counted(m, status) -> dict:
+    # The fields plus a snapshot of what the mail currently counts as
+    return {"name": m.name, "notified": m.notified, "custom_threshold_hours": m.custom_threshold_hours,
+            "counted": (m.name, status, m.notified, m.custom_threshold_hours)}
+
+
+def _counter_state(state) -> tuple:
+    return (state["name"], state["status"], state.get("notified"), state.get("custom_threshold_hours"))
+
+
+def _update_values(state) -> dict:
+    values = {"id": state["id"], "status": state["status"]}
+    if "response_date" in state:
+        values["response_date"] = state["response_date"]
+    if "matched_to" in state:
+        values["matched_to_id"] = state["matched_to"]["id"]
+    return values
+
+
+def _timeline_events(state, now: datetime) -> list:
+    """Status change (and reply match) events for one mail touched by an upsert chunk."""
+    found = []
+    if state["status"] != state["arrived_as"]:
+        # A reply completes the mail as of the reply's date, not the upload's
+        at = state.get("response_date") if state["status"] == "completed" else None
+        found.append(events.event(state["id"], events.STATUS, at or now, state["status"],
+                                  state["name"], state["sender"]))
+    if "matched_to" in state:
+        found.append(events.event(state["id"], events.MATCHED, state["response_date"] or now,
+                                  state["matched_to"]["id"], state["name"], state["sender"]))
+    return found
+
+
+def _upsert_chunk(rows: list, db: Session) -> dict:
+    if not rows:
+        return {"inserted": 0, "updated": 0, "matched": 0, "candidates_checked": 0, "archived": 0}
+    states = {}   # mail id -> state, for rows already in the database
+    by_key = {}   # natural key -> state (database rows and rows inserted by this chunk)
+    new_states = []
+
+    with metrics.span("upsert.lookup"):
+        # 1. Existing mails for every natural key in the chunk, in one query
+        fold = _key_fold(db)
+        keys = {_natural_key(r, fold) for r in rows}
+        existing = db.query(
+            Mail.id, Mail.sender, Mail.recipient, Mail.document, Mail.date_sent, Mail.status, *COUNTED_COLUMNS
+        ).filter(
+            _in_or_null(Mail.sender, {k[0] for k in keys}),
+            _in_or_null(Mail.recipient, {k[1] for k in keys}),
+            _in_or_null(Mail.date_sent, {k[3] for k in keys}),
+        ).order_by(Mail.id.asc()).all()
+        for m in existing:
+            key = _natural_key(m._mapping, fold)
+            if key not in keys or key in by_key:
+                continue
+            state = {"id": m.id, "seq": (0, m.id), "sender": m.sender, "recipient": m.recipient,
+                     "document": m.document, "date_sent": m.date_sent, "status": _status_value(m.status),
+                     **_counted(m, _status_value(m.status))}
+            states[m.id] = by_key[key] = state
+
+        # Rows for mails already moved to mails_archive are skipped, so re-uploading an old
+        # sheet doesn't bring them back as new mails
+        archived_keys = {
+            _natural_key(m._mapping, fold) for m in db.query(
+                MailArchive.sender, MailArchive.recipient, MailArchive.document, MailArchive.date_sent
+            ).filter(
+                _in_or_null(MailArchive.sender, {k[0] for k in keys}),
+                _in_or_null(MailArchive.recipient, {k[1] for k in keys}),
+                _in_or_null(MailArchive.date_sent, {k[3] for k in keys}),
+            )
+        } & (keys - by_key.keys())
+
+        # 2. Pending mails that the replies in this chunk could answer, in one query
+        reply_pairs = {pair_key(r["recipient"], r["sender"], fold) for r in rows if r["response_date"]}
+        matcher = ReplyMatcher(reply_pairs, fold=fold)
+        if reply_pairs:
+            pending = db.query(
+                Mail.id, Mail.sender, Mail.recipient, Mail.document, Mail.date_sent, *COUNTED_COLUMNS
+            ).filter(
+                Mail.status == "pending",
+                _in_or_null(Mail.sender, {p[0] for p in reply_pairs}),
+                _in_or_null(Mail.recipient, {p[1] for p in reply_pairs}),
+            ).all()
+            for m in pending:
+                if pair_key(m.sender, m.recipient, fold) not in reply_pairs:
+                    continue
+                states.setdefault(m.id, {
+                    "id": m.id, "seq": (0, m.id), "sender": m.sender, "recipient": m.recipient,
+                    "document": m.document, "date_sent": m.date_sent, "status": "pending", **_counted(m, "pending")
+                })
+        # Mails found by key stay candidates whatever their stored status: a row earlier
+        # in the chunk may set them back to pending before a reply arrives
+        for state in states.values():
+            matcher.add(state)
+
+    with metrics.span("upsert.refs"):
+        new_refs = iter(generate_eksu_refs(db, len(keys - by_key.keys() - archived_keys)))
+
+    with metrics.span("upsert.match"):
+        # 3. Apply the rows in order against the in-memory view
+        updated = skipped = 0
+        for r in rows:
+            key = _natural_key(r, fold)
+            if key in archived_keys:
+                skipped += 1
+                continue
+            state = by_key.get(key)
+
+            if state:
+                updated += 1
+                # Update existing mail
+                if r["status"]:
+                    state["status"] = r["status"]
+                if r["response_date"]:
+                    state["response_date"] = r["response_date"]
+                    state["status"] = "completed"  # Mark as completed if reply
+                state["dirty"] = True
+                continue
+
+            state = {
+                "id": None, "seq": (1, len(new_states)), "name": r["name"], "sender": r["sender"],
+                "document": r["document"], "recipient": r["recipient"], "date_sent": r["date_sent"],
+                "status": r["status"], "response_date": r["response_date"], "eksu_ref": next(new_refs),
+                # A row that arrives already answered was pending until its response date
+                "arrived_as": "pending" if r["status"] == "completed" and r["response_date"] else r["status"],
+            }
+            new_states.append(state)
+            by_key.setdefault(key, state)
+            matcher.add(state)
+
+            # ✅ Attempt to match replies
+            if r["response_date"]:
+                p = matcher.match(state)
+                if p:
+                    p["status"] = "completed"
+                    p["response_date"] = state["date_sent"]
+                    p["matched_to"] = state
+                    p["dirty"] = True
+
+    with metrics.span("upsert.write"):
+        # 4. Write back: one bulk insert, one id lookup, one bulk update
+        if new_states:
+            # render_nulls: rows with a None (e.g. no response_date) would otherwise start a new
+            # executemany batch each time the set of non-None columns changes
+            db.execute(insert(Mail).execution_options(render_nulls=True), [
+                {**{c: s[c] for c in ("name", "sender", "document", "recipient", "date_sent",
+                                      "status", "response_date", "eksu_ref")},
+                 "due_at": compute_due_at(s["date_sent"])}
+                for s in new_states
+            ])
+            ids = dict(db.query(Mail.eksu_ref, Mail.id).filter(
+                Mail.eksu_ref.in_([s["eksu_ref"] for s in new_states])
+            ).all())
+            for s in new_states:
+                s["id"] = ids[s["eksu_ref"]]
+
+        # New rows were inserted in their final state; they only still need matched_to_id
+        updates = [_update_values(s) for s in states.values() if s.get("dirty")]
+        updates += [_update_values(s) for s in new_states if "matched_to" in s]
+        # executemany wants identical parameter sets, so group by the columns being set
+        groups = {}
+        for values in updates:
+            groups.setdefault(tuple(values), []).append(values)
+        for group in groups.values():
+            db.execute(update(Mail), group)
+
+        # Dashboard counters move in the same transaction
+        delta = Counter()
+        for s in states.values():
+            if s.get("dirty"):
+                counters.diff(s["counted"], _counter_state(s), delta)
+        for s in new_states:
+            counters.diff(after=_counter_state(s), delta=delta)
+        counters.apply(db, delta)
+
+        # Timeline: arrivals, then status changes and matches, in one executemany
+        now = datetime.utcnow()
+        timeline = [events.event(s["id"], events.CREATED, s["date_sent"] or now, s["arrived_as"], s["name"], s["sender"])
+                    for s in new_states]
+        for s in [*states.values(), *new_states]:
+            if "arrived_as" not in s:
+                s["arrived_as"] = s["counted"][1]
+            timeline += _timeline_events(s, now)
+        events.record(db, timeline)
+
+        # Cached views go stale with this commit; new mails aren't notified yet, so only
+        # updates and matches can change /notifications
+        if updates:
+            response_cache.invalidate(*MAIL_VIEWS, db=db)
+        elif new_states:
+            response_cache.invalidate("mails", "overdue", db=db)
+        db.commit()
+    stats = matcher.stats()
+    return {"inserted": len(new_states), "updated": updated, "matched": stats["matched"],
+            "candidates_checked": stats["candidates_checked"], "archived": skipped}
+
+
+def _row_error(r):
+    if r["status"] not in VALID_STATUSES:
+        return f"invalid status {r['status']!r}"
+    return None
+
+
+def _upsert_chunk_collecting_errors(numbered_rows: list, db: Session, errors: list) -> dict:
+    good = []
+    for n, r in numbered_rows:
+        problem = _row_error(r)
+        if problem:
+            errors.append({"row": n, "error": problem, "data": r})
+        else:
+            good.append((n, r))
+    try:
+        return _upsert_chunk([r for _, r in good], db)
+    except Exception:
+        db.rollback()
+    # Retry one row per transaction to isolate the bad ones
+    stats = dict.fromkeys(("inserted", "updated", "matched", "candidates_checked", "archived"), 0)
+    for n, r in good:
+        try:
+            for k, v in _upsert_chunk([r], db).items():
+                stats[k] += v
+        except Exception as e:
+            db.rollback()
+            errors.append({"row": n, "error": str(getattr(e, "orig", None) or e), "data": r})
+    return stats
+
+
+def simple_match_and_upsert(rows: list, db: Session, chunk_size: int = UPSERT_CHUNK_SIZE,
+                            errors: list = None, row_offset: int = 0) -> dict:
     """
     For paper mail: matching is done by:
       - Check for existing mail by sender, recipient, document, date_sent.
@@ -75,59 +544,62 @@ def simple_match_and_upsert(rows: list, db: Session):
       - If new row has response_date -> treat as incoming reply; try to find earlier pending mail
         from the other party whose document matches (substring) and mark it completed.
       - Otherwise insert new pending mail.
+
+    Rows are processed in chunks of `chunk_size`: each chunk costs a fixed handful of
+    queries (existing-key lookup, reply candidates, bulk insert, bulk update) and one commit.
+    Reply candidates are indexed by app.matcher.ReplyMatcher.
+
+    By default the first bad row raises. If `errors` is a list, bad rows are skipped and
+    appended to it as {"row", "error", "data"} (row numbers start at row_offset + 1).
+
+    Returns counts of inserted, updated, matched and failed rows, and of rows skipped
+    because their mail has been archived.
     """
-    for r in rows:
-        existing = db.query(Mail).filter(
-            Mail.sender == r["sender"],
-            Mail.recipient == r["recipient"],
-            Mail.document == r["document"],
-            Mail.date_sent == r["date_sent"]
-        ).first()
-
-        if existing:
-            # Update existing mail
-            if r["status"] and r["status"] != existing.status:
-                existing.status = r["status"]
-            if r["response_date"]:
-                existing.response_date = r["response_date"]
-                existing.status = "completed"  # Mark as completed if reply
-            db.add(existing)
-            db.commit()
-            continue
+    totals = {"inserted": 0, "updated": 0, "matched": 0, "candidates_checked": 0, "archived": 0, "failed": 0}
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        # span_sql_statements_total / span_items_total for "upsert" = queries per row
+        with metrics.span("upsert", items=len(chunk)):
+            if errors is None:
+                stats = _upsert_chunk(chunk, db)
+            else:
+                before = len(errors)
+                numbered = list(enumerate(chunk, start=row_offset + start + 1))
+                stats = _upsert_chunk_collecting_errors(numbered, db, errors)
+                totals["failed"] += len(errors) - before
+        for k, v in stats.items():
+            totals[k] += v
+    if totals["inserted"]:
+        scheduler.refresh()  # new deadlines
+    return totals
 
-        eksu_ref = generate_eksu_ref(db)
-
-        new = Mail(
-            name=r["name"],
-            sender=r["sender"],
-            document=r["document"],
-            recipient=r["recipient"],
-            date_sent=r["date_sent"],
-            status=r["status"],
-            response_date=r["response_date"],
-            eksu_ref=eksu_ref  # 👈 Add EKSU ref here
-        )
 
-        db.add(new)
-        db.commit()
-        db.refresh(new)
-
-        # ✅ Attempt to match replies
-        if r["response_date"]:
-            possible = db.query(Mail).filter(
-                Mail.sender == r["recipient"],
-                Mail.recipient == r["sender"],
-                Mail.status == "pending"
-            ).order_by(Mail.date_sent.asc()).all()
-            for p in possible:
-                if p.document and new.document and p.document.lower() in new.document.lower():
-                    p.status = "completed"
-                    p.response_date = new.date_sent
-                    p.matched_to_id = new.id
-                    db.add(p)
-                    db.commit()
-                    break
+def ingest_upload(file_like, filename: str, db: Session, batch_size: int = PARSE_BATCH_SIZE,
+                  errors: list = None, progress=None) -> dict:
+    """
+    Streams an upload into the database: each parsed batch is upserted (and committed)
+    before the next one is read. Returns overall counts plus one entry per batch.
 
+    `errors` is passed on to simple_match_and_upsert; `progress`, if given, is called
+    with the running totals after every batch.
+    """
+    totals = {"count": 0, "inserted": 0, "updated": 0, "matched": 0, "candidates_checked": 0, "archived": 0,
+              "failed": 0}
+    chunks = []
+    batches = iter_upload_row_batches(file_like, filename, batch_size)
+    for i in itertools.count():
+        with metrics.span("parse"):
+            rows = next(batches, None)
+        if rows is None:
+            break
+        stats = simple_match_and_upsert(rows, db, errors=errors, row_offset=totals["count"])
+        chunks.append({"chunk": i, "rows": len(rows), **stats})
+        totals["count"] += len(rows)
+        for k, v in stats.items():
+            totals[k] += v
+        if progress:
+            progress(totals)
+    return {**totals, "chunks": chunks}
 
 
 def check_pending_mails_and_notify(db):
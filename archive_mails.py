@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Move completed mails older than ARCHIVE_AFTER_DAYS from mails to mails_archive.
+
+    python archive_mails.py                      # archive everything eligible
+    python archive_mails.py --days 730 --batches 20
+    python archive_mails.py --dry-run            # just say how many would move
+"""
+
+import argparse
+import sys
+
+from app import archive, search
+from app.database import SessionLocal, engine
+from app.models import MailArchive
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--days", type=int, default=archive.ARCHIVE_AFTER_DAYS, help="archive mails sent longer ago than this")
+    ap.add_argument("--batch-size", type=int, default=archive.ARCHIVE_BATCH_SIZE)
+    ap.add_argument("--batches", type=int, default=None, help="stop after this many batches")
+    ap.add_argument("--dry-run", action="store_true", help="don't move anything, just report")
+    args = ap.parse_args()
+
+    MailArchive.__table__.create(engine, checkfirst=True)
+    search.ensure_index(engine)
+    db = SessionLocal()
+    try:
+        if args.dry_run:
+            stats = archive.archive_stats(db, args.days)
+            print(f"{stats['eligible']} of {stats['live']} live mails would be archived "
+                  f"({stats['archived']} already are).")
+            return
+        try:
+            result = archive.archive_mails(
+                db, args.days, args.batch_size, args.batches,
+                progress=lambda archived, batches: print(f"  batch {batches}: {archived} archived")
+            )
+        except ValueError as e:
+            print(f"⚠️ {e}")
+            sys.exit(1)
+    finally:
+        db.close()
+
+    print(f"✅ Archived {result['archived']} mails in {result['batches']} batches "
+          f"({result['seconds']}s); {result['remaining']} eligible left.")
+
+
+if __name__ == "__main__":
+    main()
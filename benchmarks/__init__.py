@@ -0,0 +1,4 @@
+"""
+Benchmarks. generator.py makes seeded synthetic registry data, suite.py times the hot
+paths and writes JSON results; the bench_*.py scripts each look at one change in depth.
+"""
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+"""
+Benchmark: /export memory and throughput at different sizes.
+
+Seeds throwaway SQLite databases (1k and 200k mails by default), streams every format
+and reports rows/s and the peak Python heap while streaming (tracemalloc). The peak
+should stay flat as the row count grows.
+
+    python benchmarks/bench_export.py [--sizes 1000,200000] [--formats csv,ndjson,xlsx]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from app import export, models  # noqa: E402
+from benchmarks.generator import insert_mails  # noqa: E402
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--sizes", default="1000,200000")
+    ap.add_argument("--formats", default="csv,ndjson,xlsx")
+    args = ap.parse_args()
+
+    for size in [int(s) for s in args.sizes.split(",")]:
+        path = os.path.join(tempfile.mkdtemp(), "export.db")
+        engine = create_engine(f"sqlite:///{path}")
+        models.Base.metadata.create_all(bind=engine)
+        insert_mails(engine, size, datetime.utcnow())
+        export.SessionLocal = sessionmaker(bind=engine)
+
+        for fmt in args.formats.split(","):
+            tracemalloc.start()
+            started = time.perf_counter()
+            written = sum(len(chunk) for chunk in export.export_stream(fmt, []))
+            elapsed = time.perf_counter() - started
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            print(f"{size:8} rows  {fmt:6}  {written / 1e6:8.1f} MB out  {size / elapsed:9.0f} rows/s  "
+                  f"peak heap {peak / 1e6:6.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Benchmark: /mails page latency, OFFSET vs keyset cursor, shallow vs deep pages.
+
+Seeds a throwaway SQLite database (1M mails by default) and times GET /mails through
+the FastAPI app at page 1 and page 5000 (200 rows per page), with and without filters.
+
+    python benchmarks/bench_mails_paging.py [--rows 1000000] [--page 5000]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from app import listing, models  # noqa: E402
+from app.database import make_async_engine  # noqa: E402
+from app.cache import response_cache  # noqa: E402
+from app.main import app, get_async_db, get_db  # noqa: E402
+from benchmarks.generator import address, insert_mails, timed  # noqa: E402
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--rows", type=int, default=1_000_000)
+    ap.add_argument("--page", type=int, default=5000)
+    args = ap.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "paging.db")
+    engine = create_engine(f"sqlite:///{path}")
+    models.Base.metadata.create_all(bind=engine)
+    started = time.perf_counter()
+    # Half pending, so the status filter has deep pages too
+    insert_mails(engine, args.rows, datetime.utcnow(), pending=0.5)
+    print(f"seeded {args.rows} mails in {time.perf_counter() - started:.1f}s")
+
+    Session = sessionmaker(bind=engine)
+
+    def bench_db():
+        db = Session()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    async_engine = make_async_engine(f"sqlite+aiosqlite:///{path}")
+    AsyncSession = async_sessionmaker(async_engine, expire_on_commit=False)
+
+    async def bench_async_db():
+        async with AsyncSession() as db:
+            yield db
+
+    app.dependency_overrides[get_db] = bench_db
+    app.dependency_overrides[get_async_db] = bench_async_db
+    client = TestClient(app)
+    response_cache.ttl = 0  # time the queries, not the response cache
+    size = listing.PAGE_SIZE
+
+    def get(params):
+        r = client.get("/mails", params=params)
+        assert r.status_code == 200, r.text
+
+    for filters in ({}, {"status": "pending"}, {"sender": address("Bursary")}):
+        clauses = listing.filter_clauses(**filters)
+        # Cursor for the start of the deep page, found once (untimed) with OFFSET
+        with Session() as db:
+            matching = db.scalar(select(func.count()).select_from(models.Mail).where(*clauses))
+            deep = min(args.page, matching // size - 1)
+            rows, _ = listing.list_page(db, clauses, 1, skip=(deep - 1) * size - 1)
+        cursor = listing.encode_cursor(rows[0]["date_sent"], rows[0]["id"])
+
+        first = timed(lambda: get({**filters, "limit": size}))
+        offset_deep = timed(lambda: get({**filters, "limit": size, "skip": (deep - 1) * size}))
+        keyset_deep = timed(lambda: get({**filters, "limit": size, "cursor": cursor}))
+        label = ",".join(f"{k}={v}" for k, v in filters.items()) or "no filter"
+        print(f"{label:30} page 1: {first:7.1f}ms   page {deep} offset: {offset_deep:7.1f}ms   "
+              f"page {deep} keyset: {keyset_deep:7.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
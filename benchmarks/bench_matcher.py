@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Benchmark: ReplyMatcher vs scanning every pending mail of the reversed pair.
+
+Builds pending mails and replies spread over a handful of busy department pairs and
+resolves the replies three ways, checking they pick the same mails: the old scan,
+ReplyMatcher with every pair indexed up front, and ReplyMatcher as uploads use it
+(pairs indexed after INDEX_AFTER_LOOKUPS lookups). Indexing only pays off for pairs
+looked up many times, so it runs at several sizes (or the one given) to show where.
+
+    python benchmarks/bench_matcher.py [--pending 100000 --replies 10000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from app import matcher as matcher_module  # noqa: E402
+from app.matcher import ReplyMatcher, pending_order  # noqa: E402
+
+DEPARTMENTS = ["registry", "bursary", "admissions", "exams", "library", "works"]
+TOPICS = ["leave", "budget", "results", "transcript", "promotion", "allocation", "procurement"]
+
+
+def make_data(n_pending: int, n_replies: int, seed: int = 7):
+    rnd = random.Random(seed)
+    start = datetime(2023, 1, 1)
+    pending = []
+    for i in range(n_pending):
+        a, b = rnd.sample(DEPARTMENTS, 2)
+        pending.append({
+            "seq": (0, i), "sender": a, "recipient": b, "status": "pending",
+            "document": f"Memo {i} on {rnd.choice(TOPICS)}",
+            "date_sent": start + timedelta(minutes=rnd.randrange(0, 60 * 24 * 365)),
+        })
+    replies = []
+    for j in range(n_replies):
+        original = rnd.choice(pending)
+        document = f"RE: {original['document']} (approved)" if rnd.random() < 0.8 else f"Unrelated note {j}"
+        replies.append({
+            "seq": (1, j), "sender": original["recipient"], "recipient": original["sender"],
+            "document": document, "status": "pending", "date_sent": original["date_sent"] + timedelta(days=2),
+        })
+    return pending, replies
+
+
+def scan(pending, replies):
+    """The old strategy: walk the pair's pending mails oldest first, substring-check each."""
+    pools = {}
+    for m in pending:
+        pools.setdefault((m["sender"], m["recipient"]), []).append(m)
+    for pool in pools.values():
+        pool.sort(key=pending_order)
+    results = []
+    for r in replies:
+        found = None
+        for p in pools.get((r["recipient"], r["sender"]), ()):
+            if p["status"] == "pending" and p["document"].lower() in r["document"].lower():
+                found = p
+                p["status"] = "completed"
+                break
+        results.append(found)
+    return results
+
+
+def matched(pending, replies, index_after: int):
+    """Resolve the replies in order as _upsert_chunk does: a mail one reply matched isn't offered to the next."""
+    default, matcher_module.INDEX_AFTER_LOOKUPS = matcher_module.INDEX_AFTER_LOOKUPS, index_after
+    try:
+        matcher = ReplyMatcher({(m["sender"], m["recipient"]) for m in pending})
+        for m in pending:
+            matcher.add(m)
+        results = []
+        for reply in replies:
+            mail = matcher.match(reply)
+            if mail is not None:
+                mail["status"] = "completed"
+            results.append(mail)
+        return results, matcher.stats()
+    finally:
+        matcher_module.INDEX_AFTER_LOOKUPS = default
+
+
+def reset(pending):
+    for m in pending:
+        m["status"] = "pending"
+
+
+def timed(fn, *args):
+    started = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - started, result
+
+
+def run(n_pending: int, n_replies: int):
+    pending, replies = make_data(n_pending, n_replies)
+    scan_t, expected = timed(scan, pending, replies)
+    print(f"pending={n_pending} replies={n_replies} matched={sum(m is not None for m in expected)}")
+    print(f"  scan:     {scan_t:7.3f}s")
+    for label, index_after in (("indexed", 0), ("adaptive", matcher_module.INDEX_AFTER_LOOKUPS)):
+        reset(pending)
+        t, (actual, stats) = timed(matched, pending, replies, index_after)
+        assert [id(m) for m in expected] == [id(m) for m in actual], f"{label} disagrees with scan"
+        print(f"  {label + ':':9} {t:7.3f}s ({stats['candidates_checked']} candidates verified)  "
+              f"speedup={scan_t / t:5.1f}x")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--pending", type=int)
+    ap.add_argument("--replies", type=int)
+    args = ap.parse_args()
+
+    if args.pending or args.replies:
+        run(args.pending or 100_000, args.replies or 10_000)
+        return
+    # A small, a realistic and a large backlog: the crossover is around the middle one
+    for n_pending, n_replies in ((2_000, 200), (20_000, 2_000), (100_000, 10_000)):
+        run(n_pending, n_replies)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Benchmark: read latency while uploads are running.
+
+Seeds a throwaway SQLite database, then keeps a handful of clients reading /mails
+(response cache off) while another client posts uploads of increasing size, one after
+another. Prints read p50/p99 for each upload size; with reads on the async session and
+uploads in the worker pool, p99 should stay flat as uploads grow.
+
+    python benchmarks/bench_mixed_load.py [--seed-rows 50000] [--sizes 0,2000,20000] [--readers 8]
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import httpx
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from app import models  # noqa: E402
+from app.cache import response_cache  # noqa: E402
+from app.database import make_async_engine  # noqa: E402
+from app.main import app, get_async_db, get_db  # noqa: E402
+from benchmarks.generator import generate_sheet, insert_mails, sheet_bytes  # noqa: E402
+
+
+def upload_payload(n: int, seed: int) -> bytes:
+    return sheet_bytes(generate_sheet(n, seed), "csv")
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p))]
+
+
+async def run_round(client, payload, readers: int, min_seconds: float):
+    latencies = []
+    done = asyncio.Event()
+
+    async def reader(i):
+        while not done.is_set():
+            started = time.perf_counter()
+            r = await client.get("/mails", params={"limit": 50, "sender": ["registry", "bursary"][i % 2]})
+            latencies.append(time.perf_counter() - started)
+            assert r.status_code == 200, r.text
+
+    async def uploader():
+        started = time.perf_counter()
+        uploads = 0
+        while payload and (uploads == 0 or time.perf_counter() - started < min_seconds):
+            r = await client.post("/upload", files={"file": ("load.csv", payload)})
+            assert r.status_code == 200, r.text
+            uploads += 1
+        if not payload:
+            await asyncio.sleep(min_seconds)
+        done.set()
+        return uploads
+
+    tasks = [asyncio.create_task(reader(i)) for i in range(readers)]
+    uploads = await uploader()
+    await asyncio.gather(*tasks)
+    return latencies, uploads
+
+
+async def main_async(args, sizes):
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as client:
+        for round_no, size in enumerate(sizes):
+            payload = upload_payload(size, seed=round_no) if size else b""
+            latencies, uploads = await run_round(client, payload, args.readers, args.seconds)
+            ms = [x * 1000 for x in latencies]
+            print(f"uploads of {size:6} rows ({uploads} done): {len(ms):5} reads   "
+                  f"p50 {statistics.median(ms):7.1f}ms   p99 {percentile(ms, 0.99):7.1f}ms   "
+                  f"max {max(ms):7.1f}ms")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--seed-rows", type=int, default=50_000)
+    ap.add_argument("--sizes", default="0,2000,20000", help="upload sizes in rows, comma separated")
+    ap.add_argument("--readers", type=int, default=8)
+    ap.add_argument("--seconds", type=float, default=5, help="minimum length of each round")
+    args = ap.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "mixed.db")
+    engine = create_engine(f"sqlite:///{path}")
+    models.Base.metadata.create_all(bind=engine)
+    insert_mails(engine, args.seed_rows, datetime.utcnow())
+    Session = sessionmaker(bind=engine)
+    AsyncSession = async_sessionmaker(make_async_engine(f"sqlite+aiosqlite:///{path}"), expire_on_commit=False)
+
+    def bench_db():
+        db = Session()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    async def bench_async_db():
+        async with AsyncSession() as db:
+            yield db
+
+    app.dependency_overrides[get_db] = bench_db
+    app.dependency_overrides[get_async_db] = bench_async_db
+    response_cache.ttl = 0  # every read goes to the database
+
+    asyncio.run(main_async(args, [int(s) for s in args.sizes.split(",")]))
+
+
+if __name__ == "__main__":
+    main()
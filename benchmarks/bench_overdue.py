@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+Benchmark: /overdue-summary and /overdue-mails on a large table.
+
+Seeds a throwaway SQLite database (1M mails by default, mostly completed, as in a
+long-running deployment), prints the EXPLAIN QUERY PLAN of the new queries and times
+them against the old shape: function-wrapped date arithmetic, one COUNT per direction
+(julianday() standing in for MySQL's TIMESTAMPDIFF()).
+
+    python benchmarks/bench_overdue.py [--rows 1000000] [--pending 0.03]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.orm import sessionmaker
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from app import models, overdue  # noqa: E402
+from benchmarks.generator import insert_mails, timed  # noqa: E402
+
+LEGACY_COUNTS = [
+    """SELECT COUNT(*) FROM mails WHERE sender IS NOT NULL AND status = 'pending'
+       AND (julianday(:now) - julianday(date_sent)) * 24 > 24""",
+    """SELECT COUNT(*) FROM mails WHERE recipient IS NOT NULL AND status = 'pending'
+       AND (julianday(:now) - julianday(date_sent)) * 24 > 48""",
+]
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--rows", type=int, default=1_000_000)
+    ap.add_argument("--pending", type=float, default=0.03, help="fraction of mails still pending")
+    args = ap.parse_args()
+
+    now = datetime.utcnow()
+    path = os.path.join(tempfile.mkdtemp(), "overdue.db")
+    engine = create_engine(f"sqlite:///{path}")
+    models.Base.metadata.create_all(bind=engine)
+    started = time.perf_counter()
+    # Pending mail is recent; completed mail spreads over five years
+    insert_mails(engine, args.rows, now, seed=5, pending=args.pending, days=365 * 5)
+    print(f"seeded {args.rows} mails in {time.perf_counter() - started:.1f}s")
+
+    Session = sessionmaker(bind=engine)
+    db = Session()
+
+    captured = []
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if not statement.startswith("EXPLAIN"):
+            captured.append((statement, parameters))
+
+    for label, fn in (("summary", overdue.overdue_summary), ("mails", overdue.overdue_mails)):
+        captured.clear()
+        fn(db, now)
+        statement, params = captured[0]
+        plan = [row[-1] for row in db.connection().exec_driver_sql("EXPLAIN QUERY PLAN " + statement, params)]
+        print(f"{label} plan: {' | '.join(plan)}")
+
+    legacy = lambda: [db.execute(text(sql), {"now": now}).scalar() for sql in LEGACY_COUNTS]  # noqa: E731
+    summary = overdue.overdue_summary(db, now)
+    print(f"overdue: {summary['incoming']} incoming, {summary['outgoing']} outgoing, "
+          f"{len(summary['by_department'])} departments")
+
+    old_ms = timed(legacy)
+    new_ms = timed(lambda: overdue.overdue_summary(db, now))
+    mails_ms = timed(lambda: overdue.overdue_mails(db, now))
+    print(f"summary  old (2 function-wrapped COUNTs): {old_ms:8.1f}ms")
+    print(f"summary  new (1 grouped range query):     {new_ms:8.1f}ms   ({old_ms / new_ms:.1f}x)")
+    print(f"overdue-mails (range query, {len(overdue.overdue_mails(db, now))} rows): {mails_ms:8.1f}ms")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Benchmark: the reminder dispatcher (app/reminders.py) against a local SMTP server.
+
+Seeds a throwaway SQLite database, starts an aiosmtpd server on localhost that takes
+--latency-ms per message and answers a --fail-rate share of them with a temporary 451,
+and times sending the overdue reminders: one connection and one message per mail (what
+calling the per-mail endpoint and mailing each would cost) against the pooled digest
+dispatcher at several pool sizes. Needs aiosmtpd (pip install -r requirements-dev.txt).
+
+    python benchmarks/bench_reminders.py [--rows 50000] [--digest 10] [--pools 1,4,8]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import smtplib
+import socket
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from aiosmtpd.controller import Controller
+from sqlalchemy import create_engine, update
+from sqlalchemy.orm import sessionmaker
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from app import models, overdue, reminders  # noqa: E402
+from benchmarks.generator import seed_database  # noqa: E402
+
+
+class SlowRelay:
+    """aiosmtpd handler: a relay that takes `latency` seconds per message and sometimes says 451."""
+
+    def __init__(self, latency: float, fail_rate: float, seed: int = 3):
+        self.latency = latency
+        self.fail_rate = fail_rate
+        self.rnd = random.Random(seed)
+        self.received = 0
+        self.refused = 0
+        self.connections = 0
+
+    async def handle_EHLO(self, server, session, envelope, hostname, responses):
+        self.connections += 1
+        session.host_name = hostname
+        return responses
+
+    async def handle_DATA(self, server, session, envelope):
+        await asyncio.sleep(self.latency)
+        if self.rnd.random() < self.fail_rate:
+            self.refused += 1
+            return "451 4.3.0 Try again later"
+        self.received += 1
+        return "250 OK"
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def one_per_mail(mails: list, host: str, port: int, now: datetime) -> int:
+    """The naive way: a fresh connection and a single-mail message for each overdue mail."""
+    sent = 0
+    for mail in mails:
+        address = reminders.recipient_address(mail.recipient)
+        if not address:
+            continue
+        try:
+            with smtplib.SMTP(host, port) as smtp:
+                smtp.send_message(reminders._message(address, [mail], now))
+            sent += 1
+        except smtplib.SMTPException:
+            pass
+    return sent
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--rows", type=int, default=50_000)
+    ap.add_argument("--pending", type=float, default=0.05, help="fraction of mails still pending")
+    ap.add_argument("--digest", type=int, default=10, help="mails per digest (DIGEST_MAX_MAILS)")
+    ap.add_argument("--pools", default="1,4,8", help="pool sizes to time")
+    ap.add_argument("--latency-ms", type=float, default=5, help="relay time per message")
+    ap.add_argument("--fail-rate", type=float, default=0.02, help="share of messages answered 451")
+    ap.add_argument("--naive-limit", type=int, default=500, help="mails sent the one-per-mail way")
+    args = ap.parse_args()
+
+    now = datetime.utcnow()
+    path = os.path.join(tempfile.mkdtemp(), "reminders.db")
+    engine = create_engine(f"sqlite:///{path}")
+    seed_database(engine, args.rows, now, pending=args.pending)
+    Session = sessionmaker(bind=engine)
+
+    relay = SlowRelay(args.latency_ms / 1000, args.fail_rate)
+    host, port = "127.0.0.1", free_port()
+    controller = Controller(relay, hostname=host, port=port)
+    controller.start()
+    reminders.DIGEST_MAX_MAILS = args.digest
+    reminders.REMINDER_FROM, reminders.REMINDER_DOMAIN = "registry@example.org", "example.org"
+
+    try:
+        with Session() as db:
+            mails = overdue.overdue_mails(db, now)
+        print(f"{len(mails)} overdue mails, {len(reminders.build_digests(mails, now))} digests "
+              f"of up to {args.digest}")
+
+        sample = mails[:args.naive_limit]
+        started = time.perf_counter()
+        sent = one_per_mail(sample, host, port, now)
+        seconds = time.perf_counter() - started
+        per_mail = seconds / max(len(sample), 1)
+        print(f"one connection per mail: {sent} of {len(sample)} in {seconds:.2f}s "
+              f"({sent / seconds:.0f} msg/s; ~{per_mail * len(mails):.1f}s for all {len(mails)})")
+
+        for size in [int(p) for p in args.pools.split(",")]:
+            with engine.begin() as conn:
+                conn.execute(update(models.Mail).values(reminder_sent_at=None))
+            relay.connections = relay.refused = 0
+            with Session() as db:
+                pool = reminders.SMTPPool(size, host, port)
+                try:
+                    result = reminders.dispatch_reminders(
+                        db, now, pool_size=size, rate=0, retries=3, backoff=0.01, pool=pool
+                    )
+                finally:
+                    pool.close()
+            print(f"pooled x{size}: {result['sent']} of {result['messages']} digests "
+                  f"({result['mails_reminded']} mails) in {result['seconds']:.2f}s, "
+                  f"{result['messages_per_second']} msg/s, {relay.connections} connections, "
+                  f"{relay.refused} retried, {result['failed']} failed")
+    finally:
+        controller.stop()
+
+
+if __name__ == "__main__":
+    main()
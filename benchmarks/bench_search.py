@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Benchmark: /mails/search on a large table.
+
+Seeds a throwaway SQLite database (1M mails by default, from benchmarks/generator.py:
+"Memo <n>: <topic>" subjects between department addresses) and times typical searches
+through the FTS5 index against the client-side alternative it replaces: LIKE
+'%fragment%' over the three text columns. Also reports what the index triggers add to
+the seeding inserts.
+
+    python benchmarks/bench_search.py [--rows 1000000]
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from sqlalchemy import create_engine, or_, select, text
+from sqlalchemy.orm import sessionmaker
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from app import listing, models, search  # noqa: E402
+from benchmarks.generator import insert_mails, timed  # noqa: E402
+
+QUERIES = [
+    ("one word", "transcript", {}),
+    ("prefix", "transc", {}),
+    ("two words", "budget release", {}),
+    ("party + word", "bursary leave", {}),
+    ("memo number", "memo 12345", {}),
+    ("with status", "leave", {"status": "pending"}),
+]
+
+
+def like_search(db, query: str, clauses: list):
+    # Substring match on every word, unranked: what filtering /mails client-side amounts to
+    m = models.Mail
+    words = [or_(m.document.like(f"%{t}%"), m.sender.like(f"%{t}%"), m.recipient.like(f"%{t}%"))
+             for t in search.search_terms(query)]
+    return db.execute(select(*listing.list_columns()).where(*words, *clauses).limit(search.SEARCH_LIMIT)).all()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--rows", type=int, default=1_000_000)
+    args = ap.parse_args()
+
+    now = datetime.utcnow()
+    seeded = {}
+    for indexed in (False, True):
+        path = os.path.join(tempfile.mkdtemp(), "search.db")
+        engine = create_engine(f"sqlite:///{path}")
+        models.Base.metadata.create_all(bind=engine)
+        if not indexed:
+            with engine.begin() as conn:
+                for trigger in ("ai", "ad", "au"):
+                    conn.execute(text(f"DROP TRIGGER {search.FTS_TABLE}_{trigger}"))
+        started = time.perf_counter()
+        insert_mails(engine, args.rows, now, seed=3)
+        seeded[indexed] = time.perf_counter() - started
+    print(f"seeded {args.rows} mails: {seeded[False]:.1f}s without the index triggers, "
+          f"{seeded[True]:.1f}s with them")
+
+    db = sessionmaker(bind=engine)()
+    print(f"{'query':14} {'hits':>6} {'fts5':>9} {'LIKE':>10}   (LIKE stops at the first {search.SEARCH_LIMIT} hits, unranked)")
+    for label, query, filters in QUERIES:
+        clauses = listing.filter_clauses(**filters)
+        hits = len(search.search_mails(db, query, clauses))
+        fts_ms = timed(lambda: search.search_mails(db, query, clauses))
+        like_ms = timed(lambda: like_search(db, query, clauses), repeat=1)
+        print(f"{label:14} {hits:6} {fts_ms:8.1f}ms {like_ms:9.1f}ms")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()
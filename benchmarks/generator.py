@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Seeded generator of synthetic registry data for the benchmarks.
+
+Everything is drawn from one random.Random(seed), so the same arguments always give
+the same mails. Two shapes are produced:
+
+- upload sheets: rows as a department's registry clerk would type them (mixed date
+  formats, the odd blank cell), with reply chains - a memo, the other office's
+  "RE: ..." reply, sometimes a reply to that - so uploads exercise the reply matcher;
+- mails table rows for seeding a database directly (seed_database), much faster
+  than going through uploads when the benchmark is about reads.
+
+It also has the timing helper the bench_* scripts share.
+
+    python benchmarks/generator.py --rows 10000 --out registry.xlsx [--seed 42]
+"""
+
+import argparse
+import io
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from app import counters, events, models, refs  # noqa: E402
+from app.scheduler import compute_due_at  # noqa: E402
+
+DEPARTMENTS = [
+    "Registry", "Bursary", "Admissions", "Exams and Records", "Library", "Works and Services",
+    "Faculty of Science", "Faculty of Arts", "Faculty of Education", "Student Affairs",
+    "Health Centre", "Legal Unit", "Vice-Chancellor's Office", "ICT Centre",
+]
+TOPICS = [
+    "leave of absence", "budget release", "result verification", "transcript request",
+    "promotion exercise", "hostel allocation", "procurement approval", "staff posting",
+    "examination timetable", "library clearance", "contract renewal", "student disciplinary case",
+]
+SHEET_COLUMNS = ["Department", "From", "To", "Subject", "Date", "Status", "Reply_Date"]
+# Formats registry clerks actually type (all understood by app.utils)
+DATE_FORMATS = ["%Y-%m-%d %H:%M:%S", "%Y-%m-%d", "%m/%d/%Y", "%d %b %Y", "%Y/%m/%d %H:%M"]
+SEED_BATCH_SIZE = 20_000
+
+
+def address(department: str) -> str:
+    return "".join(c for c in department.lower() if c.isalnum() or c == " ").replace(" ", ".") + "@eksu.edu.ng"
+
+
+def department_pairs(rnd: random.Random, departments: list = DEPARTMENTS):
+    """
+    Every (from, to) pair of departments with a Zipf-like weight: a few pairs (the
+    Registry and the Bursary, say) carry most of the mail, as in a real registry.
+    """
+    pairs = [(a, b) for a in departments for b in departments if a != b]
+    rnd.shuffle(pairs)
+    return pairs, [1 / (rank + 1) for rank in range(len(pairs))]
+
+
+def generate_sheet(rows: int, seed: int = 42, start: datetime = None, days: int = 365,
+                   reply_rate: float = 0.4, follow_up_rate: float = 0.25, messy: bool = True) -> list:
+    """
+    `rows` upload rows (SHEET_COLUMNS), in the order they were sent.
+
+    A `reply_rate` share of memos get a reply from the recipient 1-240 hours later
+    (Subject "RE: ...", with a Reply_Date), and a `follow_up_rate` share of replies are
+    answered in turn, up to three deep. A reply that is itself answered stays pending
+    until then. With `messy`, dates come in mixed formats and a few cells are blank.
+    """
+    rnd = random.Random(seed)
+    start = start or datetime(2024, 1, 1)
+    pairs, weights = department_pairs(rnd)
+    sheet = []  # (sent, row)
+    n = 0
+    while len(sheet) < rows:
+        sender, recipient = rnd.choices(pairs, weights)[0]
+        sent = start + timedelta(minutes=rnd.randrange(0, 60 * 24 * days))
+        subject = f"Memo {seed}-{n}: {rnd.choice(TOPICS)}"
+        n += 1
+        answered = rnd.random() < reply_rate
+        chain = [(sender, recipient, subject, sent, "pending" if answered else rnd.choice(["pending", "completed"]), None)]
+        depth = 0
+        while answered and len(sheet) + len(chain) < rows:
+            sender, recipient = recipient, sender
+            sent = sent + timedelta(hours=rnd.randrange(1, 240))
+            subject = f"RE: {subject}"
+            depth += 1
+            answered = depth < 3 and rnd.random() < follow_up_rate
+            chain.append((sender, recipient, subject, sent, "pending" if answered else "completed", sent))
+        for sender, recipient, subject, sent, status, replied in chain:
+            sheet.append((sent, {
+                "Department": sender if not messy or rnd.random() > 0.02 else None,
+                "From": address(sender),
+                "To": address(recipient),
+                "Subject": subject,
+                "Date": sent.strftime(rnd.choice(DATE_FORMATS) if messy else DATE_FORMATS[0]),
+                "Status": status,
+                "Reply_Date": replied.strftime(DATE_FORMATS[0]) if replied else None,
+            }))
+    sheet.sort(key=lambda entry: entry[0])
+    return [row for _, row in sheet[:rows]]
+
+
+def to_frame(sheet: list) -> pd.DataFrame:
+    return pd.DataFrame(sheet, columns=SHEET_COLUMNS)
+
+
+def write_sheet(sheet: list, out, fmt: str = None):
+    """Write rows to a path or binary file; `fmt` ("csv" or "xlsx") defaults to the extension."""
+    fmt = fmt or ("csv" if str(out).lower().endswith(".csv") else "xlsx")
+    df = to_frame(sheet)
+    if fmt == "csv":
+        if isinstance(out, (str, os.PathLike)):
+            df.to_csv(out, index=False)
+        else:
+            out.write(df.to_csv(index=False).encode())
+    else:
+        df.to_excel(out, index=False, engine="openpyxl")
+
+
+def sheet_bytes(sheet: list, fmt: str) -> bytes:
+    buf = io.BytesIO()
+    write_sheet(sheet, buf, fmt)
+    return buf.getvalue()
+
+
+def mail_rows(n: int, now: datetime, seed: int = 7, pending: float = 0.05, days: int = 365 * 3,
+              first_ref: int = 1) -> list:
+    """
+    `n` mails table rows as a long-running deployment has them: mostly completed and
+    spread over `days`, with a `pending` share sent in the last fortnight (some of it
+    overdue, a few with custom thresholds, a few already notified).
+    """
+    rnd = random.Random(seed)
+    pairs, weights = department_pairs(rnd)
+    rows = []
+    for i in range(n):
+        sender, recipient = rnd.choices(pairs, weights)[0]
+        is_pending = rnd.random() < pending
+        sent = now - timedelta(minutes=rnd.randrange(0, 60 * 24 * (14 if is_pending else days)))
+        custom = rnd.choice([12, 72, 168]) if rnd.random() < 0.05 else None
+        due_at = compute_due_at(sent, custom)
+        notified = is_pending and due_at <= now and rnd.random() < 0.5
+        rows.append({
+            "eksu_ref": refs.format_eksu_ref(first_ref + i), "name": sender,
+            "sender": address(sender), "recipient": address(recipient),
+            "document": f"Memo {seed}-{i}: {rnd.choice(TOPICS)}",
+            "status": "pending" if is_pending else "completed", "date_sent": sent,
+            "response_date": None if is_pending else sent + timedelta(hours=rnd.randrange(1, 240)),
+            "custom_threshold_hours": custom, "due_at": due_at,
+            "notified": notified, "notified_at": due_at if notified else None,
+        })
+    return rows
+
+
+def insert_mails(engine, n: int, now: datetime, seed: int = 7, pending: float = 0.05, days: int = 365 * 3):
+    """Insert `n` mail_rows() in SEED_BATCH_SIZE batches, and nothing else."""
+    with engine.begin() as conn:
+        for start in range(0, n, SEED_BATCH_SIZE):
+            batch = mail_rows(min(SEED_BATCH_SIZE, n - start), now, seed + start, pending, days, first_ref=start + 1)
+            conn.execute(insert(models.Mail), batch)
+
+
+def seed_database(engine, n: int, now: datetime, seed: int = 7, pending: float = 0.05, days: int = 365 * 3):
+    """
+    Insert mail_rows() in batches, then bring the dashboard counters and the event log
+    in line with them, as if the mails had arrived through the app.
+    """
+    models.Base.metadata.create_all(bind=engine)
+    insert_mails(engine, n, now, seed, pending, days)
+    with Session(engine) as db:
+        counters.reconcile(db)
+        db.commit()
+        events.backfill(db)
+
+
+# --- Timing ---
+def timed(fn, repeat: int = 5) -> float:
+    """Median wall time of `fn()` over `repeat` calls, in ms."""
+    samples = []
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--rows", type=int, default=10_000)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--days", type=int, default=365, help="spread of the send dates")
+    ap.add_argument("--reply-rate", type=float, default=0.4)
+    ap.add_argument("--clean", action="store_true", help="one date format, no blank cells")
+    ap.add_argument("--out", required=True, help=".csv or .xlsx")
+    args = ap.parse_args()
+
+    sheet = generate_sheet(args.rows, args.seed, days=args.days, reply_rate=args.reply_rate, messy=not args.clean)
+    write_sheet(sheet, args.out)
+    replies = sum(1 for row in sheet if row["Reply_Date"])
+    print(f"wrote {len(sheet)} rows ({replies} replies) to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Stress check for the EKSU reference allocator (app/refs.py).
+
+Many threads reserve single refs and blocks at the same time against one database.
+Fails if any number is handed out twice, if a block is not contiguous, or if the
+numbers handed out overall have gaps.
+
+    python benchmarks/stress_eksu_refs.py [--threads 16] [--rounds 50] [--database-url sqlite:///...]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from app import models, refs  # noqa: E402
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--threads", type=int, default=16)
+    ap.add_argument("--rounds", type=int, default=50)
+    ap.add_argument("--database-url", default=None, help="defaults to a throwaway SQLite file")
+    args = ap.parse_args()
+
+    url = args.database_url or f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'refs.db')}"
+    engine = create_engine(url, pool_size=args.threads, connect_args={"timeout": 30} if url.startswith("sqlite") else {})
+    models.Base.metadata.create_all(bind=engine)
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        start = refs.allocate_eksu_numbers(db, 1).start
+
+    blocks = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(args.threads)
+
+    def worker(seed):
+        rnd = random.Random(seed)
+        barrier.wait()
+        with Session() as db:
+            for _ in range(args.rounds):
+                block = refs.allocate_eksu_numbers(db, rnd.choice([1, 1, 5, 50, 500]))
+                with lock:
+                    blocks.append(block)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.threads)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    numbers = [n for block in blocks for n in block]
+    assert all(b.step == 1 and len(b) > 0 for b in blocks), "non-contiguous block"
+    assert len(numbers) == len(set(numbers)), f"{len(numbers) - len(set(numbers))} duplicate numbers"
+    assert sorted(numbers) == list(range(start + 1, start + 1 + len(numbers))), "gap in allocated numbers"
+    print(f"{len(blocks)} reservations / {len(numbers)} refs from {args.threads} threads in {elapsed:.2f}s "
+          f"({len(blocks) / elapsed:.0f} reservations/s): no duplicates, no gaps")
+
+
+if __name__ == "__main__":
+    main()
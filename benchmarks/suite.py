@@ -0,0 +1,465 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite: the hot paths on their own and end to end through the FastAPI app.
+
+Everything runs against throwaway SQLite databases filled by benchmarks/generator.py,
+so two runs with the same --size and --seed see the same data. Results are written as
+JSON (median, p95, SQL statements per run, environment and commit); `compare` prints
+the change between two result files and exits 1 if anything got slower than
+--threshold percent.
+
+    python benchmarks/suite.py run [--size small|medium|large] [--only parse,mails] [--out results.json]
+    python benchmarks/suite.py compare before.json after.json [--threshold 10]
+"""
+
+import argparse
+import contextlib
+import io
+import itertools
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from functools import cached_property
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, delete, event, update
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
+from app import alerts, counters, events, listing, models, utils  # noqa: E402
+from app import main as app_main  # noqa: E402
+from app.cache import MAIL_VIEWS, response_cache  # noqa: E402
+from app.database import make_async_engine  # noqa: E402
+from benchmarks import generator  # noqa: E402
+
+RESULTS_VERSION = 1
+SIZES = {
+    # sheet_rows: rows per parsed/uploaded sheet; seed_rows: mails already in the database
+    "small": {"sheet_rows": 2_000, "seed_rows": 20_000, "ws_clients": 5, "alerts": 100, "repeat": 5},
+    "medium": {"sheet_rows": 10_000, "seed_rows": 200_000, "ws_clients": 20, "alerts": 100, "repeat": 7},
+    "large": {"sheet_rows": 50_000, "seed_rows": 1_000_000, "ws_clients": 50, "alerts": 100, "repeat": 7},
+}
+# Changes smaller than this are noise whatever the percentage
+NOISE_FLOOR_MS = 0.5
+
+CASES = {}  # name -> function(bench) returning a result dict, in run order
+
+
+def case(name: str):
+    def register(fn):
+        CASES[name] = fn
+        return fn
+    return register
+
+
+class StatementCounter:
+    """Statements run on an engine, from any thread (TestClient serves requests in its own)."""
+
+    def __init__(self):
+        self.count = 0
+
+    def watch(self, sync_engine):
+        event.listen(sync_engine, "before_cursor_execute", self._count)
+
+    def _count(self, *args):
+        self.count += 1
+
+
+def _percentile(ordered: list, p: int) -> float:
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+def measure(bench, fn, setup=None, items: int = None, repeat: int = None) -> dict:
+    """
+    Time `fn` `repeat` times after one untimed warm-up; `setup` (untimed) runs before
+    each call and its return value is passed to `fn`.
+    """
+    repeat = repeat or bench.size["repeat"]
+    samples, statements = [], []
+    for i in range(repeat + 1):
+        arg = setup(i) if setup else None
+        before = bench.statements.count
+        started = time.perf_counter()
+        if setup:
+            fn(arg)
+        else:
+            fn()
+        elapsed = time.perf_counter() - started
+        if i:  # the first run warms caches and the connection pool
+            samples.append(elapsed)
+            statements.append(bench.statements.count - before)
+    ordered = sorted(samples)
+    median = statistics.median(ordered)
+    result = {
+        "median_ms": round(median * 1000, 3),
+        "p95_ms": round(_percentile(ordered, 95) * 1000, 3),
+        "min_ms": round(ordered[0] * 1000, 3),
+        "repeat": repeat,
+        "statements": int(statistics.median(statements)),
+    }
+    if items:
+        result["items"] = items
+        result["us_per_item"] = round(median * 1e6 / items, 3)
+    return result
+
+
+class Bench:
+    """Data, databases and the app client, each built the first time a case needs it."""
+
+    def __init__(self, size: dict, seed: int, workdir: str):
+        self.size, self.seed, self.workdir = size, seed, workdir
+        self.now = datetime.utcnow()
+        self.engines = []
+        self.statements = StatementCounter()
+
+    def engine(self, name: str):
+        path = os.path.join(self.workdir, f"{name}.db")
+        if os.path.exists(path):
+            os.remove(path)
+        engine = create_engine(f"sqlite:///{path}")
+        models.Base.metadata.create_all(bind=engine)
+        self.statements.watch(engine)
+        self.engines.append(engine)
+        return engine
+
+    @cached_property
+    def sheet(self) -> list:
+        return generator.generate_sheet(self.size["sheet_rows"], self.seed)
+
+    @cached_property
+    def csv(self) -> bytes:
+        return generator.sheet_bytes(self.sheet, "csv")
+
+    @cached_property
+    def xlsx(self) -> bytes:
+        return generator.sheet_bytes(self.sheet, "xlsx")
+
+    @cached_property
+    def rows(self) -> list:
+        return utils.parse_excel_to_rows(io.BytesIO(self.csv))
+
+    @cached_property
+    def seeded(self) -> sessionmaker:
+        """Sessions on a database holding seed_rows mails."""
+        started = time.perf_counter()
+        engine = self.engine("seeded")
+        generator.seed_database(engine, self.size["seed_rows"], self.now, self.seed)
+        print(f"seeded {self.size['seed_rows']} mails in {time.perf_counter() - started:.1f}s")
+        return sessionmaker(bind=engine)
+
+    @cached_property
+    def client(self) -> TestClient:
+        """The app on the seeded database, response cache off so requests reach the database."""
+        Session = self.seeded
+        async_engine = make_async_engine(f"sqlite+aiosqlite:///{os.path.join(self.workdir, 'seeded.db')}")
+        self.statements.watch(async_engine.sync_engine)
+        AsyncSession = async_sessionmaker(async_engine, expire_on_commit=False)
+
+        def bench_db():
+            db = Session()
+            try:
+                yield db
+            finally:
+                db.close()
+
+        async def bench_async_db():
+            async with AsyncSession() as db:
+                yield db
+
+        app_main.app.dependency_overrides[app_main.get_db] = bench_db
+        app_main.app.dependency_overrides[app_main.get_async_db] = bench_async_db
+        # The notifier and the WebSocket replay open their own sessions
+        app_main.SessionLocal = Session
+        app_main.AsyncSessionLocal = AsyncSession
+        response_cache.ttl = 0
+        return TestClient(app_main.app)
+
+    def get(self, path: str, params: dict = None):
+        # /overdue-mails is cached for OVERDUE_TTL_SECONDS whatever response_cache.ttl says
+        response_cache.invalidate(*MAIL_VIEWS)
+        r = self.client.get(path, params=params)
+        assert r.status_code == 200, f"{path}: {r.status_code} {r.text[:200]}"
+        return r
+
+
+# --- In isolation ---
+@case("parse.csv")
+def parse_csv(bench):
+    return measure(bench, lambda: utils.parse_excel_to_rows(io.BytesIO(bench.csv)), items=len(bench.sheet))
+
+
+@case("parse.xlsx")
+def parse_xlsx(bench):
+    return measure(bench, lambda: utils.parse_excel_to_rows(io.BytesIO(bench.xlsx)), items=len(bench.sheet))
+
+
+@case("upsert")
+def upsert(bench):
+    rows = bench.rows
+
+    def fresh_db(i):
+        return sessionmaker(bind=bench.engine(f"upsert-{i}"))()
+
+    def run(db):
+        with db:
+            stats = utils.simple_match_and_upsert(rows, db)
+        assert stats["inserted"] == len(rows), stats
+
+    return measure(bench, run, setup=fresh_db, items=len(rows))
+
+
+@case("eksu_ref.single")
+def eksu_ref_single(bench):
+    calls = 100
+
+    def run():
+        with bench.seeded() as db:
+            for _ in range(calls):
+                utils.generate_eksu_ref(db)
+
+    return measure(bench, run, items=calls)
+
+
+@case("eksu_ref.block")
+def eksu_ref_block(bench):
+    count = bench.size["sheet_rows"]
+
+    def run():
+        with bench.seeded() as db:
+            utils.generate_eksu_refs(db, count)
+
+    return measure(bench, run, items=count)
+
+
+# --- End to end through the app ---
+@case("mails.first_page")
+def mails_first_page(bench):
+    return measure(bench, lambda: bench.get("/mails", {"limit": listing.PAGE_SIZE}))
+
+
+def _deep_page(bench, filters: dict):
+    """Offset of, and keyset cursor for, the page halfway through the filtered mails."""
+    size = listing.PAGE_SIZE
+    with bench.seeded() as db:
+        total = db.query(models.Mail.id).filter(*listing.filter_clauses(**filters)).count()
+        skip = max(total // 2 // size, 1) * size
+        rows, _ = listing.list_page(db, listing.filter_clauses(**filters), 1, skip=skip - 1)
+    return skip, listing.encode_cursor(rows[0]["date_sent"], rows[0]["id"])
+
+
+@case("mails.deep_offset")
+def mails_deep_offset(bench):
+    skip, _ = _deep_page(bench, {})
+    return measure(bench, lambda: bench.get("/mails", {"limit": listing.PAGE_SIZE, "skip": skip}))
+
+
+@case("mails.deep_keyset")
+def mails_deep_keyset(bench):
+    _, cursor = _deep_page(bench, {})
+    return measure(bench, lambda: bench.get("/mails", {"limit": listing.PAGE_SIZE, "cursor": cursor}))
+
+
+@case("mails.filtered_keyset")
+def mails_filtered_keyset(bench):
+    filters = {"status": "pending"}
+    _, cursor = _deep_page(bench, filters)
+    return measure(bench, lambda: bench.get("/mails", {**filters, "limit": listing.PAGE_SIZE, "cursor": cursor}))
+
+
+@case("overdue.summary")
+def overdue_summary(bench):
+    return measure(bench, lambda: bench.get("/overdue-summary"))
+
+
+@case("overdue.mails")
+def overdue_mails(bench):
+    return measure(bench, lambda: bench.get("/overdue-mails"))
+
+
+@case("notifier")
+def notifier(bench):
+    bench.client  # the notifier opens sessions through app.main.SessionLocal
+    # A day ahead, so the pass has the mails due by then to notify
+    now = bench.now + timedelta(days=1)
+    stamp = now.replace(microsecond=0)
+
+    def unnotify(i):
+        # Put back what the previous pass changed
+        with bench.seeded() as db:
+            db.execute(update(models.Mail).where(models.Mail.notified_at == stamp).values(notified=False, notified_at=None))
+            db.execute(delete(models.MailEvent).where(models.MailEvent.kind == events.NOTIFIED, models.MailEvent.at == stamp))
+            counters.reconcile(db)
+            db.commit()
+
+    found = []
+
+    def run(_):
+        # It prints every alert; that's the real pass, just not worth reading here
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            found.append(len(app_main.notify_overdue_mails(now)))
+
+    result = measure(bench, run, setup=unnotify)
+    result["items"] = found[-1]
+    result["us_per_item"] = round(result["median_ms"] * 1000 / max(found[-1], 1), 3)
+    return result
+
+
+@case("upload")
+def upload(bench):
+    bench.client
+
+    def payload(i):
+        # A new sheet each time, so every run inserts and matches instead of updating
+        return generator.sheet_bytes(generator.generate_sheet(bench.size["sheet_rows"], bench.seed + 1000 + i), "csv")
+
+    def run(data):
+        r = bench.client.post("/upload", files={"file": ("registry.csv", data, "text/csv")})
+        assert r.status_code == 200, r.text[:200]
+
+    return measure(bench, run, setup=payload, items=bench.size["sheet_rows"])
+
+
+@case("ws.fanout")
+def ws_fanout(bench):
+    clients = bench.size["ws_clients"]
+    # One publish must fit every client's queue, or they'd lag and replay from the database
+    batch = min(bench.size["alerts"], alerts.ALERT_QUEUE_SIZE)
+    bench.client
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        app_main.notify_overdue_mails()  # so the scheduler's startup pass has nothing to send
+    # Synthetic alerts far in the future: real ones (if a mail falls due meanwhile) sort
+    # before them and are skipped by the endpoint once these have been sent
+    serial = itertools.count(1)
+    future = datetime(2100, 1, 1)
+
+    # Entering the client runs startup, which binds the broadcaster to the client's loop
+    with bench.client, contextlib.ExitStack() as stack:
+        sockets = [stack.enter_context(bench.client.websocket_connect("/ws")) for _ in range(clients)]
+        deadline = time.monotonic() + 10
+        while alerts.broadcaster.stats()["subscribers"] < clients:
+            assert time.monotonic() < deadline, "WebSocket clients did not subscribe"
+            time.sleep(0.01)
+
+        def run():
+            ids = [next(serial) for _ in range(batch)]
+            sent = [alerts.make_alert(i, f"BENCH{i}", "bench", "bench", None, future + timedelta(seconds=i)) for i in ids]
+            alerts.broadcaster.publish(sent)
+            for ws in sockets:
+                while ws.receive_json()["ref"] != sent[-1]["ref"]:
+                    pass
+
+        return measure(bench, run, items=clients * batch)
+
+
+# --- Results ---
+def environment() -> dict:
+    def git(*args):
+        try:
+            return subprocess.run(["git", *args], capture_output=True, text=True, check=True,
+                                  cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    return {
+        "commit": git("rev-parse", "HEAD"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def run(args):
+    size = {**SIZES[args.size], **{k: v for k, v in (("sheet_rows", args.sheet_rows),
+                                                     ("seed_rows", args.seed_rows),
+                                                     ("repeat", args.repeat)) if v}}
+    only = [p for p in (args.only or "").split(",") if p]
+    names = [n for n in CASES if not only or any(n == p or n.startswith(p + ".") for p in only)]
+    if not names:
+        sys.exit(f"no case matches --only {args.only}; cases: {', '.join(CASES)}")
+
+    workdir = tempfile.mkdtemp(prefix="mail-bench-")
+    bench = Bench(size, args.seed, workdir)
+    results = {}
+    try:
+        for name in names:
+            results[name] = CASES[name](bench)
+            r = results[name]
+            per_item = f"  {r['us_per_item']:9.1f}µs/item" if "us_per_item" in r else ""
+            print(f"{name:24} median {r['median_ms']:9.2f}ms  p95 {r['p95_ms']:9.2f}ms  "
+                  f"{r['statements']:5d} stmts{per_item}")
+    finally:
+        for engine in bench.engines:
+            engine.dispose()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "version": RESULTS_VERSION,
+        "created_at": datetime.utcnow().isoformat(timespec="seconds"),
+        "size": args.size, "params": size, "seed": args.seed,
+        "environment": environment(),
+        "results": results,
+    }
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"wrote {args.out}")
+
+
+def compare(args):
+    with open(args.before) as f:
+        before = json.load(f)
+    with open(args.after) as f:
+        after = json.load(f)
+    if before["params"] != after["params"]:
+        print(f"⚠️ different sizes: {before['params']} vs {after['params']}")
+    print(f"before {(before['environment']['commit'] or '?')[:10]}  after {(after['environment']['commit'] or '?')[:10]}")
+
+    regressions = []
+    for name in [*before["results"], *(n for n in after["results"] if n not in before["results"])]:
+        old, new = before["results"].get(name), after["results"].get(name)
+        if not old or not new:
+            print(f"{name:24} {'only before' if old else 'only after'}")
+            continue
+        change = (new["median_ms"] - old["median_ms"]) / old["median_ms"] * 100 if old["median_ms"] else 0
+        slower = change > args.threshold and new["median_ms"] - old["median_ms"] > NOISE_FLOOR_MS
+        statements = f"  stmts {old['statements']} -> {new['statements']}" if old["statements"] != new["statements"] else ""
+        mark = "  ⚠️ slower" if slower else ""
+        print(f"{name:24} {old['median_ms']:9.2f}ms -> {new['median_ms']:9.2f}ms  {change:+7.1f}%{statements}{mark}")
+        if slower:
+            regressions.append(name)
+    if regressions:
+        print(f"{len(regressions)} slower by more than {args.threshold}%: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = ap.add_subparsers(dest="command", required=True)
+    r = commands.add_parser("run", help="run the suite and write results as JSON")
+    r.add_argument("--size", choices=SIZES, default="small")
+    r.add_argument("--seed", type=int, default=42)
+    r.add_argument("--only", help=f"comma-separated cases or groups, e.g. parse,mails.first_page ({len(CASES)} cases)")
+    r.add_argument("--sheet-rows", type=int, help="override the size's rows per sheet")
+    r.add_argument("--seed-rows", type=int, help="override the size's mails in the database")
+    r.add_argument("--repeat", type=int, help="override the size's timed runs per case")
+    r.add_argument("--out", default="benchmark-results.json")
+    c = commands.add_parser("compare", help="compare two result files")
+    c.add_argument("before")
+    c.add_argument("after")
+    c.add_argument("--threshold", type=float, default=10, help="percent slower that counts as a regression")
+    args = ap.parse_args()
+    run(args) if args.command == "run" else compare(args)
+
+
+if __name__ == "__main__":
+    main()
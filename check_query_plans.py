@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Query-plan regression check for the mails table.
+
+Seeds a throwaway SQLite database, drives every endpoint (and the notifier / WebSocket
+replay queries) through the FastAPI app, captures each SQL statement they run against
+`mails`, and EXPLAINs it. Exits non-zero if any statement falls back to a full table scan.
+
+    python check_query_plans.py [--rows 20000] [--verbose]
+"""
+
+import argparse
+import os
+import re
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+from app import alerts, export
+from app.database import make_async_engine
+from app.main import app, get_async_db, get_db
+from app.scheduler import load_deadlines, notify_due_mails
+from benchmarks.generator import address, seed_database
+
+# Statements allowed to scan, with the reason
+ALLOWED_SCANS = {
+    "length(mails.eksu_ref)": "one-off seeding of the EKSU counter (app/refs.py)",
+}
+
+FULL_SCAN = re.compile(r"^SCAN (mails|mails_archive|mail_events)\b(?!.*\bUSING\b)")
+
+
+def upload_csv() -> bytes:
+    lines = ["department,from,to,subject,date_sent,status,response_date"]
+    lines.append("Registry,registry,bursary,Memo 1,2024-01-05,pending,")
+    lines.append("Bursary,bursary,registry,RE: Memo 1,2024-01-06,pending,2024-01-07")
+    return "\n".join(lines).encode()
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--rows", type=int, default=20_000)
+    ap.add_argument("--verbose", action="store_true", help="print every plan, not just failures")
+    args = ap.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "plans.db")
+    engine = create_engine(f"sqlite:///{path}")
+    now = datetime.utcnow()
+    # Plenty of pending mail, so the notifier and overdue queries have rows to plan over
+    seed_database(engine, args.rows, now, seed=11, pending=0.5, days=60)
+    Session = sessionmaker(bind=engine)
+    # /export streams from its own sessions, outside the request's dependencies
+    export.SessionLocal = Session
+
+    def plan_db():
+        db = Session()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    async_engine = make_async_engine(f"sqlite+aiosqlite:///{path}")
+    AsyncSession = async_sessionmaker(async_engine, expire_on_commit=False)
+
+    async def plan_async_db():
+        async with AsyncSession() as db:
+            yield db
+
+    app.dependency_overrides[get_db] = plan_db
+    app.dependency_overrides[get_async_db] = plan_async_db
+    client = TestClient(app)
+
+    captured = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if (" mails" in statement or " mail_events" in statement) and not statement.lstrip().upper().startswith(("INSERT", "EXPLAIN")):
+            captured.append((statement, parameters[0] if executemany else parameters))
+
+    for target in (engine, async_engine.sync_engine):
+        event.listen(target, "before_cursor_execute", capture)
+
+    def query(fn):
+        with Session() as db:
+            return fn(db)
+
+    first_page = client.get("/mails", params={"limit": 5})
+    cursor = first_page.headers["x-next-cursor"]
+    registry, bursary, library, works = (address(d) for d in ("Registry", "Bursary", "Library", "Works and Services"))
+    steps = [
+        ("POST /upload", lambda: client.post("/upload", files={"file": ("plans.csv", upload_csv())})),
+        ("POST /mails", lambda: client.post("/mails", json={
+            "name": "Works and Services", "sender": works, "document": "Plan check", "recipient": library,
+            "date_sent": now.isoformat()})),
+        ("GET /mails", lambda: client.get("/mails")),
+        ("GET /mails?cursor", lambda: client.get("/mails", params={"cursor": cursor})),
+        ("GET /mails?skip", lambda: client.get("/mails", params={"skip": 400})),
+        ("GET /mails?status", lambda: client.get("/mails", params={"status": "pending", "cursor": cursor})),
+        ("GET /mails?sender", lambda: client.get("/mails", params={"sender": registry})),
+        ("GET /mails?recipient", lambda: client.get("/mails", params={"recipient": bursary})),
+        ("GET /mails?department", lambda: client.get("/mails", params={"department": "Works and Services"})),
+        ("GET /mails?date range", lambda: client.get("/mails", params={
+            "date_from": (now - timedelta(days=3)).isoformat(), "date_to": now.isoformat()})),
+        ("GET /mails/search", lambda: client.get("/mails/search", params={"q": "memo 12"})),
+        ("GET /mails/search?status", lambda: client.get("/mails/search", params={
+            "q": "bursary", "status": "pending", "date_from": (now - timedelta(days=7)).isoformat()})),
+        ("GET /mails/{id}/history", lambda: client.get("/mails/8/history")),
+        ("GET /analytics/turnaround", lambda: client.get("/analytics/turnaround", params={
+            "by": "sender", "date_from": (now - timedelta(days=30)).isoformat()})),
+        ("GET /notifications", lambda: client.get("/notifications")),
+        ("GET /notifications?cursor", lambda: client.get("/notifications", params={"cursor": cursor})),
+        ("GET /overdue-mails", lambda: client.get("/overdue-mails")),
+        ("GET /overdue-summary", lambda: client.get("/overdue-summary")),
+        ("PUT /mails/{id}/duration", lambda: client.put("/mails/7/duration", params={"hours": 12})),
+        ("PUT /mails/{id}/status", lambda: client.put("/mails/8/status", json={"status": "completed"})),
+        ("PUT /mails/{id}/reminder-sent", lambda: client.put("/mails/9/reminder-sent")),
+        ("PUT /mails/bulk/status ids", lambda: client.put("/mails/bulk/status", json={
+            "ids": list(range(1, 3000)), "status": "completed"})),
+        ("PUT /mails/bulk/status filter", lambda: client.put("/mails/bulk/status", json={
+            "filter": {"sender": works, "status": "completed"}, "status": "pending"})),
+        ("PUT /mails/bulk/duration", lambda: client.put("/mails/bulk/duration", json={
+            "ids": list(range(10, 2000, 3)), "hours": 72})),
+        ("PUT /mails/bulk/reminder-sent", lambda: client.put("/mails/bulk/reminder-sent", json={
+            "filter": {"recipient": library, "date_from": (now - timedelta(days=2)).isoformat()}})),
+        ("notifier: load_deadlines", lambda: query(lambda db: load_deadlines(db, now + timedelta(hours=6)))),
+        ("notifier: notify_due_mails", lambda: query(lambda db: notify_due_mails(db, now))),
+        ("/ws replay", lambda: query(lambda db: alerts.load_alerts_since(db, alerts.Cursor(now - timedelta(days=1), 0)))),
+        ("alert feed: latest_cursor", lambda: query(alerts.latest_cursor)),
+        ("GET /archive", lambda: client.get("/archive", params={"older_than_days": 30})),
+        ("POST /archive", lambda: client.post("/archive", params={
+            "older_than_days": 30, "batch_size": 500, "max_batches": 2})),
+        ("GET /mails/search archived", lambda: client.get("/mails/search", params={"q": "memo 12", "status": "completed"})),
+        ("GET /export archived", lambda: client.get("/export", params={"sender": registry})),
+    ]
+
+    failures = 0
+    checked = 0
+    for name, step in steps:
+        captured.clear()
+        response = step()
+        status = getattr(response, "status_code", 200)
+        if status >= 400:
+            print(f"FAIL {name}: HTTP {status} {response.text[:200]}")
+            failures += 1
+            continue
+        for statement, params in list(captured):
+            with engine.connect() as conn:
+                plan = [row[-1] for row in conn.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, params).all()]
+            checked += 1
+            scans = [p for p in plan if FULL_SCAN.search(p)]
+            allowed = next((why for key, why in ALLOWED_SCANS.items() if key in statement), None)
+            short = " ".join(statement.split())[:110]
+            if scans and not allowed:
+                failures += 1
+                print(f"FAIL {name}: full scan of mails\n     {short}\n     plan: {plan}")
+            elif args.verbose:
+                note = f" (allowed: {allowed})" if scans else ""
+                print(f"ok   {name}: {' | '.join(plan)}{note}\n     {short}")
+
+    print(f"{checked} statements checked, {failures} failures")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
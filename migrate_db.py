@@ -5,31 +5,59 @@ Run this before starting the application in production.
 """
 
 import os
-from dotenv import load_dotenv
-from sqlalchemy import create_engine, text
-from urllib.parse import urlparse, parse_qs, urlunparse
-
-# Load environment variables
-if not os.getenv('DATABASE_URL'):
-    load_dotenv()
-
-# Get database URL
-database_url = os.getenv('DATABASE_URL')
-if database_url:
-    # Parse and reconstruct URL for mysql-connector-python
-    parsed = urlparse(database_url)
-    query_params = parse_qs(parsed.query)
-    if 'ssl-mode' in query_params:
-        del query_params['ssl-mode']
-    new_query = '&'.join([f"{k}={v[0]}" for k, v in query_params.items()])
-    scheme = "mysql+mysqlconnector"
-    SQLALCHEMY_DATABASE_URL = urlunparse((scheme, parsed.netloc, parsed.path, parsed.params, new_query, parsed.fragment))
+from sqlalchemy import bindparam, inspect, select, text, update
+from sqlalchemy.orm import Session
+
+# app.database loads .env when DATABASE_URL isn't set
+from app import counters, events, search
+from app.database import build_database_url, make_engine
+from app.models import CacheGeneration, JobLease, Mail, MailArchive, MailCounter, MailEvent, UploadJob, UploadJobError
+from app.scheduler import compute_due_at
+
+# Get database URL: DATABASE_URL as the app uses it, otherwise the DB_* settings
+if os.getenv('DATABASE_URL'):
+    SQLALCHEMY_DATABASE_URL = build_database_url(os.getenv('DATABASE_URL'))
 else:
     SQLALCHEMY_DATABASE_URL = f"mysql+pymysql://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}"
 
+def column_exists(conn, table, column):
+    return column in {c["name"] for c in inspect(conn).get_columns(table)}
+
+
+def backfill_due_at(conn, batch_size=5000):
+    """Fill due_at for rows written before the column existed."""
+    total = 0
+    while True:
+        rows = conn.execute(
+            select(Mail.id, Mail.date_sent, Mail.custom_threshold_hours)
+            .where(Mail.due_at.is_(None), Mail.date_sent.isnot(None))
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        conn.execute(
+            update(Mail.__table__).where(Mail.__table__.c.id == bindparam("mail_id")),
+            [{"mail_id": r.id, "due_at": compute_due_at(r.date_sent, r.custom_threshold_hours)} for r in rows]
+        )
+        conn.commit()
+        total += len(rows)
+    print(f"✅ due_at backfilled for {total} mails.")
+
+
+def create_missing_indexes(conn):
+    """Create any index declared on the models that the database doesn't have yet."""
+    for index in Mail.__table__.indexes:
+        existing = {i["name"] for i in inspect(conn).get_indexes("mails")}
+        if index.name not in existing:
+            print(f"Creating index {index.name}...")
+            index.create(conn)
+            conn.commit()
+    print("✅ Indexes up to date.")
+
+
 def migrate_database():
     """Add missing columns to the mails table."""
-    engine = create_engine(SQLALCHEMY_DATABASE_URL)
+    engine = make_engine(SQLALCHEMY_DATABASE_URL)
 
     with engine.connect() as conn:
         # Check if reminder_sent_at column exists
@@ -88,7 +116,60 @@ def migrate_database():
         conn.commit()
         print("✅ Columns altered to nullable.")
 
-        print("Migration completed!")
+        # due_at: when the mail becomes overdue, indexed for the deadline scheduler
+        if not column_exists(conn, "mails", "due_at"):
+            print("Adding due_at column to mails table...")
+            conn.execute(text("ALTER TABLE mails ADD COLUMN due_at DATETIME NULL"))
+            conn.commit()
+            print("✅ due_at column added successfully!")
+        else:
+            print("✅ due_at column already exists.")
+        backfill_due_at(conn)
+        create_missing_indexes(conn)
+
+    # Archive: completed mails moved out of the live table (see archive_mails.py). Before the
+    # counters and the event log, which read both tables
+    MailArchive.__table__.create(engine, checkfirst=True)
+    search.ensure_index(engine)
+    print("✅ mails_archive table ready.")
+
+    # Dashboard counters: create the table and (re)build it from the mails
+    MailCounter.__table__.create(engine, checkfirst=True)
+    with Session(engine) as db:
+        drift = counters.reconcile(db)
+    print(f"✅ Dashboard counters rebuilt ({len(drift)} changed).")
+
+    # Event log: create the table and seed it from the mails the first time
+    MailEvent.__table__.create(engine, checkfirst=True)
+    with Session(engine) as db:
+        written = events.backfill(db)
+    print(f"✅ Mail events backfilled ({written} written).")
+
+    # Leases: which worker runs the notifier when there are several
+    JobLease.__table__.create(engine, checkfirst=True)
+    print("✅ job_leases table ready.")
+
+    # Response cache generations, so a write through one worker invalidates every worker's cache
+    CacheGeneration.__table__.create(engine, checkfirst=True)
+    print("✅ cache_generations table ready.")
+
+    # Upload jobs: which worker runs each one and when it last checked in, so jobs left
+    # behind by a crashed worker can be failed (app/jobs.py recover_jobs)
+    UploadJob.__table__.create(engine, checkfirst=True)
+    UploadJobError.__table__.create(engine, checkfirst=True)
+    with engine.connect() as conn:
+        for column, ddl in (("worker", "VARCHAR(64) NULL"), ("heartbeat_at", "DATETIME NULL")):
+            if not column_exists(conn, "upload_jobs", column):
+                conn.execute(text(f"ALTER TABLE upload_jobs ADD COLUMN {column} {ddl}"))
+                conn.commit()
+        existing = {i["name"] for i in inspect(conn).get_indexes("upload_jobs")}
+        for index in UploadJob.__table__.indexes:
+            if index.name not in existing:
+                index.create(conn)
+                conn.commit()
+    print("✅ upload_jobs ready.")
+
+    print("Migration completed!")
 
 if __name__ == "__main__":
     migrate_database()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+Rebuild the dashboard counters (mail_counters) from the mails table and report any drift.
+
+    python reconcile_counters.py            # report drift and fix it
+    python reconcile_counters.py --check    # report only; exit 1 if anything drifted
+"""
+
+import argparse
+import sys
+
+from app import counters
+from app.database import SessionLocal, engine
+from app.models import MailCounter
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    ap.add_argument("--check", action="store_true", help="don't rewrite the counters, just report drift")
+    args = ap.parse_args()
+
+    MailCounter.__table__.create(engine, checkfirst=True)
+    db = SessionLocal()
+    try:
+        drift = counters.reconcile(db, fix=not args.check)
+    finally:
+        db.close()
+
+    for key, values in drift.items():
+        print(f"⚠️ {key}: stored {values['stored']}, actual {values['actual']}")
+    if not drift:
+        print("✅ Counters match the mails table.")
+    elif not args.check:
+        print(f"✅ Rebuilt counters ({len(drift)} drifted).")
+    sys.exit(1 if drift and args.check else 0)
+
+
+if __name__ == "__main__":
+    main()